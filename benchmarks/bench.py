@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+# coding: utf-8
+# @ Author: "Chris Ward" <cward@redhat.com>
+
+"""
+Micro-benchmarks of the idid hot paths
+
+Usage: bench.py [--quick] [--filter TEXT] [--output FILE] [--compare FILE]
+
+Measures saving a logg (txt and git engines, into journals with 1, 1k
+and 100k loggs already), parsing each accepted date form, resolving
+each form of ``idid`` arguments and creating a Logg from a dict, file
+and string config. Everything runs offline, in a temporary directory.
+
+Results are written as JSON (to stdout, or --output FILE). With
+--compare FILE, the results are compared with those of another run
+(eg, of the previous commit) and the exit status is 1 if any got
+slower than --threshold (default 10%).
+"""
+
+from __future__ import unicode_literals, absolute_import, print_function
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+PATH = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(PATH, '..'))
+
+from idid import cli, logg, spool, utils  # noqa
+from idid.logg import Logg  # noqa
+
+# seconds each round of a benchmark runs for, at least
+MIN_TIME = 0.2
+ROUNDS = 5
+SIZES = [1, 1000, 100000]
+
+QUICK_MIN_TIME = 0.01
+QUICK_ROUNDS = 2
+QUICK_SIZES = [1, 100]
+
+CONFIG = """
+default_engine: txt://{path}/logg.txt
+default_journal: joy
+journals:
+    joy: {{}}
+    project_x: {{}}
+"""
+
+# (name, arguments) of each form of idid arguments; see LoggOptions._parse
+ARGUMENTS = [
+    ('none', []),
+    ('journal', ['joy']),
+    ('logg', ['did something']),
+    ('date-logg', ['2015-10-21', 'did something']),
+    ('date-journal', ['2015-10-21', 'joy']),
+    ('journal-logg', ['joy', 'did something']),
+    ('unquoted', ['did', 'something']),
+    ('date-journal-logg', ['2015-10-21', 'joy', 'did something']),
+    ('date-unquoted', ['2015-10-21', 'did', 'something', 'else']),
+    ('journal-unquoted', ['joy', 'did', 'something']),
+    ('unquoted-3', ['did', 'something', 'else']),
+]
+
+# (name, date) of each accepted date form; see utils.Date
+DATES = [
+    ('none', None),
+    ('today', 'today'),
+    ('yesterday', 'yesterday'),
+    ('iso-date', '2015-10-21'),
+    ('iso-datetime', '2015-10-21T07:28:00'),
+    ('iso-tz', '2015-10-21 07:28:00+02:00'),
+    ('words', 'Oct 21 2015'),
+    ('date', datetime.date(2015, 10, 21)),
+    ('datetime', datetime.datetime(2015, 10, 21, 7, 28)),
+    ('Date', utils.Date('2015-10-21')),
+]
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#  Timing
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def measure(fn, min_time=MIN_TIME, rounds=ROUNDS):
+    """ Time fn(); returns stats of the seconds per call """
+    timer = timeit.default_timer
+    # call fn often enough for each round to take at least min_time
+    number = 1
+    while True:
+        start = timer()
+        for _ in range(number):
+            fn()
+        elapsed = timer() - start
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed <= 0 else min(
+            10, max(2, int(min_time / elapsed) + 1))
+    times = [elapsed / number]
+    for _ in range(rounds - 1):
+        start = timer()
+        for _ in range(number):
+            fn()
+        times.append((timer() - start) / number)
+    times.sort()
+    return {
+        'min': times[0],
+        'median': times[len(times) // 2],
+        'max': times[-1],
+        'calls': number,
+        'rounds': rounds,
+    }
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#  Benchmarks
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+# Each benchmark generates (name, setup) pairs; setup() prepares what's
+# needed and returns the function to time. Only the benchmarks which
+# aren't filtered out are set up.
+
+def bench_logg_record(tmp, sizes):
+    """ Logg.logg_record() into journals of each size """
+    def setup(engine, size):
+        path = os.path.join(tmp, '{0}-{1}.{0}'.format(engine, size))
+        config = {'default_engine': '{0}://{1}'.format(engine, path),
+                  'journals': {'joy': {}}}
+        journal = Logg(config, 'joy')
+        if engine == 'git':
+            _fill_git(journal, size)
+        else:
+            journal.logg_records(_loggs(size))
+        return lambda: journal.logg_record('did something #bench')
+
+    for engine in ['txt', 'git']:
+        if engine not in logg.SUPPORTED_BACKENDS:
+            continue
+        for size in sizes:
+            yield 'logg_record/{0}/{1}'.format(engine, _size(size)), \
+                lambda engine=engine, size=size: setup(engine, size)
+
+
+def bench_date(tmp, sizes):
+    """ utils.Date() of each accepted form """
+    for name, date in DATES:
+        yield 'date/{0}'.format(name), \
+            lambda date=date: lambda: utils.Date(date)
+
+
+def bench_arguments(tmp, sizes):
+    """ LoggOptions._parse() of each form of arguments """
+    config = logg.load_config(CONFIG.format(path=tmp))
+    options = cli.LoggOptions([])
+    options.config = config
+    for name, arguments in ARGUMENTS:
+        yield 'arguments/{0}'.format(name), \
+            lambda arguments=arguments: lambda: options._parse(
+                argparse.Namespace(), list(arguments))
+
+
+def bench_logg_factory(tmp, sizes):
+    """ Logg() of a dict, file and string config """
+    string = CONFIG.format(path=tmp)
+    path = os.path.join(tmp, 'config.yaml')
+    with open(path, 'w') as config:
+        config.write(string)
+    data = {'default_engine': 'txt://{0}/logg.txt'.format(tmp),
+            'default_journal': 'joy',
+            'journals': {'joy': {}, 'project_x': {}}}
+
+    def uncached():
+        # parsed configs are cached in memory and on disk
+        logg._CONFIGS.clear()
+        Logg(path, 'joy')
+
+    yield 'logg_factory/dict', lambda: lambda: Logg(data, 'joy')
+    yield 'logg_factory/file', lambda: lambda: Logg(path, 'joy')
+    yield 'logg_factory/file-uncached', lambda: uncached
+    yield 'logg_factory/string', lambda: lambda: Logg(string, 'joy')
+
+
+BENCHMARKS = [bench_logg_record, bench_date, bench_arguments,
+              bench_logg_factory]
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#  Helpers
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def _size(size):
+    return '{0}k'.format(size // 1000) if size >= 1000 else str(size)
+
+
+def _loggs(size):
+    """ (date, record) of size loggs, a few a day """
+    start = datetime.date(2010, 1, 1)
+    for x in range(size):
+        date = start + datetime.timedelta(days=x // 10)
+        yield date.isoformat(), 'did thing {0} #tag{1}'.format(x, x % 50)
+
+
+def _fill_git(journal, size):
+    """ Add size loggs to a git journal the way ``idid import`` does """
+    journal.fast_import(
+        (None, date, record) for date, record in _loggs(size))
+
+
+def _commit():
+    """ The sha of the checked out idid commit, if known """
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=PATH,
+            stderr=open(os.devnull, 'w')).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(quick=False, only=None):
+    """ Run the benchmarks in a temporary directory; returns the results """
+    tmp = tempfile.mkdtemp(prefix='idid-bench-')
+    # keep away from the user's ~/.idid
+    dirs = utils.IDID_DIR, logg.CONFIG_CACHE_DIR, spool.SPOOL_DIR
+    utils.IDID_DIR = tmp
+    logg.CONFIG_CACHE_DIR = os.path.join(tmp, 'cache')
+    spool.SPOOL_DIR = os.path.join(tmp, 'spool')
+    for var, value in [('GIT_AUTHOR_NAME', 'idid'),
+                       ('GIT_AUTHOR_EMAIL', 'idid@localhost'),
+                       ('GIT_COMMITTER_NAME', 'idid'),
+                       ('GIT_COMMITTER_EMAIL', 'idid@localhost')]:
+        os.environ.setdefault(var, value)
+    min_time, rounds, sizes = (QUICK_MIN_TIME, QUICK_ROUNDS, QUICK_SIZES) \
+        if quick else (MIN_TIME, ROUNDS, SIZES)
+    results = {}
+    try:
+        for benchmark in BENCHMARKS:
+            for name, setup in benchmark(tmp, sizes):
+                if only and only not in name:
+                    continue
+                results[name] = measure(setup(), min_time, rounds)
+                print('{0:<32} {1:>12.1f} us'.format(
+                    name, results[name]['min'] * 1e6), file=sys.stderr)
+    finally:
+        utils.IDID_DIR, logg.CONFIG_CACHE_DIR, spool.SPOOL_DIR = dirs
+        shutil.rmtree(tmp)
+    return {
+        'commit': _commit(),
+        'date': datetime.datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'quick': quick,
+        'results': results,
+    }
+
+
+def compare(base, new, threshold):
+    """ Print how each result changed; returns the names of regressions """
+    slower = []
+    for name in sorted(new['results']):
+        if name not in base['results']:
+            continue
+        before = base['results'][name]['min']
+        after = new['results'][name]['min']
+        ratio = after / before if before else 1.0
+        flag = ''
+        if ratio > 1 + threshold:
+            slower.append(name)
+            flag = '  SLOWER'
+        elif ratio < 1 - threshold:
+            flag = '  faster'
+        print('{0:<32} {1:>12.1f} {2:>12.1f} us {3:>7.2f}x{4}'.format(
+            name, before * 1e6, after * 1e6, ratio, flag))
+    return slower
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(
+        description='Micro-benchmarks of the idid hot paths')
+    parser.add_argument(
+        '--quick', action='store_true',
+        help='Small journals and few rounds; checks the benchmarks work')
+    parser.add_argument(
+        '--filter', help='Only run benchmarks with TEXT in their name')
+    parser.add_argument('--output', help='Write the results to FILE')
+    parser.add_argument('--compare', help='Compare with the results in FILE')
+    parser.add_argument(
+        '--threshold', type=float, default=0.1,
+        help='Slowdown reported as a regression (default: 0.1)')
+    opts = parser.parse_args(arguments)
+
+    level = utils.log.level
+    utils.log.setLevel(logging.ERROR)
+    try:
+        results = run(opts.quick, opts.filter)
+    finally:
+        utils.log.setLevel(level)
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if opts.output:
+        with open(opts.output, 'w') as stdout:
+            stdout.write(output + '\n')
+    elif not opts.compare:
+        print(output)
+    if opts.compare:
+        with open(opts.compare) as stdin:
+            base = json.load(stdin)
+        return 1 if compare(base, results, opts.threshold) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
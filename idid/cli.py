@@ -14,21 +14,70 @@ Usage, for saving idid logg's::
     idid 2015-05-05T09:00:00 confs 'Attended PyCon CZ in Brno'
     idid 'something amazing today! #lifeisgreat'
 
-If a journal target is not specificed, 'master' will be used.
+If a journal target is not specificed, 'master' will be used. Loggs
+of journals named like a sub-command follow a ``--``::
+
+    idid -- report 'Sent the quarterly report'
+
+Usage, for status reports of the saved loggs::
+
+    idid report
+    idid report last month --brief
+    idid report --since 2015-01-01 --until 2015-03-31 --journal joy
+
+Usage, for looking up #tags and @mentions::
+
+    idid tags
+    idid tags release quarter
+    idid mentions @kejbaly2 last month
+
+Usage, for importing loggs into the git engines of their journals::
+
+    idid import old-loggs.txt
+    idid import --format jsonl --journal joy < joy.jsonl
+
+Usage, for exporting loggs to JSON Lines or CSV (eg, for a data
+warehouse); loggs are streamed, one at a time::
+
+    idid export > loggs.jsonl
+    idid export --format csv --since 2015-01-01 --journal joy
+    idid export last month --output loggs.csv --format csv
+
+Usage, for fetching and pushing git journals to their remotes::
+
+    idid sync
+    idid sync --journal joy --remote backup
+
+Usage, for keeping config and engines loaded in a daemon, which any
+later ``idid`` command is forwarded to (see idid.server)::
+
+    idid --serve &
+
+Usage, for seeing where the time of any command goes::
+
+    idid --profile joy 'did something'
+    idid --profile --profile-output profile.json report
+    idid --profile-stats idid.pstats sync
 
 """
 
 from __future__ import unicode_literals, absolute_import
 
+import io
+import json
 import os
 import sys
 import argparse
+from collections import OrderedDict
+import csv
+import itertools
 
-from configure import Configuration
 
 import idid.utils as utils
 from idid.utils import log
-from idid.logg import Logg, DT_ISO_FMT
+from idid.logg import LoggColumns, GitLogg, DT_ISO_FMT, LOGG_RE
+from idid.logg import load_config, load_config_file, pooled_logg
+from idid.profile import profiling, span, timed
 
 DEFAULT_IDID_CONFIG = os.path.expanduser('~/.idid/config.yaml')
 
@@ -37,6 +86,15 @@ DEFAULT_IDID_CONFIG = os.path.expanduser('~/.idid/config.yaml')
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 IDID_USAGE = "idid [today|DATE|...] [journal] '@mention, log record #hash #tag'"
+IMPORT_USAGE = "idid import [--format txt|jsonl] [--journal NAME] [FILE...]"
+REPORT_USAGE = "idid report [last] [week|month|...] [--journal NAME...]"
+TAGS_USAGE = "idid tags [TAG...] [last] [week|month|...] [--journal NAME...]"
+MENTIONS_USAGE = "idid mentions [NAME...] [last] [week|month|...]"
+SYNC_USAGE = "idid sync [--journal NAME...] [--remote NAME...]"
+EXPORT_USAGE = "idid export [--format jsonl|csv] [PERIOD] [--journal NAME...]"
+
+# columns of exported loggs
+EXPORT_FIELDS = ('journal', 'date', 'record', 'tags', 'mentions')
 
 
 class Options(object):
@@ -45,13 +103,15 @@ class Options(object):
     _config_file = None
     arguments = None
 
+    usage = IDID_USAGE
+
     def __init__(self, arguments=None):
         """ Prepare the shared [i]did argument parser """
-        self.parser = argparse.ArgumentParser(usage=IDID_USAGE)
+        self.parser = argparse.ArgumentParser(usage=self.usage)
         # if we don't pass args, we can assume we're calling this via CLI
         # so grab the args from sys.argv instead
-        self.arguments = arguments or sys.argv[1:]
-        log.debug(' ... arguments? {0}'.format(self.arguments))
+        self.arguments = sys.argv[1:] if arguments is None else arguments
+        log.debug(' ... arguments? {0}', self.arguments)
 
         # Enable debugging output (even before options are parsed)
         if "--debug" in self.arguments:
@@ -71,14 +131,20 @@ class Options(object):
             "--quiet", action="store_true",
             help="Turn off all logging except errors; catch exceptions")
 
+        # profiling options are handled by main(); see add_profile_options()
+        add_profile_options(self.parser)
+
         # Add quiet, which overrides debug if both are issued
         self.parser.add_argument(
             "--config-file", type=str, default=DEFAULT_IDID_CONFIG,
             help="Customize the location of the idid yaml config file")
 
+    @timed('cli.parse')
     def parse(self, arguments=None):
         """ Parse the shared [i]did arguments """
-        arguments = self.arguments or arguments
+        # sub-commands pass [] for no arguments; that's not sys.argv
+        arguments = self.arguments if self.arguments is not None \
+            else arguments
         # FIXME: prep/normalize arguments in __init__
         # Split arguments if given as string and run the parser
         if isinstance(arguments, basestring):
@@ -97,7 +163,7 @@ class Options(object):
 
         if not opts.config_file:
             opts.config_file = os.path.expanduser(DEFAULT_IDID_CONFIG)
-        opts.config = Configuration().from_file(opts.config_file)
+        opts.config = load_config_file(opts.config_file)
         # alias shortcut
         self.config = opts.config
 
@@ -136,12 +202,11 @@ class LoggOptions(Options):
         default_journal = self.config.get('default_journal')
         _journals = self.config.get('journals') or {}
 
-        log.debug(' ... got {0} args [{1}]'.format(k_args, args))
+        log.debug(' ... got {0} args [{1}]', k_args, args)
         if k_args == 0 and default_journal:
             # launch the editor to save a message into 'default' branch
             # FIXME: 'unsorted' should be configurable as 'default branch'
-            log.warn('Target branch not set, using "{0}"'.format(
-                default_journal))
+            log.warn('Target branch not set, using "{0}"', default_journal)
             journal, logg = default_journal, '--'
 
         elif k_args == 1:
@@ -227,12 +292,190 @@ class LoggOptions(Options):
         opts.date = _dt or utils.Date('today', fmt=DT_ISO_FMT)
         opts.journal = journal
         opts.logg = logg
-        log.debug(' Found Date: {0}'.format(_dt))
-        log.debug(' Found Target: {0}'.format(journal))
-        log.debug(' Found Logg: {0}'.format(logg))
+        log.debug(' Found Date: {0}', _dt)
+        log.debug(' Found Target: {0}', journal)
+        log.debug(' Found Logg: {0}', logg)
+        return opts
+
+
+class ImportOptions(Options):
+    """ ``idid import`` command line arguments parser """
+
+    usage = IMPORT_USAGE
+
+    def __init__(self, arguments=None):
+        super(ImportOptions, self).__init__(arguments)
+        self.parser.add_argument(
+            "--format", choices=['txt', 'jsonl'], default=None,
+            help="Format of the imported files (default: by extension)")
+        self.parser.add_argument(
+            "--journal", type=str, default=None,
+            help="Import all loggs into this journal")
+
+    def _parse(self, opts, args):
+        """ Remaining arguments are the files to import """
+        opts.paths = args or ['-']
+        # loggs of the files without a journal go to the default journal
+        opts.target = opts.journal or self.config.get('default_journal')
+        log.debug(' Found Paths: {0}', opts.paths)
+        log.debug(' Found Target: {0}', opts.target)
+        return opts
+
+
+class SyncOptions(Options):
+    """ ``idid sync`` command line arguments parser """
+
+    usage = SYNC_USAGE
+
+    def __init__(self, arguments=None):
+        super(SyncOptions, self).__init__(arguments)
+        self.parser.add_argument(
+            "--journal", action="append", default=None,
+            help="Journal to sync; may be used multiple times")
+        self.parser.add_argument(
+            "--remote", action="append", default=None,
+            help="Sync only with this remote; may be used multiple times")
+
+    def _parse(self, opts, args):
+        """ Remaining arguments are journals too """
+        # all the configured journals, unless given
+        opts.journals = (opts.journal or []) + args
+        log.debug(' Found Journals: {0}', opts.journals)
         return opts
 
 
+class PeriodOptions(Options):
+    """ Arguments parser of commands reading the loggs of a period """
+
+    # without a period, read this week's loggs
+    all_time = False
+
+    def __init__(self, arguments=None):
+        super(PeriodOptions, self).__init__(arguments)
+        self.parser.add_argument(
+            "--since", type=str, default=None,
+            help="Read loggs since this date (inclusive)")
+        self.parser.add_argument(
+            "--until", type=str, default=None,
+            help="Read loggs until this date (inclusive)")
+        self.parser.add_argument(
+            "--journal", action="append", default=None,
+            help="Journal to read; may be used multiple times")
+
+    def _parse(self, opts, args):
+        """ Remaining arguments define the period """
+        if args or not self.all_time:
+            since, until, period = utils.Date.period(args)
+        else:
+            since, until, period = None, None, 'all time'
+        if opts.since or opts.until:
+            period = 'custom period'
+        opts.since = utils.Date(opts.since) if opts.since else since
+        opts.until = utils.Date(opts.until) if opts.until else until
+        opts.period = period
+        opts.journals = opts.journal or sorted(
+            self.config.get('journals') or {})
+        log.debug(' Found Period: {0} [{1}, {2}]',
+                  period, opts.since, opts.until)
+        log.debug(' Found Journals: {0}', opts.journals)
+        return opts
+
+
+class ReportOptions(PeriodOptions):
+    """ ``idid report`` command line arguments parser """
+
+    usage = REPORT_USAGE
+
+    def __init__(self, arguments=None):
+        super(ReportOptions, self).__init__(arguments)
+        self.parser.add_argument(
+            "--brief", action="store_true",
+            help="Show journals only, not the individual loggs")
+        self.parser.add_argument(
+            "--format", choices=['text', 'wiki'], default='text',
+            help="Output style, possible values: text (default) or wiki")
+        self.parser.add_argument(
+            "--width", type=int, default=79,
+            help="Maximum width of the report output (default: 79)")
+
+
+class TagsOptions(ReportOptions):
+    """ ``idid tags`` command line arguments parser """
+
+    usage = TAGS_USAGE
+    sigil = '#'
+    # what's listed without any tags given
+    noun = 'Tags'
+    # without a period, report all loggs
+    all_time = True
+
+    def _parse(self, opts, args):
+        """ Period words define the period, the rest are the tags """
+        period = [arg for arg in args
+                  if arg.lower() in utils.PERIODS + ['last']]
+        opts.tags = [arg if arg[0] in '#@' else self.sigil + arg
+                     for arg in args if arg not in period]
+        log.debug(' Found Tags: {0}', opts.tags)
+        return super(TagsOptions, self)._parse(opts, period)
+
+
+class MentionsOptions(TagsOptions):
+    """ ``idid mentions`` command line arguments parser """
+
+    usage = MENTIONS_USAGE
+    sigil = '@'
+    noun = 'Mentions'
+
+
+class ExportOptions(PeriodOptions):
+    """ ``idid export`` command line arguments parser """
+
+    usage = EXPORT_USAGE
+    # without a period, export all loggs
+    all_time = True
+
+    def __init__(self, arguments=None):
+        super(ExportOptions, self).__init__(arguments)
+        self.parser.add_argument(
+            "--format", choices=sorted(EXPORTERS), default='jsonl',
+            help="Format of the exported loggs (default: jsonl)")
+        self.parser.add_argument(
+            "--output", type=str, default='-',
+            help="File to export the loggs to (default: stdout)")
+
+
+def read_loggs(paths, fmt=None, journal=None):
+    """
+    Generate (journal, date, record) triples from files to import
+
+    Accepts txt files as saved by the txt engine and JSON Lines with
+    ``journal``, ``date`` and ``record`` keys; '-' reads stdin. If
+    ``journal`` is given, it overrides the journal of every logg.
+    """
+    for path in paths:
+        _fmt = fmt or ('jsonl' if path.endswith(('.jsonl', '.json'))
+                       else 'txt')
+        if path == '-':
+            lines = (line.decode('utf-8') if isinstance(line, bytes)
+                     else line for line in sys.stdin)
+        else:
+            lines = io.open(path, encoding='utf-8')
+        for k, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line:
+                continue
+            if _fmt == 'jsonl':
+                logg = json.loads(line)
+            else:
+                logg = LOGG_RE.match(line)
+                if not logg:
+                    raise ValueError('Invalid logg [{0}:{1}]: {2}'.format(
+                        path, k, line))
+                logg = logg.groupdict()
+            yield (journal or logg.get('journal'), logg.get('date'),
+                   logg['record'])
+
+
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 #  Main
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -250,14 +493,297 @@ def main(arguments=None, config=None):
 
     Returns the saved logg string.
 
+    With ``--profile`` the time spent in each phase of the command is
+    shown when it's done.
+
     """
+    profile, arguments = split_profile_options(arguments)
+    if not (profile.profile or profile.profile_output or
+            profile.profile_stats):
+        return _main(arguments, config)
+    with profiling(profile.profile_output, profile.profile_stats):
+        return _main(arguments, config)
+
+
+def _main(arguments, config):
+    command, arguments = split_command(arguments)
+    if command:
+        return COMMANDS[command](arguments, config)
+
     # Parse options, initialize gathered stats
     options = LoggOptions(arguments=arguments).parse()
 
     # FIXME: pass in only config; set config.journal = options.journal
     if not config:
-        config = options.config_file
+        config = options.config
+
+    with pooled_logg(config, options.journal) as logg:
+        return logg.logg_record(options.logg, options.date)
+
+
+def import_loggs(arguments=None, config=None):
+    """
+    Import loggs from txt or JSON Lines files into git engines
 
-    logg = Logg(config, options.journal)
+    Each logg is imported into the engine of its journal, or of the
+    ``--journal`` all of them go to. Consecutive loggs of the same
+    engine are streamed through a single ``git fast-import``. Returns
+    the number of imported loggs.
+
+    """
+    options = ImportOptions(arguments=arguments).parse()
+    config = load_config(config or options.config)
+
+    # loggs without a journal go to the default journal
+    loggs = ((journal or options.target, date, record) for journal, date,
+             record in read_loggs(options.paths, options.format,
+                                  options.journal))
+    k_loggs = 0
+    for _, group in itertools.groupby(
+            loggs, lambda logg: _import_engine(config, logg[0])):
+        first = next(group)
+        with pooled_logg(config, first[0]) as logg:
+            if not isinstance(logg, GitLogg):
+                raise RuntimeError(
+                    "idid import requires a git engine for [{0}]".format(
+                        first[0]))
+            k_loggs += logg.fast_import(itertools.chain([first], group))
+    return k_loggs
+
+
+def _import_engine(config, journal):
+    """ Engine the loggs of the journal are imported into """
+    if not journal:
+        raise RuntimeError("No journal specified.")
+    if journal not in config['journals']:
+        raise RuntimeError("Unknown journal [{0}]".format(journal))
+    jconf = config['journals'][journal] or {}
+    return jconf.get('engine', config['default_engine'])
+
+
+def report(arguments=None, config=None):
+    """
+    Show a status report of the loggs saved in the given period
+
+    Loggs of each journal are grouped by day. Only a single journal's
+    loggs are held in memory at a time. Returns the number of loggs
+    reported.
+
+    """
+    options = ReportOptions(arguments=arguments).parse()
+    config = load_config(config or options.config)
+
+    utils.header('Status report for {0} ({1} to {2})'.format(
+        options.period, options.since, options.until))
+    k_loggs = 0
+    for journal in options.journals:
+        with span('report.read'), pooled_logg(config, journal) as logg:
+            loggs = LoggColumns(logg.iter_records(
+                options.since, options.until))
+            # sorting groups the loggs by day
+            loggs.sort()
+        if not loggs:
+            continue
+        desc = (config['journals'][journal] or {}).get('desc')
+        utils.item('{0} ({1})'.format(journal, desc) if desc else journal,
+                   level=0, options=options)
+        for logg in loggs:
+            summary = logg.record.splitlines()[0]
+            utils.item('{0} {1}'.format(logg.date, summary),
+                       level=1, options=options)
+        k_loggs += len(loggs)
+    return k_loggs
+
+
+def tags(arguments=None, config=None, options_class=TagsOptions):
+    """
+    Show the #tags used in the given period, or the loggs with them
 
-    return logg.logg_record(options.logg, options.date)
+    Without any tags given, all tags used in each journal are listed
+    with the number of loggs using them. Otherwise the loggs having all
+    the given tags are shown. Both are answered from the tag index.
+    Returns the number of tags or loggs shown.
+
+    """
+    options = options_class(arguments=arguments).parse()
+    config = load_config(config or options.config)
+
+    sigil = options_class.sigil
+    what = utils.listed(options.tags) or options_class.noun
+    utils.header('{0} for {1}'.format(what, options.period))
+    k_found = 0
+    for journal in options.journals:
+        with span('tags.read'), pooled_logg(config, journal) as logg:
+            found = _tagged(logg, options, sigil)
+        if not found:
+            continue
+        utils.item(journal, level=0, options=options)
+        for line in found:
+            utils.item(line, level=1, options=options)
+        k_found += len(found)
+    return k_found
+
+
+def _tagged(logg, options, sigil):
+    """ Lines listing the tags of the journal, or the loggs with them """
+    if options.tags:
+        # look up the first tag, then filter by the others
+        _tags = set(tag.lower() for tag in options.tags)
+        return [
+            '{0} {1}'.format(_logg.date, _logg.record.splitlines()[0])
+            for _logg in logg.iter_tagged(
+                options.tags[0], options.since, options.until)
+            if _tags <= set(tag.lower() for tag in _logg.tags)]
+    return ['{0} ({1})'.format(tag, k_loggs)
+            for tag, k_loggs in logg.tags(
+                sigil, options.since, options.until)]
+
+
+def mentions(arguments=None, config=None):
+    """ Show the @mentions used in the given period, or loggs with them """
+    return tags(arguments, config, options_class=MentionsOptions)
+
+
+def export_loggs(arguments=None, config=None):
+    """
+    Export the loggs of the given period as JSON Lines or CSV
+
+    Loggs are streamed from the engines to the output one at a time, so
+    memory use doesn't depend on the size of the journals. Journals are
+    exported one after another, each in the order its engine reads it
+    (see Logg.iter_records). JSON Lines exports can be imported back
+    with ``idid import``. Returns the number of exported loggs.
+
+    """
+    options = ExportOptions(arguments=arguments).parse()
+    config = load_config(config or options.config)
+
+    rows = _export_rows(config, options)
+    export = EXPORTERS[options.format]
+    if options.output == '-':
+        return export(rows, sys.stdout)
+    with open(options.output, 'wb') as output:
+        k_loggs = export(rows, output)
+    log.info('Exported {0} loggs to {1}', k_loggs, options.output)
+    return k_loggs
+
+
+def _export_rows(config, options):
+    """ Generate the exported loggs as tuples of EXPORT_FIELDS """
+    for journal in options.journals:
+        with span('export.read'), pooled_logg(config, journal) as logg:
+            for _logg in logg.iter_records(options.since, options.until):
+                yield (_logg.journal, unicode(_logg.date), _logg.record,
+                       [tag for tag in _logg.tags if tag[0] == '#'],
+                       [tag for tag in _logg.tags if tag[0] == '@'])
+
+
+def _export_jsonl(rows, output):
+    """ Write a JSON object per logg """
+    k_rows = 0
+    for row in rows:
+        output.write(json.dumps(OrderedDict(zip(EXPORT_FIELDS, row))))
+        output.write(b'\n')
+        k_rows += 1
+    return k_rows
+
+
+def _export_csv(rows, output):
+    """ Write a header and a CSV row per logg; tags separated by spaces """
+    writer = csv.writer(output)
+    writer.writerow([field.encode('utf-8') for field in EXPORT_FIELDS])
+    k_rows = 0
+    for row in rows:
+        # the csv module of python 2 only writes bytes
+        writer.writerow([
+            (' '.join(value) if isinstance(value, list) else value).encode(
+                'utf-8') for value in row])
+        k_rows += 1
+    return k_rows
+
+
+EXPORTERS = {
+    'jsonl': _export_jsonl,
+    'csv': _export_csv,
+}
+
+
+def sync(arguments=None, config=None):
+    """
+    Fetch and push the git journals from and to their remotes
+
+    Each engine repo and ref namespace is synced once, however many of
+    the given journals it holds. Returns the number of repos synced.
+
+    """
+    options = SyncOptions(arguments=arguments).parse()
+    config = load_config(config or options.config)
+
+    synced = set()
+    for journal in options.journals or sorted(config.get('journals') or {}):
+        with pooled_logg(config, journal) as logg:
+            if not isinstance(logg, GitLogg):
+                log.debug('Journal [{0}] is not a git journal', journal)
+                continue
+            key = (logg._engine_path, logg._ref_namespace())
+            remotes = dict(
+                (name, url) for name, url in logg._remotes().items()
+                if not options.remote or name in options.remote)
+            if key in synced or not remotes:
+                continue
+            names = logg.sync(remotes)
+            utils.eprint('Synced {0} with {1}'.format(
+                logg._journal_engine, utils.listed(names)))
+            synced.add(key)
+    return len(synced)
+
+
+# sub-commands; anything else is considered to be a logg
+COMMANDS = {
+    'export': export_loggs,
+    'import': import_loggs,
+    'mentions': mentions,
+    'report': report,
+    'sync': sync,
+    'tags': tags,
+}
+
+
+def add_profile_options(parser):
+    """ Add the --profile options to an argument parser """
+    parser.add_argument(
+        "--profile", action="store_true",
+        help="Show the time spent in each phase of the command")
+    parser.add_argument(
+        "--profile-output", metavar="FILE",
+        help="Save the time spent in each phase as JSON to FILE")
+    parser.add_argument(
+        "--profile-stats", metavar="FILE",
+        help="Run the command with cProfile and dump its stats to FILE")
+
+
+def split_profile_options(arguments=None):
+    """ Split the --profile options off the arguments """
+    arguments = sys.argv[1:] if arguments is None else arguments
+    if isinstance(arguments, basestring):
+        arguments = utils.split(arguments)
+    parser = argparse.ArgumentParser(add_help=False)
+    add_profile_options(parser)
+    return parser.parse_known_args(arguments)
+
+
+def split_command(arguments=None):
+    """
+    Split off the sub-command name, if any, from the arguments
+
+    A leading '--' is split off instead, so the rest is a logg even if
+    its journal is named like a sub-command.
+    """
+    arguments = sys.argv[1:] if arguments is None else arguments
+    if isinstance(arguments, basestring):
+        arguments = utils.split(arguments)
+    if arguments and arguments[0] == '--':
+        return None, arguments[1:]
+    if arguments and arguments[0] in COMMANDS:
+        return arguments[0], arguments[1:]
+    return None, arguments
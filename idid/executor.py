@@ -0,0 +1,188 @@
+# coding: utf-8
+# @ Author: "Chris Ward" <cward@redhat.com>
+
+""" Bounded thread pool running idid work in the background """
+
+from __future__ import unicode_literals, absolute_import
+
+from collections import deque
+import Queue
+import sys
+import threading
+
+from idid.utils import log
+
+"""
+Executor
+--------
+A fixed number of worker threads runs the submitted calls, so hundreds
+of concurrent requests don't mean hundreds of threads. Calls submitted
+with the same ``key`` form a strand: they run one at a time, in the
+order submitted, while calls of other keys run in parallel. Each call
+returns a Future to wait on.
+"""
+
+DEFAULT_MAX_WORKERS = 8
+
+
+class Timeout(RuntimeError):
+    """ The call didn't finish in time """
+
+
+class Future(object):
+    """ The result of a call, once it's done """
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """ Wait for the call and return its result, or raise its error """
+        self._wait(timeout)
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        """ Wait for the call and return its error, if any """
+        self._wait(timeout)
+        return self._exc_info[1] if self._exc_info else None
+
+    def add_done_callback(self, callback):
+        """ Call callback(future) once done; right away if it already is """
+        with self._lock:
+            if not self.done():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exc_info(self, exc_info):
+        self._exc_info = exc_info
+        self._finish()
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as err:
+                log.error('Future callback failed: {0}', err)
+
+    def _wait(self, timeout):
+        # Event.wait() without a timeout can't be interrupted in python 2
+        if not self._done.wait(timeout if timeout is not None else 1e9):
+            raise Timeout('Timed out after {0}s'.format(timeout))
+
+
+class Executor(object):
+    """ Run calls on a bounded pool of worker threads """
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS):
+        self.max_workers = max_workers
+        self._queue = Queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = []
+        # pending calls of busy keys; {key: deque([(future, call)])}
+        self._strands = {}
+
+    def submit(self, fn, *args, **kwargs):
+        """ Run fn(*args, **kwargs) in the pool; returns a Future """
+        return self.submit_ordered(None, fn, *args, **kwargs)
+
+    def submit_ordered(self, key, fn, *args, **kwargs):
+        """ Like submit(), but calls of the same key run one by one """
+        future = Future()
+        task = (future, lambda: fn(*args, **kwargs))
+        with self._lock:
+            self._start()
+            if key is None:
+                self._queue.put(task)
+            elif key in self._strands:
+                self._strands[key].append(task)
+            else:
+                self._strands[key] = deque([task])
+                self._queue.put(self._strand_task(key))
+        return future
+
+    def shutdown(self, wait=True):
+        """ Stop the workers once the queued calls are done """
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def _start(self):
+        """ Start the workers on first use """
+        while len(self._threads) < self.max_workers:
+            thread = threading.Thread(
+                target=self._work, name='idid-executor-{0}'.format(
+                    len(self._threads)))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _strand_task(self, key):
+        """ Task running the next call of key, then queueing the rest """
+        def run():
+            with self._lock:
+                future, call = self._strands[key].popleft()
+            _run(future, call)
+            with self._lock:
+                if self._strands[key]:
+                    self._queue.put(self._strand_task(key))
+                else:
+                    del self._strands[key]
+        return (None, run)
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                break
+            future, call = task
+            if future is None:
+                # strands take care of their own futures
+                call()
+            else:
+                _run(future, call)
+
+
+def _run(future, call):
+    try:
+        result = call()
+    except BaseException:
+        future.set_exc_info(sys.exc_info())
+    else:
+        future.set_result(result)
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def shared_executor(name):
+    """ The process wide executor of the given name """
+    with _executors_lock:
+        if name not in _executors:
+            _executors[name] = Executor()
+    return _executors[name]
+
+
+def default_executor():
+    """ The executor shared by everything not given its own """
+    return shared_executor('default')
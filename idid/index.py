@@ -0,0 +1,500 @@
+# coding: utf-8
+# @ Author: "Chris Ward" <cward@redhat.com>
+
+""" Sidecar indexes for idid logg engines """
+
+from __future__ import unicode_literals, absolute_import
+
+from array import array
+import bisect
+from contextlib import contextmanager
+import datetime
+import fcntl
+import heapq
+import io
+import os
+import stat
+import struct
+import tempfile
+import zlib
+
+from idid.utils import log, LazyModule
+
+sqlite3 = LazyModule('sqlite3')
+
+"""
+TxtIndex
+--------
+The txt engine is a plain append-only file, so finding the loggs of a
+given week means scanning the whole file. ``TxtIndex`` keeps a binary
+file next to it (``<engine path>.idx``) which maps the date and journal
+of every logg to its byte offset::
+
+    header: magic, k sorted entries, indexed data size, inode, tail crc
+    sorted: entries ordered by (date, offset)
+    tail:   entries appended since the last compaction, unordered
+
+Loggs are appended out of date order (``idid yesterday ...``), so new
+entries go to the unordered tail first. Once the tail grows over
+``COMPACT_AFTER`` entries it's sorted and merged into the sorted
+section, streaming, without loading the whole index into memory.
+
+TagIndex
+--------
+An inverted index of the #tags and @mentions of each journal, kept in
+a small sqlite database next to the engine. Every (journal, token) row
+holds the sorted postings of the loggs containing the token, packed
+into an ``array('q')`` of ``day << 40 | location`` keys, where the
+location is the byte offset of the logg (txt) or the first 40 bits of
+its commit sha (git). Sorting by key sorts the postings by date, so a
+date window is a binary search away.
+"""
+
+# postings keep the location in the lower 40 bits
+LOCATION_BITS = 40
+LOCATION_MASK = (1 << LOCATION_BITS) - 1
+
+# 64 bit postings; python 2 has no 'q' arrays, but 'l' is 64 bit on LP64
+try:
+    POSTING_TYPE = array(str('q')).typecode
+except ValueError:
+    POSTING_TYPE = str('l')
+
+
+def _day(date):
+    """ 'YYYY-MM-DD' -> proleptic ordinal of the day """
+    return datetime.date(
+        int(date[0:4]), int(date[5:7]), int(date[8:10])).toordinal()
+
+
+def posting(date, location):
+    """ Posting key of a logg dated 'YYYY-MM-DD' found at location """
+    return _day(date) << LOCATION_BITS | location
+
+
+def _window(since=None, until=None):
+    """ [low, high) posting keys of the loggs dated within [since, until] """
+    low = _day(since) << LOCATION_BITS if since else 0
+    high = (_day(until) + 1) << LOCATION_BITS if until else 1 << 63
+    return low, high
+
+
+def _journal_key(journal):
+    """ Compact (non unique!) key of the journal name """
+    return zlib.crc32(journal.encode('utf-8')) & 0xffffffff
+
+
+class TxtIndex(object):
+    """ Date/journal -> byte offset index of a txt engine file """
+
+    MAGIC = b'IDIDX001'
+    # magic, k sorted entries, indexed data size, data inode, tail crc
+    HEADER = struct.Struct(b'<8sQQQI4x')
+    # (day << LOCATION_BITS | offset), journal key
+    ENTRY = struct.Struct(b'<QI')
+    # unordered entries kept before merging them into the sorted ones
+    COMPACT_AFTER = 4096
+    # entries sorted in memory per run while rebuilding from scratch
+    RUN_SIZE = 1 << 20
+    # bytes of data the tail crc is computed from
+    CRC_SIZE = 64
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = '{0}.idx'.format(path)
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    #  Update
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def sync(self):
+        """ Index whatever was appended to the data since the last sync """
+        with self._lock():
+            self._sync()
+
+    def rebuild(self):
+        """ Build the index from scratch """
+        with self._lock():
+            self._rebuild()
+
+    def compact(self):
+        """ Merge the unordered tail into the sorted entries """
+        with self._lock():
+            self._compact()
+
+    @contextmanager
+    def _lock(self):
+        """
+        Hold the exclusive lock of the data file
+
+        Logg writers take the same lock, so the index is updated by one
+        process at a time and never sees a logg half written.
+        """
+        try:
+            data = open(self.path, 'rb')
+        except IOError:
+            # nothing to index (yet)
+            yield
+            return
+        with data:
+            fcntl.flock(data, fcntl.LOCK_EX)
+            yield
+
+    def _sync(self):
+        if not os.path.exists(self.path):
+            return
+        if not os.path.exists(self.index_path):
+            return self._rebuild()
+
+        with open(self.index_path, 'r+b') as index:
+            header = self._read_header(index)
+            if not header or not self._is_valid(header):
+                log.debug('Stale index [{0}]; rebuilding', self.index_path)
+                index.close()
+                return self._rebuild()
+            k_sorted, indexed = header[1], header[2]
+
+            entries, end = self._scan(indexed)
+            if end == indexed:
+                return
+            indexed = end
+            index.seek(0, os.SEEK_END)
+            index.write(b''.join(self.ENTRY.pack(*e) for e in entries))
+            self._write_header(index, k_sorted, indexed)
+            k_tail = self._k_entries(index) - k_sorted
+
+        if k_tail > self.COMPACT_AFTER:
+            self._compact()
+
+    def _rebuild(self):
+        log.debug('Building index [{0}]', self.index_path)
+        runs = []
+        entries = []
+        indexed = 0
+        try:
+            # sort the entries in runs, merge the runs at the end
+            for entry, indexed in self._iter_entries(0):
+                if entry is None:
+                    continue
+                entries.append(entry)
+                if len(entries) >= self.RUN_SIZE:
+                    runs.append(self._write_run(entries))
+                    entries = []
+            entries.sort()
+            self._write_merged(
+                [self._iter_run(run) for run in runs] + [entries], indexed)
+        finally:
+            for run in runs:
+                os.remove(run)
+
+    def _compact(self):
+        with open(self.index_path, 'rb') as index:
+            header = self._read_header(index)
+            k_entries = self._k_entries(index)
+            index.seek(self._offset(header[1]))
+            tail = sorted(self._read_entries(index, k_entries - header[1]))
+            # the new index is written aside and moved over the old one
+            self._write_merged(
+                [self._iter_sorted(index, header[1]), tail], header[2])
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    #  Query
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def query(self, since=None, until=None, journal=None):
+        """
+        Generate byte offsets of loggs dated within [since, until]
+
+        since and until are 'YYYY-MM-DD' strings (both optional and
+        inclusive). Offsets are generated in date order. As journal keys
+        aren't unique, the caller should still check the journal of
+        the logg found at each offset.
+        """
+        low, high = _window(since, until)
+        key = _journal_key(journal) if journal else None
+
+        with self._lock():
+            self._sync()
+            if not os.path.exists(self.index_path):
+                return
+            index = open(self.index_path, 'rb')
+            header = self._read_header(index)
+            k_sorted = header[1]
+            k_entries = self._k_entries(index)
+            # the tail is small, filter it in memory
+            index.seek(self._offset(k_sorted))
+            tail = sorted(e for e in self._read_entries(
+                index, k_entries - k_sorted) if low <= e[0] < high)
+        # the sorted entries are only ever replaced by a rename, so
+        # they're read without holding up the writers
+        with index:
+            # binary search the first sorted entry of the window
+            first = self._bisect(index, k_sorted, low)
+            window = self._iter_window(index, first, k_sorted, high)
+            for entry in heapq.merge(window, tail):
+                if key is None or entry[1] == key:
+                    yield entry[0] & LOCATION_MASK
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    #  Helpers
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def _iter_entries(self, start):
+        """ Generate (entry, end offset) for each complete line """
+        # imported here to avoid circular imports
+        from idid.logg import LOGG_RE
+        with open(self.path, 'rb') as data:
+            data.seek(start)
+            offset = start
+            for line in data:
+                if not line.endswith(b'\n'):
+                    # partially written logg; index it next time
+                    break
+                end = offset + len(line)
+                logg = LOGG_RE.match(line.decode('utf-8').rstrip('\n'))
+                entry = None
+                if logg:
+                    try:
+                        day = _day(logg.group('date'))
+                    except ValueError:
+                        # hand edited or foreign line; not a logg
+                        log.debug('Skipping logg with invalid date at {0}',
+                                  offset)
+                        day = None
+                    if day is not None:
+                        key = _journal_key(logg.group('journal'))
+                        entry = (day << LOCATION_BITS | offset, key)
+                yield entry, end
+                offset = end
+
+    def _scan(self, start):
+        """ Entries of the loggs appended after start and the new end """
+        entries = []
+        end = start
+        for entry, end in self._iter_entries(start):
+            if entry is not None:
+                entries.append(entry)
+        return entries, end
+
+    def _is_valid(self, header):
+        """ Make sure the index still belongs to the same data """
+        magic, k_sorted, indexed, inode, crc = header
+        stat = os.stat(self.path)
+        return (magic == self.MAGIC and inode == stat.st_ino and
+                indexed <= stat.st_size and crc == self._crc(indexed))
+
+    def _crc(self, indexed):
+        """ crc of the last indexed bytes of the data """
+        with open(self.path, 'rb') as data:
+            start = max(0, indexed - self.CRC_SIZE)
+            data.seek(start)
+            return zlib.crc32(data.read(indexed - start)) & 0xffffffff
+
+    def _read_header(self, index):
+        index.seek(0)
+        header = index.read(self.HEADER.size)
+        if len(header) != self.HEADER.size:
+            return None
+        return self.HEADER.unpack(header)
+
+    def _write_header(self, index, k_sorted, indexed):
+        index.seek(0)
+        index.write(self.HEADER.pack(
+            self.MAGIC, k_sorted, indexed, os.stat(self.path).st_ino,
+            self._crc(indexed)))
+
+    def _k_entries(self, index):
+        index.seek(0, os.SEEK_END)
+        return (index.tell() - self.HEADER.size) // self.ENTRY.size
+
+    def _offset(self, k):
+        return self.HEADER.size + k * self.ENTRY.size
+
+    def _read_entries(self, index, k):
+        """ Read k entries from the current position """
+        size = self.ENTRY.size
+        while k > 0:
+            chunk = min(k, 4096)
+            buf = index.read(chunk * size)
+            for i in range(0, len(buf) - size + 1, size):
+                yield self.ENTRY.unpack_from(buf, i)
+            k -= chunk
+
+    def _iter_sorted(self, index, k_sorted):
+        """ Generate the sorted entries of index """
+        index.seek(self._offset(0))
+        for entry in self._read_entries(index, k_sorted):
+            yield entry
+
+    def _bisect(self, index, k_sorted, low):
+        """ Number of the first sorted entry >= low """
+        lo, hi = 0, k_sorted
+        while lo < hi:
+            mid = (lo + hi) // 2
+            index.seek(self._offset(mid))
+            if self.ENTRY.unpack(index.read(self.ENTRY.size))[0] < low:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _iter_window(self, index, first, k_sorted, high):
+        """ Generate the sorted entries from first until high """
+        index.seek(self._offset(first))
+        for entry in self._read_entries(index, k_sorted - first):
+            if entry[0] >= high:
+                break
+            yield entry
+
+    def _write_run(self, entries):
+        """ Sort and save a run of entries to a temporary file """
+        entries.sort()
+        fd, path = tempfile.mkstemp(
+            prefix='.idx-', dir=os.path.dirname(self.index_path) or '.')
+        with io.open(fd, 'wb') as run:
+            run.write(b''.join(self.ENTRY.pack(*e) for e in entries))
+        return path
+
+    def _iter_run(self, path):
+        with open(path, 'rb') as run:
+            for entry in self._read_entries(run, os.path.getsize(path) //
+                                            self.ENTRY.size):
+                yield entry
+
+    def _write_merged(self, runs, indexed):
+        """ Merge sorted runs into a new, fully sorted index """
+        fd, path = tempfile.mkstemp(
+            prefix='.idx-', dir=os.path.dirname(self.index_path) or '.')
+        k_sorted = 0
+        with io.open(fd, 'w+b') as index:
+            index.write(b'\0' * self.HEADER.size)
+            buf = []
+            for entry in heapq.merge(*runs):
+                buf.append(self.ENTRY.pack(*entry))
+                if len(buf) >= 4096:
+                    index.write(b''.join(buf))
+                    buf = []
+                k_sorted += 1
+            index.write(b''.join(buf))
+            self._write_header(index, k_sorted, indexed)
+        # mkstemp files are private; share the index like the data
+        os.chmod(path, stat.S_IMODE(os.stat(self.path).st_mode))
+        os.rename(path, self.index_path)
+
+
+class TagIndex(object):
+    """ Inverted index of #tags and @mentions to logg postings """
+
+    # postings are merged into the db once this many are pending
+    BATCH_SIZE = 100000
+    # seconds to wait for another process' transaction
+    TIMEOUT = 30
+
+    def __init__(self, path):
+        self.path = path
+
+    def _connect(self):
+        # concurrent writers wait for each other's transactions
+        db = sqlite3.connect(self.path, timeout=self.TIMEOUT)
+        # the index can always be rebuilt; don't wait for the disk
+        db.execute('PRAGMA synchronous=OFF')
+        db.execute(
+            'CREATE TABLE IF NOT EXISTS postings ('
+            'journal TEXT, token TEXT, data BLOB, '
+            'PRIMARY KEY (journal, token))')
+        return db
+
+    @staticmethod
+    def token(token):
+        """ Tokens are case insensitive """
+        return token.lower()
+
+    def add(self, journal, postings):
+        """
+        Index (posting, tags) pairs of the journal's loggs
+
+        Postings are collected per token and merged into the stored
+        ones in batches, so bulk updates rewrite each token just once
+        per batch.
+        """
+        pending = {}
+        k_pending = 0
+        db = self._connect()
+        try:
+            for key, tags in postings:
+                for token in set(self.token(tag) for tag in tags):
+                    pending.setdefault(token, []).append(key)
+                    k_pending += 1
+                if k_pending >= self.BATCH_SIZE:
+                    self._merge(db, journal, pending)
+                    pending, k_pending = {}, 0
+            self._merge(db, journal, pending)
+        finally:
+            db.close()
+
+    def _merge(self, db, journal, pending):
+        with db:
+            for token, keys in pending.items():
+                postings = self._postings(db, journal, token)
+                for key in keys:
+                    i = bisect.bisect_left(postings, key)
+                    if i == len(postings) or postings[i] != key:
+                        postings.insert(i, key)
+                db.execute(
+                    'INSERT OR REPLACE INTO postings VALUES (?, ?, ?)',
+                    (journal, token, sqlite3.Binary(postings.tostring())))
+
+    @staticmethod
+    def _postings(db, journal, token):
+        postings = array(POSTING_TYPE)
+        row = db.execute(
+            'SELECT data FROM postings WHERE journal = ? AND token = ?',
+            (journal, token)).fetchone()
+        if row:
+            postings.fromstring(bytes(row[0]))
+        return postings
+
+    def clear(self, journal):
+        """ Forget everything indexed for the journal """
+        db = self._connect()
+        try:
+            with db:
+                db.execute('DELETE FROM postings WHERE journal = ?',
+                           (journal,))
+        finally:
+            db.close()
+
+    def query(self, journal, token, since=None, until=None):
+        """ Locations of the journal's loggs with token, in date order """
+        if not os.path.exists(self.path):
+            return []
+        low, high = _window(since, until)
+        db = self._connect()
+        try:
+            postings = self._postings(db, journal, self.token(token))
+        finally:
+            db.close()
+        first = bisect.bisect_left(postings, low)
+        last = bisect.bisect_left(postings, high)
+        return [key & LOCATION_MASK for key in postings[first:last]]
+
+    def tokens(self, journal, prefix='', since=None, until=None):
+        """ Generate (token, k loggs) of the journal's tokens by prefix """
+        if not os.path.exists(self.path):
+            return
+        low, high = _window(since, until)
+        db = self._connect()
+        try:
+            rows = db.execute(
+                'SELECT token, data FROM postings WHERE journal = ? '
+                'AND substr(token, 1, ?) = ? ORDER BY token',
+                (journal, len(prefix), prefix))
+            for token, data in rows:
+                postings = array(POSTING_TYPE)
+                postings.fromstring(bytes(data))
+                k_loggs = (bisect.bisect_left(postings, high) -
+                           bisect.bisect_left(postings, low))
+                if k_loggs:
+                    yield token, k_loggs
+        finally:
+            db.close()
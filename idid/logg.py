@@ -3,20 +3,36 @@
 
 from __future__ import unicode_literals, absolute_import
 
+from array import array
+from collections import namedtuple
+from contextlib import contextmanager
+import datetime
+import fcntl
+import hashlib
+import itertools
+import mmap
 import os
+import cPickle as pickle
+import random
 import re
-from subprocess import call
+from subprocess import call, PIPE
 import tempfile
+import threading
+import time
 
 from configure import Configuration, ConfigurationError
 
-from idid.utils import log, Date, today
+from idid.index import TxtIndex, TagIndex, posting, POSTING_TYPE
+from idid.pool import Pool
+from idid.profile import span, timed
+from idid.utils import log, Date, today, IDID_DIR, LazyModule, available
 
-try:
-    import git
-except ImportError:
+# GitPython is slow to import; only load it once a git engine is used
+git = LazyModule('git') if available('git') else None
+if not git:
     log.warn('GitPython not installed!')
-    git = None
+
+sqlite3 = LazyModule('sqlite3') if available('sqlite3') else None
 
 """ Logg, save and share your daily activities! """
 
@@ -30,13 +46,40 @@ Overview
   - journal (topic) are branches
   - loggs are commits
   - can be 'cloned' and shared
+ * sqlite database
+  - indexed by journal and date, full-text searchable
+  - concurrent readers while writing (WAL)
 """
 
 DT_ISO_FMT = "%Y-%m-%dT%H:%M:%S %z"
 DT_GIT_FMT = "%Y-%m-%dT%H:%M:%S"
 
+# git's well-known sha of the empty tree and of a 'missing' ref
+EMPTY_TREE_SHA = '4b825dc642cb6eb9a060e54bf8d69288fbee4904'
+NULL_SHA = '0' * 40
+# how many times to retry if a journal ref moved or was locked under us;
+# attempts back off exponentially, up to ~1s apart
+GIT_CAS_RETRIES = 10
+# journals are branches unless `ref_namespace` is configured
+DEFAULT_REF_NAMESPACE = 'refs/heads'
+# seconds to wait for each `sync_to` journal before moving on
+SYNC_TIMEOUT = 30
+# git dir file touched on every sync with the remotes
+SYNC_STAMP = 'idid-synced'
+# parsed config files are cached here, keyed by path, mtime and size
+CONFIG_CACHE_DIR = os.path.join(IDID_DIR, 'cache')
+# idle Logg's and git repos kept open for reuse by pooled_logg(); idle
+# Logg's don't hold a repo, so only the repos run cat-file processes
+LOGG_POOL_SIZE = 64
+REPO_POOL_SIZE = 16
+
 # Regex's
 URI_RE = re.compile('([\w]*)://(.*)')
+# parses loggs saved by the txt engine (see Logg._logg_format)
+LOGG_RE = re.compile(
+    r'^<(?P<journal>[^>]+)> \[(?P<date>[^\]]+)\]:: (?P<record>.*)$')
+# #tags and @mentions found in logg records
+TAGS_RE = re.compile(r'(?<![\w#@])([#@]\w+)', re.UNICODE)
 
 # only git backend supported; not sure why, but I think
 # we might want to extend to support other 'backends' somehow
@@ -44,6 +87,9 @@ SUPPORTED_BACKENDS = ['txt']
 if git:
     # only enable git backend if PythonGit is installed
     SUPPORTED_BACKENDS += ['git']
+if sqlite3:
+    # python can be built without sqlite support
+    SUPPORTED_BACKENDS += ['sqlite']
 
 LOGG_CONFIG_KEY = 'logg'
 
@@ -88,6 +134,12 @@ DEFAULT_LOGG_RECORD = """
         engine: git:///tmp/logg.git
         desc: Joy of the Day!
 
+    team:
+        engine: git:///srv/idid/loggs.git
+        bare: true
+        ref_namespace: refs/idid/cward
+        desc: Stored in a bare repo as refs/idid/cward/team
+
 
 Logg Record can for example contain (for later parsing)::
 
@@ -108,32 +160,208 @@ eg::
 
 # FIXME: invidual but related idids on a single line separated by semi-colon
 
+class LoggRecord(namedtuple('LoggRecord', 'journal date record tags')):
+    """ A single logg as read back from an engine
+
+    An immutable tuple; loggs sort by journal, date and record.
+    """
+    __slots__ = ()
+
+    @property
+    def day(self):
+        """ The logg's day as an ordinal, see Date.day """
+        return self.date.day
+
+
+class LoggColumns(object):
+    """
+    Column store for large sets of LoggRecord's
+
+    Instead of a tuple, Date and datetime per logg, loggs are kept in
+    parallel columns: an array of timestamps, an array of journal ids
+    (indexes into ``journals``, each journal name stored once) and a
+    list of records. Tags are extracted again when a logg is read
+    back. Sorting permutes the columns in place.
+    """
+    __slots__ = ('journals', 'journal_ids', 'timestamps', 'records', '_ids')
+
+    def __init__(self, loggs=()):
+        self.journals = []
+        self.journal_ids = array(str('I'))
+        self.timestamps = array(POSTING_TYPE)
+        self.records = []
+        self._ids = {}
+        self.extend(loggs)
+
+    def append(self, logg):
+        """ Add a LoggRecord """
+        journal_id = self._ids.get(logg.journal)
+        if journal_id is None:
+            journal_id = self._ids[logg.journal] = len(self.journals)
+            self.journals.append(logg.journal)
+        self.journal_ids.append(journal_id)
+        self.timestamps.append(logg.date.timestamp)
+        self.records.append(logg.record)
+
+    def extend(self, loggs):
+        """ Add an iterable of LoggRecord's """
+        for logg in loggs:
+            self.append(logg)
+
+    def sort(self):
+        """ Sort the loggs by date; loggs of the same date keep their order """
+        order = sorted(xrange(len(self)), key=self.timestamps.__getitem__)
+        ordered = self._take(order)
+        self.journal_ids = ordered.journal_ids
+        self.timestamps = ordered.timestamps
+        self.records = ordered.records
+
+    def groupby_journal(self):
+        """ Generate (journal, LoggColumns) of each journal, in order """
+        groups = {}
+        for index, journal_id in enumerate(self.journal_ids):
+            groups.setdefault(journal_id, []).append(index)
+        for journal_id in sorted(groups):
+            yield self.journals[journal_id], self._take(groups[journal_id])
+
+    def _take(self, indexes):
+        """ New LoggColumns with the loggs at indexes, in that order """
+        columns = LoggColumns()
+        columns.journals = list(self.journals)
+        columns._ids = dict(self._ids)
+        columns.journal_ids = array(
+            self.journal_ids.typecode, (self.journal_ids[i] for i in indexes))
+        columns.timestamps = array(
+            self.timestamps.typecode, (self.timestamps[i] for i in indexes))
+        columns.records = [self.records[i] for i in indexes]
+        return columns
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        record = self.records[index]
+        return LoggRecord(
+            self.journals[self.journal_ids[index]],
+            Date(datetime.datetime.utcfromtimestamp(self.timestamps[index])),
+            record, extract_tags(record))
+
+    def __iter__(self):
+        for index in xrange(len(self)):
+            yield self[index]
+
+
+def extract_tags(record):
+    """ Return the #tags and @mentions found in record, in order """
+    return tuple(TAGS_RE.findall(record))
+
+
+@timed('config.load')
+def load_config(config):
+    """ Load the config from a Configuration, dict, path or YAML string """
+    try:
+        if not config:
+            raise ConfigurationError("Config can't be null")
+        elif isinstance(config, Configuration):
+            pass
+        elif isinstance(config, dict):
+            config = Configuration.from_dict(config).configure()
+        elif isinstance(config, (str, unicode)):
+            if os.path.exists(config):
+                # config is a valid /existing path
+                config = load_config_file(config)
+            else:
+                # config is loaded as a simple string
+                with span('config.parse'):
+                    config = Configuration.from_string(config).configure()
+        else:
+            raise ConfigurationError(
+                'Failed to load config file [{0}]'.format(config))
+    except Exception as err:
+        raise ConfigurationError(err)
+    return config
+
+
+# parsed configs of this process; {path: (key, Configuration)}
+_CONFIGS = {}
+
+
+@timed('config.load_file')
+def load_config_file(path):
+    """ Load a YAML config file, parsing it only when it changed
+
+    The configured structure is kept in memory and pickled into
+    ``CONFIG_CACHE_DIR`` keyed by the file path, mtime and size, so
+    unchanged config files skip YAML parsing entirely. Files pulled in
+    with ``!include`` or ``!extends`` are not tracked.
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    key = (path, stat.st_mtime, stat.st_size)
+    cached = _CONFIGS.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    cache_path = _config_cache_path(path)
+    struct = _read_config_cache(cache_path, key)
+    if struct is None:
+        with span('config.parse'):
+            config = Configuration.from_file(path).configure()
+        _write_config_cache(cache_path, key, config)
+    else:
+        config = Configuration(struct, pwd=os.path.dirname(path))
+    _CONFIGS[path] = (key, config)
+    return config
+
+
+def _config_cache_path(path):
+    name = hashlib.sha1(path.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(CONFIG_CACHE_DIR, 'config-{0}.pickle'.format(name))
+
+
+def _read_config_cache(cache_path, key):
+    try:
+        with open(cache_path, 'rb') as cache:
+            _key, struct = pickle.load(cache)
+    except Exception:
+        return None
+    if _key != key:
+        log.debug('Config cache is stale: {0}', cache_path)
+        return None
+    log.debug('Loaded config from cache: {0}', cache_path)
+    return struct
+
+
+def _write_config_cache(cache_path, key, config):
+    try:
+        data = pickle.dumps((key, _plain(config)), pickle.HIGHEST_PROTOCOL)
+        if not os.path.exists(CONFIG_CACHE_DIR):
+            os.makedirs(CONFIG_CACHE_DIR)
+        # write then rename so concurrent readers never see half a file
+        fd, tmp = tempfile.mkstemp(dir=CONFIG_CACHE_DIR)
+        with os.fdopen(fd, 'wb') as cache:
+            cache.write(data)
+        os.rename(tmp, cache_path)
+    except Exception as err:
+        log.debug('Failed to cache config {0}: {1}', key[0], err)
+
+
+def _plain(config):
+    """ Unwrap the nested Configuration objects left by configure() """
+    if isinstance(config, Configuration):
+        return dict((k, _plain(v)) for k, v in config.iteritems())
+    elif isinstance(config, list):
+        return [_plain(v) for v in config]
+    return config
+
 
 class LoggFactory(type):
     """ Detect the type of backend based on the engine uri and
         return the backend expected class automatically
     """
+    @timed('logg.factory')
     def __call__(cls, config, journal):
-        try:
-            if not config:
-                raise ConfigurationError("Config can't be null")
-            elif isinstance(config, Configuration):
-                pass
-            elif isinstance(config, dict):
-                config = Configuration.from_dict(config).configure()
-            elif isinstance(config, (str, unicode)):
-                if os.path.exists(config):
-                    # config is a valid /existing path
-                    config = os.path.abspath(config)
-                    config = Configuration.from_file(config).configure()
-                else:
-                    # config is loaded as a simple string
-                    config = Configuration.from_string(config).configure()
-            else:
-                raise ConfigurationError(
-                    'Failed to load config file [{0}]'.format(config))
-        except Exception as err:
-            raise ConfigurationError(err)
+        config = load_config(config)
 
         if 'journals' not in config:
             # User tried using an unconfigured journal
@@ -151,6 +379,49 @@ class LoggFactory(type):
             return type.__call__(_cls, config, journal)
 
 
+@contextmanager
+def pooled_logg(config, journal):
+    """
+    Context of an open Logg of the journal, reused across calls
+
+    The Logg's of a process writing to many journals (the daemon, sync)
+    are kept in a bounded pool instead of loading their engines (git
+    repos, sqlite connections) over and over::
+
+        with pooled_logg(config, 'joy') as logg:
+            logg.logg_record('reused #pool', 'today')
+
+    A Logg is only used by one thread at a time. Once the pool is
+    full, the least recently used Logg's are closed. Idle git Logg's
+    give their repo back to the pool of repos (keyed by engine path),
+    so the journals of an engine share its repos and at most
+    ``REPO_POOL_SIZE`` idle repos keep their git processes running.
+    """
+    logg = acquire_logg(config, journal)
+    try:
+        yield logg
+    except BaseException:
+        logg.close()
+        raise
+    release_logg(logg)
+
+
+def acquire_logg(config, journal):
+    """ Take an open Logg of the journal out of the pool, or open one """
+    config = load_config(config)
+    logg = _loggs.acquire(_logg_key(config, journal), check=_fresh_logg)
+    if logg is None:
+        return Logg(config, journal)
+    logg._resume()
+    return logg
+
+
+def release_logg(logg):
+    """ Put a Logg taken with acquire_logg() back into the pool """
+    logg._suspend()
+    _loggs.release(_logg_key(logg.config, logg._journal), logg)
+
+
 class Logg(object):
     """ idid logg backend class for storing idid messages """
     __metaclass__ = LoggFactory
@@ -176,6 +447,19 @@ class Logg(object):
         self._engine_backend, self._engine_path = self._parse_engine(
             self._journal_engine)
 
+    def close(self):
+        """ Release the engine's resources; the Logg can't be used after """
+
+    def _stale(self):
+        """ True if the engine was removed or replaced since opened """
+        return False
+
+    def _suspend(self):
+        """ Release what an idle pooled Logg needn't hold """
+
+    def _resume(self):
+        """ Reacquire what _suspend() released """
+
     @staticmethod
     def _get_Logg_Type(config, journal):
         # Parse out the engine type
@@ -183,16 +467,16 @@ class Logg(object):
         if 'engine' not in jconf:
             engine = config['default_engine']
             log.debug(
-                'Engine not defined for Journal [{0}]. Using [{1}]'.format(
-                    journal, engine))
+                'Engine not defined for Journal [{0}]. Using [{1}]',
+                journal, engine)
         else:
             engine = jconf['engine']
-            log.debug('LoggFactory loading [{0}]...'.format(engine))
+            log.debug('LoggFactory loading [{0}]...', engine)
 
         backend, path = Logg._parse_engine(engine)
 
-        _cls = GitLogg if backend == 'git' else Logg
-        log.debug(' ... Loading Backend Class: {0}'.format(_cls))
+        _cls = {'git': GitLogg, 'sqlite': SqliteLogg}.get(backend, Logg)
+        log.debug(' ... Loading Backend Class: {0}', _cls)
         return _cls
 
     @staticmethod
@@ -204,44 +488,445 @@ class Logg(object):
         if backend not in SUPPORTED_BACKENDS:
             raise NotImplementedError(
                 "Logg supports only {0} for now.".format(SUPPORTED_BACKENDS))
-        log.debug('Found engine: {0}'.format(engine))
+        log.debug('Found engine: {0}', engine)
         return backend, path
 
+    @timed('logg.write')
     def logg_record(self, record, date=None):
+        record, date = self._prep_record(record, date)
+        # default format YYYY-MM-DD
+        log.debug('Saving idid Logg("{0}", "{1}", "{2}")',
+                  self._journal, record, date)
+        if record != '--' and self._journal_option('spool'):
+            # loggs written in the editor can't wait for later
+            self._spool_records([(record, date)])
+            return self._logg_format.format(
+                date=date, record=record, journal=self._journal)
+        # the spooled loggs go first
+        self.flush()
+        result = self._logg_record(record, date)
+        log.info('SUCCESS: \n{0}', result)
+        if record == '--':
+            if self._sync_targets():
+                log.warn("Loggs written in the editor aren't synced")
+        else:
+            self._sync([(record, date)])
+        return result
+
+    @timed('logg.write')
+    def logg_records(self, records):
+        """
+        Save an iterable of (date, record) pairs in a single transaction
+
+        Records are consumed lazily, so any iterable (eg, a generator
+        reading another tool's export) can be passed in. If the journal
+        has ``sync_to`` targets though, the records are kept in memory
+        to be mirrored once saved. Returns the number of records saved.
+        """
+        records = (self._prep_record(record, date) for date, record in records)
+        if self._journal_option('spool'):
+            return self._spool_records(list(records))
+        self.flush()
+        synced = []
+        if self._sync_targets():
+            records = _tee(records, synced)
+        k_records = self._logg_records(records)
+        log.info('SUCCESS: {0} records saved to [{1}]',
+                 k_records, self._journal)
+        self._sync(synced)
+        return k_records
+
+    @timed('spool.flush')
+    def flush(self):
+        """ Write the loggs waiting in the journal's spool """
+        k_records = self._spool.flush(self._logg_spooled)
+        if k_records:
+            log.info('Flushed {0} spooled records to [{1}]',
+                     k_records, self._journal)
+        return k_records
+
+    def retry_sync(self):
+        """ Write the spooled loggs of failed syncs; returns their number """
+        k_records = 0
+        for target in self._sync_targets():
+            k_records += self._sync_target(target)
+        return k_records
+
+    def iter_records(self, since=None, until=None, search=None):
+        """
+        Generate the journal's loggs as LoggRecord's, lazily
+
+        Only loggs dated within [since, until] (both inclusive, either
+        optional) and containing the search string, if given, are
+        generated. Records are read one at a time, so memory use doesn't
+        depend on the size of the journal. Indexed txt engines generate
+        loggs in date order, git engines newest commit first.
+        """
+        since = unicode(Date(since)) if since else None
+        until = unicode(Date(until)) if until else None
+        self.flush()
+        return self._iter_records(since, until, search)
+
+    def iter_tagged(self, tag, since=None, until=None):
+        """
+        Generate the journal's loggs with the #tag or @mention
+
+        The loggs are looked up in the tag index, in date order,
+        instead of scanning the whole journal.
+        """
+        since = unicode(Date(since)) if since else None
+        until = unicode(Date(until)) if until else None
+        tags = self._tags
+        if not tags:
+            raise RuntimeError('Tag index is disabled for [{0}]'.format(
+                self._journal))
+        self.flush()
+        locations = tags.query(self._journal, tag, since, until)
+        tag = TagIndex.token(tag)
+        for location, logg in self._iter_located(since, until, locations):
+            # postings may be stale; make sure the logg still matches
+            if tag in (TagIndex.token(t) for t in logg.tags):
+                yield logg
+
+    def tags(self, prefix='', since=None, until=None):
+        """ Generate (token, k loggs) for the journal's tags by prefix """
+        since = unicode(Date(since)) if since else None
+        until = unicode(Date(until)) if until else None
+        tags = self._tags
+        if not tags:
+            return iter([])
+        self.flush()
+        return tags.tokens(self._journal, prefix.lower(), since, until)
+
+    def rebuild_tags(self):
+        """ Rebuild the journal's tag index from all its loggs """
+        tags = self._tags
+        if not tags:
+            return
+        tags.clear(self._journal)
+        tags.add(self._journal, (
+            (posting(unicode(logg.date), location), logg.tags)
+            for location, logg in self._iter_located(None, None)
+            if logg.tags))
+
+    @timed('tags.index')
+    def _index_tags(self, postings):
+        """ Add (posting, tags) of newly saved loggs to the tag index """
+        tags = self._tags
+        if tags:
+            tags.add(self._journal, postings)
+
+    @property
+    def _tags(self):
+        """ Tag index of the engine, unless disabled """
+        if not self._journal_option('tags', default=True):
+            return None
+        return TagIndex(self._tags_path)
+
+    @property
+    def _tags_path(self):
+        return '{0}.tags'.format(self._engine_path)
+
+    def _iter_records(self, since, until, search=None):
+        return (logg for location, logg in self._iter_located(
+            since, until, search=search))
+
+    def _iter_located(self, since, until, offsets=None, search=None):
+        """
+        Scan the memory mapped txt engine for the journal's loggs
+
+        Generates (offset, LoggRecord) pairs. Logg boundaries, journal,
+        date and search string are all matched on the raw bytes of the
+        mapped file; only the loggs which pass are decoded. Without an
+        index, the scan jumps from one '<journal> [' header to the next
+        with mmap.find().
+        """
+        if not os.path.exists(self._engine_path):
+            return
+        index = self._index
+        if offsets is None and index:
+            offsets = index.query(since, until, self._journal)
+        with open(self._engine_path, 'rb') as stdin:
+            # map only complete loggs; writers hold an exclusive lock
+            fcntl.flock(stdin, fcntl.LOCK_SH)
+            size = os.fstat(stdin.fileno()).st_size
+            if not size:
+                # empty files can't be mapped
+                return
+            data = mmap.mmap(stdin.fileno(), size, access=mmap.ACCESS_READ)
+            fcntl.flock(stdin, fcntl.LOCK_UN)
+            try:
+                for located in self._scan(
+                        data, since, until, search, offsets):
+                    yield located
+            finally:
+                data.close()
+
+    def _scan(self, data, since, until, search=None, offsets=None):
+        """ Generate the (offset, logg) of matching loggs in data """
+        prefix = '<{0}> ['.format(self._journal).encode('utf-8')
+        k_prefix = len(prefix)
+        # YYYY-MM-DD dates compare fine as (ascii) bytes
+        since = since.encode('ascii') if since else None
+        until = until.encode('ascii') if until else None
+        search = search.encode('utf-8') if search else None
+        if offsets is None:
+            offsets = self._iter_offsets(data, prefix)
+
+        size = len(data)
+        for start in offsets:
+            if start >= size or data[start:start + k_prefix] != prefix:
+                continue
+            date = data[start + k_prefix:start + k_prefix + 10]
+            if (since and date < since) or (until and date > until):
+                continue
+            end = data.find(b'\n', start)
+            end = size if end < 0 else end
+            # '<journal> [YYYY-MM-DD]:: ' is k_prefix + 14 bytes long
+            if search and data.find(search, start + k_prefix + 14, end) < 0:
+                continue
+            logg = LOGG_RE.match(data[start:end].decode('utf-8'))
+            if not logg:
+                continue
+            try:
+                date = Date(logg.group('date'))
+            except ValueError:
+                log.debug('Skipping logg with invalid date at {0}', start)
+                continue
+            record = logg.group('record')
+            yield start, LoggRecord(
+                self._journal, date, record, extract_tags(record))
+
+    @staticmethod
+    def _iter_offsets(data, prefix):
+        """ Generate offsets of the lines starting with prefix """
+        if data[:len(prefix)] == prefix:
+            yield 0
+        needle = b'\n' + prefix
+        pos = data.find(needle)
+        while pos >= 0:
+            yield pos + 1
+            pos = data.find(needle, pos + 1)
+
+    @property
+    def _index(self):
+        """ Date offset index of the txt engine, unless disabled """
+        if not self._journal_option('index', default=True):
+            return None
+        return TxtIndex(self._engine_path)
+
+    # ~~~ spool mode ~~~
+    @property
+    def _spool(self):
+        """ Spool of the loggs waiting to be written to the journal """
+        from idid.spool import Spool
+        return Spool.for_journal(self._journal_engine, self._journal, 'write')
+
+    @timed('spool.append')
+    def _spool_records(self, records):
+        """ Spool (record, date) pairs and flush them in the background """
+        from idid.executor import shared_executor
+        spool = self._spool
+        spool.extend(records)
+        log.info('SPOOLED: {0} records for [{1}]', len(records), self._journal)
+        # flushed by a Logg of its own; loggs aren't shared across threads
+        config, journal = self.config, self._journal
+        future = shared_executor('spool').submit_ordered(
+            ('spool', spool.path), _flush, config, journal)
+        _flushing.add(future)
+        future.add_done_callback(self._flushed)
+        return len(records)
+
+    def _flushed(self, future):
+        _flushing.discard(future)
+        if future.exception():
+            log.warn('Failed to flush the spool of [{0}], will retry: '
+                     '{1}', self._journal, future.exception())
+
+    def _logg_spooled(self, records):
+        """ Write a batch of spooled (record, date) pairs """
+        self._logg_records(iter(records))
+        self._sync(records)
+
+    # ~~~ sync_to fan-out ~~~
+    def _sync_targets(self):
+        """ The journals configured to mirror this journal's loggs """
+        targets = self._journal_option('sync_to') or []
+        if isinstance(targets, basestring):
+            targets = [targets]
+        return [target for target in targets if target != self._journal]
+
+    @timed('sync_to')
+    def _sync(self, records):
+        """
+        Mirror saved (record, date) pairs to the `sync_to` journals
+
+        The loggs are spooled for each target first, then the targets'
+        spools are written concurrently on a thread pool; each is waited
+        for up to `sync_timeout` seconds. Loggs which fail to be written
+        in time (or at all) stay spooled and are written before the
+        target's next loggs, even if idid exits meanwhile.
+        """
+        targets = self._sync_targets()
+        if not records or not targets:
+            return
+        from idid.executor import shared_executor, Timeout
+        executor = shared_executor('sync')
+        timeout = self._journal_option('sync_timeout', default=SYNC_TIMEOUT)
+        mirrored = [('{0} [{1}]'.format(record, self._journal), date)
+                    for record, date in records]
+        for target in targets:
+            self._target_spool(target).extend(mirrored)
+        futures = [(target, executor.submit_ordered(
+            ('sync', target), self._sync_target, target))
+            for target in targets]
+        for target, future in futures:
+            try:
+                future.result(timeout)
+            except Timeout:
+                log.warn('Still syncing to [{0}] after {1}s', target, timeout)
+            except Exception as err:
+                log.warn('Failed to sync to [{0}], will retry: {1}',
+                         target, err)
+
+    @timed('sync_to.target')
+    def _sync_target(self, target):
+        """ Write the loggs spooled for the target journal """
+        spool = self._target_spool(target)
+        with pooled_logg(self.config, target) as logg:
+            # mirrored loggs aren't synced any further
+            k_records = spool.flush(
+                lambda batch: logg._logg_records(iter(batch)))
+        if k_records:
+            log.info('Synced {0} records to [{1}]', k_records, target)
+        return k_records
+
+    def _target_spool(self, target):
+        """ Spool of the loggs to be mirrored to the target journal """
+        from idid.spool import Spool
+        engine = self._journal_option('engine', target,
+                                      self.config.get('default_engine'))
+        return Spool.for_journal(engine, target)
+
+    def _journal_option(self, key, journal=None, default=None):
+        """ Get a journal specific config value, falling back to global """
+        journal = journal or self._journal
+        jconf = self.config['journals'].get(journal) or {}
+        return jconf.get(key, self.config.get(key, default))
+
+    def _prep_record(self, record, date):
+        """ Validate and normalize a record and its date """
         if not record:
             raise RuntimeError(
-                "record [{1}] must be defined".format(record))
+                "record [{0}] must be defined".format(record))
         # we want to store dates in txt as YYYY-MM-DD which is default
         # formate for Date() objects
         date = unicode(Date(date or today()))
 
-        record = record.decode('utf-8').strip()
-        # default format YYYY-MM-DD
-        log.debug('Saving idid Logg("{0}", "{1}", "{2}")'.format(
-            self._journal, record, date))
-        result = self._logg_record(record, date)
-        log.info('SUCCESS: \n{0}'.format(result))
-        return result
+        if isinstance(record, bytes):
+            record = record.decode('utf-8')
+        return record.strip(), date
 
+    @timed('txt.append')
     def _logg_record(self, record, date):
         # self._engine_path contains the path part of the engine uri
-        mode = 'a' if os.path.exists(self._engine_path) else 'w'
-        with open(self._engine_path, mode) as stdout:
-            result = self._logg_format.format(
-                date=date, record=record, journal=self._journal)
-            stdout.write(result)
+        result = self._logg_format.format(
+            date=date, record=record, journal=self._journal)
+        with self._appending() as fd:
+            offset = os.fstat(fd).st_size
+            _write(fd, self._encode_line(result))
+        self._sync_index()
+        tags = extract_tags(record)
+        if tags:
+            self._index_tags([(posting(date, offset), tags)])
         return result
 
+    @timed('txt.append')
+    def _logg_records(self, records):
+        # one open, lock, append and fsync for the whole batch
+        k_records = 0
+        postings = []
+        with self._appending() as fd:
+            offset = os.fstat(fd).st_size
+            lines = []
+            for record, date in records:
+                result = self._logg_format.format(
+                    date=date, record=record, journal=self._journal)
+                line = self._encode_line(result)
+                lines.append(line)
+                tags = extract_tags(record)
+                if tags:
+                    postings.append((posting(date, offset), tags))
+                offset += len(line)
+                k_records += 1
+                if len(lines) >= 4096:
+                    _write(fd, b''.join(lines))
+                    lines = []
+            _write(fd, b''.join(lines))
+            os.fsync(fd)
+        self._sync_index()
+        self._index_tags(postings)
+        return k_records
+
+    @contextmanager
+    def _appending(self):
+        """
+        Exclusively locked O_APPEND descriptor of the engine file
+
+        Concurrent idid processes take turns; every logg is appended
+        whole and the offset read under the lock is where it lands.
+        """
+        fd = os.open(self._engine_path,
+                     os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield fd
+        finally:
+            os.close(fd)
+
+    @timed('txt.index')
+    def _sync_index(self):
+        if self._index:
+            self._index.sync()
+
+    @staticmethod
+    def _encode_line(result):
+        """ One logg per line in the txt engine """
+        return '{0}\n'.format(result).encode('utf-8')
+
 
 class GitLogg(Logg):
 
     """ idid logg backend to save loggs to a git repo """
 
+    # (st_dev, st_ino) of the repo's git dir, to tell if it was replaced
+    _git_dir_id = None
+    # (sha, committer timestamp) of the last commit created
+    _last_commit = (None, 0)
+
     def __init__(self, *args, **kwargs):
         super(GitLogg, self).__init__(*args, **kwargs)
         # cache the _logg_repo in the instance
         self._logg_repo = self._load_repo()
 
+    def close(self):
+        """ Put the repo back into the pool of repos """
+        _logg_repo, self._logg_repo = self._logg_repo, None
+        if _logg_repo:
+            _repos.release(self._engine_path, (_logg_repo, self._git_dir_id))
+
+    def _stale(self):
+        # suspended Logg's check the pooled repo once resumed
+        return bool(self._logg_repo) and (
+            _file_id(self._logg_repo.git_dir) != self._git_dir_id)
+
+    def _suspend(self):
+        self.close()
+
+    def _resume(self):
+        self._logg_repo = self._load_repo()
+
+    @timed('git.write')
     def _logg_record(self, record, date):
         """
         # %> idid work 2015-01-01 '... bla bla #tag @mention ...'
@@ -280,114 +965,883 @@ class GitLogg(Logg):
         try:
             result = self._commit(self._journal, record, date)
         except KeyboardInterrupt as err:
-            log.error('Error encountered during git commit: {0}'.format(err))
+            log.error('Error encountered during git commit: {0}', err)
             raise SystemExit('\n\n')
 
-        # FIXME #########
-        # LOAD SYNC_TO options from config PER JOURNAL
-        # ie, sync to remote (friends) journals too
-        # ENABLE syncing to multiple (remotee) branches
-        # sync_to = None
-        # if sync_to:
-        #    # sync/backup branch (eg, master or remote)
-        #    log.info(' ... ... also syncing to: {0}'.format(sync_to))
-        #    record = '{0} [{1}]'.format(record, self._journal)
-        #    result_sync = self._commit(record, date)
-        #    log.debug(" ... ... record committed\n{0}".format(result_sync))
-
+        # `sync_to` journals are written by Logg.logg_record()
+        self._auto_sync()
         return result
 
-    # FIXME: sync; sync_tx == remotee, remotees
     def _commit(self, branch, record, date):
+        """
+        Commit the record straight onto the journal ref
+
+        The commit is built with ``git commit-tree`` on top of the current
+        tip of the journal (or HEAD for new journals) and the ref is then
+        advanced with ``git update-ref`` using the old tip as a
+        compare-and-swap guard. HEAD, the index and the working tree are
+        never touched, so journals can be written concurrently.
+        """
         if record in ['--', None]:
-            # inspired by: http://stackoverflow.com/a/6309753/1289080
-            with tempfile.NamedTemporaryFile(suffix=".tmp") as _tmp:
-                _n = _tmp.name
-                description = DEFAULT_LOGG_RECORD.format(
-                    **dict(journal=self._journal, date=date))
-                _tmp.write(description)
-                _tmp.flush()
-                call([LOGG_EDITOR, _n])
-                record = [x.strip(' ') for x in open(_n).readlines() if x]
-                record = [x for x in record if not COMMENT_RE.match(x)]
-                k_lines = len(record)
-                if k_lines > 1:
-                    # complain that we expect the SUMMARY / MSG BODY form
-                    if not record[1] == '\n':
-                        raise RuntimeError(
-                            'Invalid format. Usage:\nSUMMARY\n\nMESSAGE...')
-                record = ''.join(record).strip()
-                if not record:
-                    raise SystemExit('Empty Logg. Aborting.')
-
-        # git command kwargs
-        kwargs = dict(date=date, allow_empty=True)
-
-        # Include the record in the git command too
-        kwargs['m'] = record
+            record = self._edit_record(date)
+
+        ref = self._journal_ref(branch)
+        old = self._rev_parse(ref)
+        base = old or self._rev_parse('HEAD')
+        sha = self._commit_tree(record, date, base)
+        log.debug(" ... record committed ({0})", sha)
+        sha = self._advance_ref(ref, sha, old, base)
+        tags = extract_tags(record)
+        if tags and branch == self._journal:
+            self._index_tags(
+                [(posting(unicode(Date(date)), _location(sha)), tags)])
+
+        summary = record.splitlines()[0] if record else ''
+        return '[{0} {1}] {2}'.format(branch, sha[:7], summary)
+
+    @timed('git.write')
+    def _logg_records(self, records):
+        """ Chain all the records and advance the journal ref once """
+        ref = self._journal_ref()
+        old = self._rev_parse(ref)
+        tip = base = old or self._rev_parse('HEAD')
+        k_records = 0
+        for record, date in records:
+            tip = self._commit_tree(record, Date(date, fmt=DT_GIT_FMT), tip)
+            k_records += 1
+        if k_records:
+            tip = self._advance_ref(ref, tip, old, base)
+            # the commits may have been replayed; index the final ones
+            self._index_tags(self._iter_postings(
+                '{0}..{1}'.format(old or base, tip)))
+            self._auto_sync()
+        return k_records
+
+    @timed('git.update_ref')
+    def _advance_ref(self, ref, tip, old, base):
+        """
+        Move ref from old to tip with a compare-and-swap update-ref
+
+        If another writer moved the ref in the meantime, the commits
+        base..tip are replayed on top of the new value and the update
+        is retried; if it was only locked, the update is simply retried.
+        Attempts back off exponentially, with jitter, so a crowd of
+        writers doesn't retry in lockstep. Returns the sha the ref was
+        finally set to.
+        """
+        for attempt in range(GIT_CAS_RETRIES):
+            try:
+                # only move the ref if nobody else did in the meantime
+                self._logg_repo.git.update_ref(ref, tip, old or NULL_SHA)
+                return tip
+            except git.GitCommandError as err:
+                # moved by another writer, or its .lock held by one
+                log.debug(" ... ref [{0}] moved; retrying ({1})", ref, err)
+                _backoff(attempt)
+            current = self._rev_parse(ref)
+            if current != old:
+                # moved (or created); put the commits on top of it
+                onto = current or self._rev_parse('HEAD')
+                tip, base = self._replay(base, tip, onto), onto
+                old = current
+        raise RuntimeError(
+            'Failed to update [{0}] after {1} attempts'.format(
+                ref, GIT_CAS_RETRIES))
+
+    def _replay(self, base, tip, onto):
+        """ Recreate the commits base..tip on top of onto """
+        shas = self._logg_repo.git.rev_list(
+            '--reverse', '{0}..{1}'.format(base, tip)).split()
+        for sha in shas:
+            commit = self._logg_repo.commit(sha)
+            date = datetime.datetime.utcfromtimestamp(commit.authored_date)
+            onto = self._commit_tree(commit.message.strip(), date, onto)
+        return onto
+
+    # ~~~ remotes ~~~
+    @timed('git.sync')
+    def sync(self, remotes=None):
+        """
+        Fetch and push the journal refs of the engine to its remotes
+
+        The refs of the configured journals sharing the engine and the
+        journal's ref namespace are fetched with a single ``git fetch``
+        and pushed with a single ``git push`` per remote; other refs, eg
+        each repo's own ``master``, are left alone. Remote loggs are
+        fast-forwarded into the local journals; local loggs of diverged
+        journals are replayed on top of the remote ones. Remotes (name:
+        url) default to the configured ones; plain paths of missing
+        repos are initialized as bare repos.
+        Returns the names of the synced remotes.
+        """
+        if remotes is None:
+            remotes = self._remotes()
+        for name, url in sorted(remotes.items()):
+            self._sync_remote(name, url)
+        self._touch(SYNC_STAMP)
+        return sorted(remotes)
+
+    def _remotes(self):
+        """ Configured {name: url} remotes of the journal """
+        remotes = self._journal_option('remotes') or {}
+        if isinstance(remotes, basestring):
+            remotes = {'origin': remotes}
+        return dict(remotes)
+
+    def _auto_sync(self):
+        """ Sync, unless the last sync was less than `sync_interval` ago """
+        interval = self._journal_option('sync_interval')
+        if not interval or not self._remotes():
+            return
+        # loggs saved in the meantime are pushed with the next sync
+        stamp = os.path.join(self._logg_repo.git_dir, SYNC_STAMP)
+        if os.path.exists(stamp) and \
+                os.path.getmtime(stamp) > time.time() - interval:
+            return
+        try:
+            self.sync()
+        except Exception as err:
+            log.warn('Failed to sync [{0}]: {1}', self._journal, err)
+
+    def _sync_remote(self, name, url):
+        """ Fetch, merge and push the namespace's journal refs to url """
+        git_ = self._logg_repo.git
+        namespace = self._ref_namespace()
+        tracking = 'refs/idid-remotes/{0}/'.format(name)
+        # only the configured journals; never master or unrelated branches
+        journals = self._synced_journals()
+        path = url[len('file://'):] if url.startswith('file://') else url
+        if '://' not in path and ':' not in path.split('/')[0] and \
+                not os.path.exists(path):
+            log.info('Creating bare remote repo {0}', path)
+            git.Repo.init(path, bare=True)
+        for attempt in range(GIT_CAS_RETRIES):
+            remote = self._remote_refs(url, namespace, journals)
+            if remote:
+                git_.fetch(url, *['+{0}{1}:{2}{1}'.format(
+                    namespace, journal, tracking) for journal in remote])
+            for journal in remote:
+                sha = self._rev_parse(tracking + journal)
+                self._merge_ref(journal, namespace + journal, sha)
+            refs = ['{0}{1}:{0}{1}'.format(namespace, journal)
+                    for journal in journals
+                    if self._rev_parse(namespace + journal)]
+            try:
+                if refs:
+                    git_.push(url, *refs)
+                log.info('Synced [{0}] with {1}', namespace, name)
+                return
+            except git.GitCommandError as err:
+                # somebody pushed in the meantime; fetch their loggs too
+                log.debug(' ... push to {0} rejected; retrying ({1})',
+                          name, err)
+                _backoff(attempt)
+        raise RuntimeError('Failed to push to {0} after {1} attempts'.format(
+            name, GIT_CAS_RETRIES))
+
+    def _synced_journals(self):
+        """ Configured journals of the engine in the journal's namespace """
+        default = self.config.get('default_engine')
+        engine = self._journal_option('engine', default=default)
+        namespace = self._ref_namespace()
+        journals = set(self.config['journals']) | set([self._journal])
+        return sorted(
+            journal for journal in journals
+            if self._journal_option('engine', journal, default) == engine and
+            self._ref_namespace(journal) == namespace)
+
+    def _remote_refs(self, url, namespace, journals):
+        """ The journals of which url has a ref in the namespace """
+        refs = set(namespace + journal for journal in journals)
+        output = self._logg_repo.git.ls_remote(url, *sorted(refs))
+        found = set(line.split()[1] for line in output.splitlines())
+        return [journal for journal in journals
+                if namespace + journal in found]
+
+    def _merge_ref(self, journal, ref, remote):
+        """ Bring the remote loggs of a journal into the local ref """
+        for attempt in range(GIT_CAS_RETRIES):
+            local = self._rev_parse(ref)
+            if local == remote or local and self._is_ancestor(remote, local):
+                return
+            if not local or self._is_ancestor(local, remote):
+                tip = remote
+            else:
+                # diverged; put the local-only loggs on top
+                tip = self._replay(
+                    self._merge_base(local, remote), local, remote)
+            try:
+                self._logg_repo.git.update_ref(ref, tip, local or NULL_SHA)
+            except git.GitCommandError:
+                # a local write moved the ref; merge again
+                _backoff(attempt)
+                continue
+            self._index_merged(journal, local, tip)
+            return
+        raise RuntimeError('Failed to merge [{0}] after {1} attempts'.format(
+            ref, GIT_CAS_RETRIES))
+
+    def _index_merged(self, journal, old, tip):
+        """ Index the tags of the loggs a merge brought into a journal """
+        if not self._journal_option('tags', journal, default=True):
+            return
+        tags = TagIndex(self._tags_path)
+        if old and not self._is_ancestor(old, tip):
+            # local commits were replayed and got new shas
+            tags.clear(journal)
+            old = None
+        tags.add(journal, self._iter_postings(
+            '{0}..{1}'.format(old, tip) if old else tip))
+
+    def _list_refs(self, prefix):
+        """ Generate (ref, sha) of the refs starting with prefix """
+        output = self._logg_repo.git.for_each_ref(
+            prefix, format='%(refname) %(objectname)')
+        for line in output.splitlines():
+            ref, sha = line.split()
+            yield ref, sha
+
+    def _merge_base(self, one, two):
+        """ Latest common commit; the root commit for unrelated repos """
+        status, sha, _ = self._logg_repo.git.merge_base(
+            one, two, with_extended_output=True, with_exceptions=False)
+        if status == 0:
+            return sha.strip()
+        # every repo starts with its own initial commit, which isn't a logg
+        return self._logg_repo.git.rev_list('--max-parents=0', one).split()[0]
+
+    def _is_ancestor(self, ancestor, sha):
+        status, _, _ = self._logg_repo.git.merge_base(
+            '--is-ancestor', ancestor, sha,
+            with_extended_output=True, with_exceptions=False)
+        return status == 0
+
+    def _touch(self, name):
+        path = os.path.join(self._logg_repo.git_dir, name)
+        with open(path, 'a'):
+            os.utime(path, None)
+
+    @property
+    def _tags_path(self):
+        return os.path.join(self._logg_repo.git_dir, 'idid-tags')
+
+    def _iter_records(self, since, until, search=None):
+        return (logg for sha, logg in self._iter_located(
+            since, until, search=search))
+
+    def _iter_located(self, since, until, locations=None, search=None):
+        """
+        Walk the journal's commits, newest first, using a single
+        ``git log`` process. As committer dates never go back along a
+        journal, nor before the dates of its loggs (even of loggs dated
+        ahead, eg ``idid tomorrow``), the walk stops at the first commit
+        made before since.
+
+        Generates (sha, LoggRecord) pairs. If locations (of the tag index)
+        are given, only those commits are looked up, in the given order.
+        """
+        if locations is not None:
+            commits = self._iter_locations(locations)
+        else:
+            kwargs = dict(fixed_strings=True, grep=search) if search else {}
+            commits = self._iter_commits([self._journal_ref()], **kwargs)
+        _since = Date(since).timestamp if since else None
+        for sha, committed, logg in commits:
+            if _since and locations is None and committed < _since:
+                break
+            _date = unicode(logg.date)
+            if (since and _date < since) or (until and _date > until):
+                continue
+            yield sha, logg
+
+    def _iter_locations(self, locations, chunk=512):
+        """ Look up the commits at the tag index locations, in order """
+        locations = iter(locations)
+        while True:
+            revs = ['{0:010x}'.format(location) for location in
+                    itertools.islice(locations, chunk)]
+            if not revs:
+                break
+            for commit in self._iter_commits(revs, no_walk='unsorted'):
+                yield commit
+
+    def _iter_commits(self, revs, **kwargs):
+        """ Generate (sha, committer timestamp, LoggRecord) of git log """
+        proc = self._logg_repo.git.log(
+            *revs, z=True, as_process=True,
+            format='%H%x01%P%x01%ct%x01%at%x01%B', **kwargs)
+        try:
+            for commit in _split_stream(proc.proc.stdout, b'\0'):
+                sha, parents, committed, authored, record = commit.decode(
+                    'utf-8').split('\x01', 4)
+                if not parents:
+                    # the repo's initial commit isn't a logg
+                    continue
+                date = Date(datetime.datetime.utcfromtimestamp(
+                    int(authored)))
+                record = record.strip()
+                yield sha, int(committed), LoggRecord(
+                    self._journal, date, record, extract_tags(record))
+        finally:
+            proc.proc.kill()
+            proc.proc.wait()
+
+    def _iter_postings(self, rev=None):
+        """ Generate (posting, tags) of the tagged commits in rev """
+        for sha, committed, logg in self._iter_commits(
+                [rev or self._journal_ref()]):
+            if logg.tags:
+                yield posting(unicode(logg.date), _location(sha)), logg.tags
+
+    def rebuild_tags(self):
+        """ Rebuild the journal's tag index from all its commits """
+        tags = self._tags
+        if not tags:
+            return
+        tags.clear(self._journal)
+        tags.add(self._journal, self._iter_postings())
+
+    @timed('git.fast_import')
+    def fast_import(self, records):
+        """
+        Stream (journal, date, record) triples into ``git fast-import``
+
+        All records are written through a single fast-import process,
+        so importing large histories runs in constant memory. The
+        commits have the same shape as the ones written by _commit:
+        empty commits on top of the journal tip (or HEAD for new
+        journals) authored on the record's date. Records without a
+        journal are imported into this instance's journal. Returns the
+        number of records imported.
+        """
+        if self.config.get('gpg', None):
+            log.warn('git fast-import can not sign commits; '
+                     'imported loggs will be unsigned')
+
+        # 'Name <email> 1445412480 +0000' -> 'Name <email>'
+        ident = self._logg_repo.git.var('GIT_COMMITTER_IDENT')
+        ident = ident.rsplit(' ', 2)[0]
+        # committer dates only ever grow; see _commit_tree
+        committed = int(time.time())
+        head = self._rev_parse('HEAD')
+
+        proc = self._logg_repo.git.execute(
+            ['git', 'fast-import', '--quiet', '--date-format=raw'],
+            istream=PIPE, as_process=True)
+        stdin = proc.proc.stdin
+        started = {}
+        k_records = 0
+        try:
+            for journal, date, record in records:
+                journal = journal or self._journal
+                record, date = self._prep_record(record, date)
+                message = '{0}\n'.format(record).encode('utf-8')
+                ref = self._journal_ref(journal)
+                parent = None
+                if ref not in started:
+                    # continue the existing history of the journal
+                    parent = self._rev_parse(ref) or head
+                    started[ref] = (journal, parent)
+                    committed = max(committed, self._committed_time(parent))
+                authored = Date(date).timestamp
+                committed = max(committed, authored)
+                stdin.write('commit {0}\n'.format(ref).encode('utf-8'))
+                stdin.write('author {0} {1} +0000\n'.format(
+                    ident, authored).encode('utf-8'))
+                stdin.write('committer {0} {1} +0000\n'.format(
+                    ident, committed).encode('utf-8'))
+                stdin.write(
+                    'data {0}\n'.format(len(message)).encode('utf-8'))
+                stdin.write(message)
+                if parent:
+                    stdin.write('from {0}\n'.format(parent).encode('utf-8'))
+                stdin.write(b'\n')
+                k_records += 1
+            stdin.write(b'done\n')
+            stdin.close()
+        except BaseException:
+            # abort; fast-import must not update any refs
+            proc.proc.kill()
+            proc.proc.wait()
+            raise
+        status = proc.proc.wait()
+        if status != 0:
+            raise RuntimeError('git fast-import failed: {0}'.format(
+                proc.proc.stderr.read().decode('utf-8', 'replace')))
+        log.info('Imported {0} records into [{1}]',
+                 k_records, self._engine_path)
+
+        tags = self._tags
+        for ref, (journal, parent) in started.items():
+            rev = '{0}..{1}'.format(parent, ref) if parent else ref
+            if tags:
+                tags.add(journal, self._iter_postings(rev))
+        return k_records
+
+    def _commit_tree(self, record, date, parent=None):
+        """ Create a commit object for record, return its sha """
+        if parent:
+            # keep the journal tree as-is; loggs are empty commits
+            args = ['{0}^{{tree}}'.format(parent), '-p', parent]
+        else:
+            args = [EMPTY_TREE_SHA]
 
         # FIXME: add documentation to describe this config option
         # if gpg key is defined in .config [logg], git will attempt to
         # sign the commits with the provided key
         gpg_sign = self.config.get('gpg', None)
         if gpg_sign:
-            kwargs['gpg_sign'] = gpg_sign
-
-        try:
-            # checkout the journal branch, but make sure to return to
-            # pre-commit state after completion (clean-up) ...
-            current = self._logg_repo.active_branch
-
-            log.debug("Checking out branch: {0}".format(branch))
-            self._checkout_branch(branch)
-
-            # HACK !!!!
-            # os.environ["GIT_COMMITTER_DATE"] = str(date)
-
-            r = self._logg_repo.git.commit(**kwargs)
-            log.debug(" ... record committed")
-
-        finally:
-            if self._logg_repo.active_branch != current:
-                log.debug(
-                    " ... cleaning up (git checkout {0}...)".format(current))
-                self._checkout_branch(current)
-        return r
-
-    def _checkout_branch(self, branch=None):
-        branch = branch or 'master'
-        # Try to create the journal branch
-        try:
-            self._logg_repo.git.checkout(branch, b=True)
-        except git.GitCommandError:
-            # branch already exists, so check it out
-            self._logg_repo.git.checkout(branch)
-
+            args.append('-S{0}'.format(gpg_sign))
+
+        # git date option needs a timezone too or it will assume local time
+        authored = Date(date).timestamp
+        # committer dates never go back along a journal, nor before the
+        # dates of its loggs, so walks can stop at the first commit made
+        # before since (see _iter_located)
+        committed = max(int(time.time()), authored,
+                        self._committed_time(parent))
+        # signing may wait for gpg-agent, or even a passphrase
+        with span('git.commit_tree.gpg' if gpg_sign else 'git.commit_tree'):
+            with self._logg_repo.git.custom_environment(
+                    GIT_AUTHOR_DATE='{0} +0000'.format(authored),
+                    GIT_COMMITTER_DATE='{0} +0000'.format(committed)):
+                sha = self._logg_repo.git.commit_tree(
+                    *args, m=record).strip()
+        self._last_commit = (sha, committed)
+        return sha
+
+    def _committed_time(self, sha):
+        """ Committer timestamp of the commit sha; 0 without a commit """
+        if not sha:
+            return 0
+        if sha == self._last_commit[0]:
+            return self._last_commit[1]
+        return self._logg_repo.commit(sha).committed_date
+
+    def _rev_parse(self, rev):
+        """ Resolve rev to a commit sha; None if it doesn't exist """
+        status, sha, _ = self._logg_repo.git.rev_parse(
+            '--verify', '-q', '{0}^{{commit}}'.format(rev),
+            with_extended_output=True, with_exceptions=False)
+        return sha.strip() if status == 0 else None
+
+    def _journal_ref(self, journal=None):
+        """ Full ref name where the journal's loggs are stored """
+        journal = journal or self._journal
+        # eg, ref_namespace: refs/idid/cward -> refs/idid/cward/<journal>
+        return '{0}{1}'.format(self._ref_namespace(journal), journal)
+
+    def _ref_namespace(self, journal=None):
+        """ Prefix of the journal refs, including the trailing slash """
+        namespace = self._journal_option('ref_namespace', journal)
+        return (namespace or DEFAULT_REF_NAMESPACE).rstrip('/') + '/'
+
+    @timed('git.editor')
+    def _edit_record(self, date):
+        """ Launch $EDITOR to let the user write the record """
+        # inspired by: http://stackoverflow.com/a/6309753/1289080
+        with tempfile.NamedTemporaryFile(suffix=".tmp") as _tmp:
+            _n = _tmp.name
+            description = DEFAULT_LOGG_RECORD.format(
+                **dict(journal=self._journal, date=date))
+            _tmp.write(description)
+            _tmp.flush()
+            call([LOGG_EDITOR, _n])
+            record = [x.strip(' ') for x in open(_n).readlines() if x]
+            record = [x for x in record if not COMMENT_RE.match(x)]
+            k_lines = len(record)
+            if k_lines > 1:
+                # complain that we expect the SUMMARY / MSG BODY form
+                if not record[1] == '\n':
+                    raise RuntimeError(
+                        'Invalid format. Usage:\nSUMMARY\n\nMESSAGE...')
+            record = ''.join(record).strip()
+            if not record:
+                raise SystemExit('Empty Logg. Aborting.')
+        return record
+
+    @timed('git.init_repo')
     def _init_repo(self):
         """ create and initialize a new Git Repo """
-        log.debug("initializing new Git Repo: {0}".format(self._engine_path))
-        if os.path.exists(self._engine_path):
-            log.error("Path already exists! Aborting!")
-            raise RuntimeError
+        log.debug("initializing new Git Repo: {0}", self._engine_path)
+        bare = bool(self._journal_option('bare', default=False))
+        path = self._engine_path
+        if os.path.exists(path) and not (
+                os.path.isdir(path) and not os.listdir(path)):
+            try:
+                # left without its initial commit by an interrupted idid
+                _logg_repo = git.Repo(self._engine_path)
+            except Exception:
+                log.error("Path already exists! Aborting!")
+                raise RuntimeError
         else:
-            # create the repo if it doesn't already exist
-            _logg_repo = git.Repo.init(path=self._engine_path, mkdir=True)
-            record = "idid Logg repo initialized on {0}".format(today())
-            c = _logg_repo.index.commit(record)
-            assert c.type == 'commit'
-            log.info('Created git repo [{0}]'.format(self._engine_path))
+            # create the repo if it doesn't already exist; with `bare: true`
+            # the repo is created without a working tree at all
+            _logg_repo = git.Repo.init(
+                path=self._engine_path, mkdir=True, bare=bare)
+        record = "idid Logg repo initialized on {0}".format(today())
+        # commit the empty tree directly; no index or worktree needed
+        sha = _logg_repo.git.commit_tree(EMPTY_TREE_SHA, m=record).strip()
+        _logg_repo.git.update_ref('HEAD', sha, NULL_SHA)
+        log.info('Created {0}git repo [{1}]',
+                 'bare ' if bare else '', self._engine_path)
         return _logg_repo
 
+    @timed('git.load_repo')
     def _load_repo(self):
         """ Load git repo using GitPython """
         if self._logg_repo:
             return self._logg_repo
 
+        pooled = _repos.acquire(self._engine_path, check=_unchanged_repo)
+        if pooled:
+            _logg_repo, self._git_dir_id = pooled
+            log.debug('Reusing git repo [{0}]', self._engine_path)
+            return _logg_repo
+        _logg_repo = self._open_repo()
+        if _logg_repo:
+            log.debug('Loaded git repo [{0}]', self._engine_path)
+            self._git_dir_id = _file_id(_logg_repo.git_dir)
+            return _logg_repo
+        # FIXME: should this be automatic?
+        # log.error("Git repo doesn't exist! run ``idid init``")
+        # other idid processes may be creating the same repo right now;
+        # they take turns on the engine directory itself
+        try:
+            os.makedirs(self._engine_path)
+        except OSError:
+            if not os.path.isdir(self._engine_path):
+                raise
+        fd = os.open(self._engine_path, os.O_RDONLY)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            _logg_repo = self._open_repo() or self._init_repo()
+        finally:
+            os.close(fd)
+        self._git_dir_id = _file_id(_logg_repo.git_dir)
+        return _logg_repo
+
+    def _open_repo(self):
+        """ The git repo, unless missing or not initialized yet """
         try:
             _logg_repo = git.Repo(self._engine_path)
-            log.debug('Loaded git repo [{0}]'.format(self._engine_path))
         except Exception:
-            # FIXME: should this be automatic?
-            # log.error("Git repo doesn't exist! run ``idid init``")
-            _logg_repo = self._init_repo()
-        return _logg_repo
+            return None
+        status, _, _ = _logg_repo.git.rev_parse(
+            '--verify', '-q', 'HEAD',
+            with_extended_output=True, with_exceptions=False)
+        return _logg_repo if status == 0 else None
+
+
+class SqliteLogg(Logg):
+
+    """ idid logg backend to save loggs to a sqlite database """
+
+    _db = None
+    _db_id = None
+
+    def __init__(self, *args, **kwargs):
+        super(SqliteLogg, self).__init__(*args, **kwargs)
+        # serializes the use of the connection by the threads
+        self._lock = threading.RLock()
+        # cache the connection in the instance
+        self._db = self._load_db()
+        self._db_id = _file_id(self._engine_path)
+
+    def close(self):
+        with self._lock:
+            _db, self._db = self._db, None
+            if _db:
+                _db.close()
+
+    def _stale(self):
+        return _file_id(self._engine_path) != self._db_id
+
+    def _load_db(self):
+        """ Connect to the database, creating the schema if needed """
+        # AsyncLogg's and pooled Logg's move between threads; the
+        # connection is only used while holding self._lock
+        db = sqlite3.connect(self._engine_path, check_same_thread=False)
+        # readers don't block the writer and vice versa
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        with db:
+            db.executescript(SQLITE_SCHEMA)
+        self._fts = self._create_fts(db)
+        log.debug('Loaded sqlite db [{0}] (fts: {1})',
+                  self._engine_path, self._fts)
+        return db
+
+    @staticmethod
+    def _create_fts(db):
+        """ Create the full-text table with the best fts available """
+        # fts4 has no content_rowid, but uses the rowid (id) anyway
+        for fts, rowid in [('fts5', ", content_rowid='id'"), ('fts4', '')]:
+            try:
+                with db:
+                    db.executescript(
+                        SQLITE_FTS_SCHEMA.format(fts=fts, rowid=rowid))
+                return fts
+            except sqlite3.OperationalError as err:
+                log.debug('sqlite {0} not available: {1}', fts, err)
+        return None
+
+    @timed('sqlite.insert')
+    def _logg_record(self, record, date):
+        with self._lock, self._db:
+            self._insert(record, date)
+        return self._logg_format.format(
+            date=date, record=record, journal=self._journal)
+
+    @timed('sqlite.insert')
+    def _logg_records(self, records, chunk=1000):
+        # each chunk of records is inserted in a single transaction
+        k_records = 0
+        records = iter(records)
+        while True:
+            with self._lock, self._db:
+                k_chunk = 0
+                for record, date in itertools.islice(records, chunk):
+                    self._insert(record, date)
+                    k_chunk += 1
+            if not k_chunk:
+                break
+            k_records += k_chunk
+        return k_records
+
+    def _insert(self, record, date):
+        cursor = self._db.execute(
+            'INSERT INTO loggs (journal, date, record) VALUES (?, ?, ?)',
+            (self._journal, date, record))
+        tags = set(TagIndex.token(tag) for tag in extract_tags(record))
+        self._db.executemany(
+            'INSERT INTO tags (logg, journal, token, date) '
+            'VALUES (?, ?, ?, ?)',
+            [(cursor.lastrowid, self._journal, tag, date) for tag in tags])
+
+    def _iter_records(self, since, until, search=None):
+        """
+        Query the journal's loggs, in date order
+
+        With full-text search available, search is matched as a phrase
+        against the fts index; otherwise as a plain substring.
+        """
+        query = 'SELECT date, record FROM loggs WHERE journal = ?'
+        args = [self._journal]
+        if since:
+            query += ' AND date >= ?'
+            args.append(since)
+        if until:
+            query += ' AND date <= ?'
+            args.append(until)
+        if search and self._fts:
+            query += (' AND id IN (SELECT rowid FROM loggs_fts '
+                      'WHERE loggs_fts MATCH ?)')
+            args.append('"{0}"'.format(search.replace('"', '""')))
+        elif search:
+            query += ' AND instr(record, ?) > 0'
+            args.append(search)
+        return self._iter_query(query + ' ORDER BY date, id', args)
+
+    def _iter_query(self, query, args, size=1000):
+        """ Generate the LoggRecord's of the query, fetched in batches """
+        with self._lock:
+            cursor = self._db.execute(query, args)
+            rows = cursor.fetchmany(size)
+        while rows:
+            for date, record in rows:
+                yield LoggRecord(
+                    self._journal, Date(date), record, extract_tags(record))
+            with self._lock:
+                rows = cursor.fetchmany(size)
+
+    def iter_tagged(self, tag, since=None, until=None):
+        """ Generate the journal's loggs with the #tag or @mention """
+        query = ('SELECT loggs.date, loggs.record FROM tags '
+                 'JOIN loggs ON loggs.id = tags.logg '
+                 'WHERE tags.journal = ? AND tags.token = ?')
+        args = [self._journal, TagIndex.token(tag)]
+        self.flush()
+        if since:
+            query += ' AND tags.date >= ?'
+            args.append(unicode(Date(since)))
+        if until:
+            query += ' AND tags.date <= ?'
+            args.append(unicode(Date(until)))
+        return self._iter_query(query + ' ORDER BY tags.date, loggs.id', args)
+
+    def tags(self, prefix='', since=None, until=None):
+        """ Generate (token, k loggs) for the journal's tags by prefix """
+        query = ('SELECT token, count(*) FROM tags WHERE journal = ? '
+                 'AND substr(token, 1, ?) = ?')
+        args = [self._journal, len(prefix), prefix.lower()]
+        self.flush()
+        if since:
+            query += ' AND date >= ?'
+            args.append(unicode(Date(since)))
+        if until:
+            query += ' AND date <= ?'
+            args.append(unicode(Date(until)))
+        with self._lock:
+            return iter(self._db.execute(
+                query + ' GROUP BY token ORDER BY token', args).fetchall())
+
+    def rebuild_tags(self):
+        """ Tags are stored along with the loggs; nothing to rebuild """
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS loggs (
+    id INTEGER PRIMARY KEY,
+    journal TEXT NOT NULL,
+    date TEXT NOT NULL,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS loggs_journal_date ON loggs (journal, date);
+CREATE TABLE IF NOT EXISTS tags (
+    logg INTEGER NOT NULL REFERENCES loggs (id),
+    journal TEXT NOT NULL,
+    token TEXT NOT NULL,
+    date TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tags_journal_token_date
+    ON tags (journal, token, date);
+"""
+
+SQLITE_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS loggs_fts
+    USING {fts}(record, content='loggs'{rowid});
+CREATE TRIGGER IF NOT EXISTS loggs_fts_insert AFTER INSERT ON loggs BEGIN
+    INSERT INTO loggs_fts (rowid, record) VALUES (new.id, new.record);
+END;
+"""
+
+
+class AsyncLogg(object):
+    """
+    Non-blocking facade of a Logg
+
+    The journal's Logg is created through the usual LoggFactory
+    dispatch; its calls run on a bounded Executor and return Futures.
+    Calls on the same journal run in the order they were made, calls
+    on other journals concurrently. Engines which can't take parallel
+    writes (txt files, sqlite) serialize all their journals.
+    """
+
+    def __init__(self, config, journal, executor=None):
+        from idid.executor import default_executor
+        self.logg = Logg(config, journal)
+        self.executor = executor or default_executor()
+        if isinstance(self.logg, GitLogg):
+            # journal refs are advanced with compare-and-swap
+            self._key = (self.logg._engine_path, journal)
+        else:
+            self._key = self.logg._engine_path
+
+    def logg_record(self, record, date=None):
+        """ Save a record; Future of Logg.logg_record() """
+        return self._submit(self.logg.logg_record, record, date)
+
+    def logg_records(self, records):
+        """ Save (date, record) pairs; Future of the number saved """
+        # consume the iterable here, not in a worker thread
+        return self._submit(self.logg.logg_records, list(records))
+
+    def iter_records(self, since=None, until=None, search=None):
+        """ Future of the list of the journal's LoggRecord's """
+        return self._submit(
+            lambda: list(self.logg.iter_records(since, until, search)))
+
+    def _submit(self, fn, *args):
+        return self.executor.submit_ordered(self._key, fn, *args)
+
+
+def _flush(config, journal):
+    """ Flush the spool of the journal """
+    with pooled_logg(config, journal) as logg:
+        return logg.flush()
+
+
+def wait_for_flushes():
+    """
+    Wait for the spool flushes running in the background
+
+    A command line idid calls this before exiting, so the loggs it
+    spooled are written rather than left in the spool. Failed flushes
+    were logged already; their loggs stay spooled.
+    """
+    for future in list(_flushing):
+        future.exception()
+
+
+def _file_id(path):
+    """ (device, inode) of path; None if it doesn't exist """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_dev, stat.st_ino
+
+
+def _logg_key(config, journal):
+    # configs are reloaded (into new objects) only when their file changed
+    return id(config), journal
+
+
+def _fresh_logg(logg):
+    return not logg._stale()
+
+
+def _unchanged_repo(pooled):
+    _logg_repo, git_dir_id = pooled
+    return _file_id(_logg_repo.git_dir) == git_dir_id
+
+
+def _close_repo(pooled):
+    """ Stop the persistent git cat-file processes of a repo """
+    pooled[0].git.clear_cache()
+
+
+# Futures of the spool flushes still running
+_flushing = set()
+# Logg's by (config, journal) and (repo, git dir id) by engine path
+_loggs = Pool(LOGG_POOL_SIZE, close=lambda logg: logg.close())
+_repos = Pool(REPO_POOL_SIZE, close=_close_repo)
+
+
+def _tee(iterable, seen):
+    """ Generate the items of iterable, collecting them into seen """
+    for item in iterable:
+        seen.append(item)
+        yield item
+
+
+def _write(fd, data):
+    """ Write all of data; os.write() may write only a part of it """
+    while data:
+        data = data[os.write(fd, data):]
+
+
+def _backoff(attempt):
+    """ Sleep before retrying; ~10ms doubling per attempt, with jitter """
+    time.sleep(min(1.0, 0.01 * 2 ** attempt) * random.uniform(0.5, 1.5))
+
+
+def _location(sha):
+    """ Tag index location of a commit: the first 40 bits of its sha """
+    return int(sha[:10], 16)
+
+
+def _split_stream(stream, sep, size=65536):
+    """ Generate the sep separated chunks of a byte stream """
+    tail = b''
+    while True:
+        data = stream.read(size)
+        if not data:
+            break
+        chunks = (tail + data).split(sep)
+        tail = chunks.pop()
+        for chunk in chunks:
+            yield chunk
+    if tail:
+        yield tail
@@ -0,0 +1,115 @@
+# coding: utf-8
+# @ Author: "Chris Ward" <cward@redhat.com>
+
+""" Bounded pools of idle objects, eg open repos, for reuse """
+
+from __future__ import unicode_literals, absolute_import
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import threading
+
+from idid.utils import log
+
+"""
+Pool
+----
+Objects which are expensive to open (git repos with their persistent
+``cat-file`` processes, sqlite connections, whole Logg's) are returned
+to a pool once used instead of being thrown away, and handed out again
+to the next user of the same key. An object is used by one thread at a
+time: ``acquire()`` takes it out of the pool and ``release()`` puts it
+back, so threads wanting the same key at once get objects of their own.
+
+The pool keeps at most ``size`` idle objects; beyond that the least
+recently released ones are closed::
+
+    with pool.lease(path, lambda: open_repo(path)) as repo:
+        ...
+"""
+
+
+class Pool(object):
+    """ Idle objects by key, closing the least recently used ones """
+
+    def __init__(self, size, close=None):
+        self.size = size
+        self._close = close
+        self._lock = threading.Lock()
+        # idle objects, least recently released key first; {key: [obj]}
+        self._idle = OrderedDict()
+        self._k_idle = 0
+
+    def acquire(self, key, check=None):
+        """
+        Take an idle object of key out of the pool; None if there's none
+
+        Objects for which check(obj) is false are closed and skipped.
+        """
+        while True:
+            with self._lock:
+                objs = self._idle.get(key)
+                if not objs:
+                    return None
+                obj = objs.pop()
+                if not objs:
+                    del self._idle[key]
+                self._k_idle -= 1
+            if check is None or check(obj):
+                return obj
+            log.debug('Closing stale pooled {0}', key)
+            self._closing([obj])
+
+    def release(self, key, obj):
+        """ Put obj back, closing the least recently used if over size """
+        evicted = []
+        with self._lock:
+            objs = self._idle.pop(key, [])
+            objs.append(obj)
+            self._idle[key] = objs
+            self._k_idle += 1
+            while self._k_idle > self.size:
+                oldest = next(iter(self._idle))
+                objs = self._idle[oldest]
+                evicted.append(objs.pop(0))
+                if not objs:
+                    del self._idle[oldest]
+                self._k_idle -= 1
+        self._closing(evicted)
+
+    @contextmanager
+    def lease(self, key, create, check=None):
+        """
+        Use a pooled object of key, or create() one, then put it back
+
+        Objects which raised are closed rather than reused.
+        """
+        obj = self.acquire(key, check)
+        if obj is None:
+            obj = create()
+        try:
+            yield obj
+        except BaseException:
+            self._closing([obj])
+            raise
+        self.release(key, obj)
+
+    def clear(self):
+        """ Close all the idle objects """
+        with self._lock:
+            idle, self._idle = self._idle, OrderedDict()
+            self._k_idle = 0
+        self._closing([obj for objs in idle.values() for obj in objs])
+
+    def __len__(self):
+        return self._k_idle
+
+    def _closing(self, objs):
+        """ Close objs, outside of the lock """
+        if not self._close:
+            return
+        for obj in objs:
+            try:
+                self._close(obj)
+            except Exception as err:
+                log.warn('Failed to close {0!r}: {1}', obj, err)
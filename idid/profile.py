@@ -0,0 +1,187 @@
+# coding: utf-8
+# @ Author: "Chris Ward" <cward@redhat.com>
+
+""" Timing of the phases of idid commands """
+
+from __future__ import unicode_literals, absolute_import
+
+from contextlib import contextmanager
+import functools
+import json
+import sys
+import threading
+import timeit
+
+"""
+Profile
+-------
+The phases of an idid command (parsing the config, loading the engine,
+committing a logg, ...) are wrapped in ``span(name)``; whole functions
+are decorated with ``timed(name)``::
+
+    with span('git.commit'):
+        ...
+
+Spans are only recorded while profiling, ie inside ``profiling()``;
+otherwise ``span()`` returns a shared no-op context and costs next to
+nothing. Nested spans make up a tree, which is printed with the time
+spent in each phase, or saved as JSON. Spans of background threads (eg,
+``sync_to`` journals) are recorded along with the thread name.
+"""
+
+timer = timeit.default_timer
+
+# recorded (path, start, duration, thread name) of each span; None when
+# not profiling
+_spans = None
+_lock = threading.Lock()
+_local = threading.local()
+
+
+class _Null(object):
+    """ Span which doesn't record anything """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL = _Null()
+
+
+class _Span(object):
+    """ Span recorded on exit """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        stack.append(self.name)
+        self.path = tuple(stack)
+        self.start = timer()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = timer() - self.start
+        _local.stack.pop()
+        spans = _spans
+        if spans is not None:
+            with _lock:
+                spans.append((self.path, self.start, duration,
+                              threading.current_thread().name))
+
+
+def span(name):
+    """ Context timing the phase called name, while profiling """
+    if _spans is None:
+        return _NULL
+    return _Span(name)
+
+
+def timed(name):
+    """ Decorator timing every call of a function as the span name """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def profiling(output=None, stats=None):
+    """
+    Record the spans of the wrapped code and report them on exit
+
+    The breakdown is printed to stderr, or saved as JSON to output.
+    With stats, the code is run under cProfile too and its stats are
+    dumped to the stats file (see the pstats module).
+    """
+    global _spans
+    _spans = []
+    profiler = None
+    if stats:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    start = timer()
+    try:
+        with span('idid'):
+            yield
+    finally:
+        total = timer() - start
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(stats)
+        spans, _spans = _spans, None
+        if output:
+            with open(output, 'w') as stdout:
+                json.dump(to_json(spans, start, total), stdout, indent=2,
+                          separators=(',', ': '))
+        else:
+            sys.stderr.write(breakdown(spans, total))
+
+
+def breakdown(spans, total):
+    """ Text table of the time spent in each phase, as a tree """
+    # {path: [k calls, total duration, children duration]}
+    stats = {}
+    for path, _, duration, _ in spans:
+        stat = stats.setdefault(path, [0, 0.0, 0.0])
+        stat[0] += 1
+        stat[1] += duration
+    for path, _, duration, _ in spans:
+        if len(path) > 1 and path[:-1] in stats:
+            stats[path[:-1]][2] += duration
+    rss = _max_rss()
+    lines = ['Profile: {0:.1f} ms total, {1} max RSS'.format(
+        total * 1e3, '{0:.1f} MB'.format(rss / 1024.0) if rss else '?'),
+        '{0:>6} {1:>10} {2:>10} {3:>6}  {4}'.format(
+            'calls', 'total ms', 'self ms', '%', 'phase')]
+    starts = {}
+    for path, begin, _, _ in spans:
+        starts[path] = min(starts.get(path, begin), begin)
+    # parents before their children, siblings in the order they started
+    order = dict((path, tuple(starts.get(path[:depth], 0)
+                              for depth in range(1, len(path) + 1)))
+                 for path in stats)
+    for path in sorted(stats, key=order.get):
+        calls, duration, children = stats[path]
+        lines.append('{0:>6} {1:>10.2f} {2:>10.2f} {3:>5.1f}%  {4}{5}'.format(
+            calls, duration * 1e3, max(0, duration - children) * 1e3,
+            100 * duration / total if total else 0,
+            '  ' * (len(path) - 1), path[-1]))
+    return '\n'.join(lines) + '\n'
+
+
+def to_json(spans, start, total):
+    """ JSON-able dict of the recorded spans """
+    return {
+        'total': total,
+        'max_rss_kb': _max_rss(),
+        'spans': [{
+            'name': path[-1],
+            'path': '/'.join(path),
+            'start': begin - start,
+            'duration': duration,
+            'thread': thread,
+        } for path, begin, duration, thread in spans],
+    }
+
+
+def _max_rss():
+    """ Peak memory use of the process in kB, if known """
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on mac os, kilobytes elsewhere
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
@@ -0,0 +1,559 @@
+# coding: utf-8
+# @ Author: "Chris Ward" <cward@redhat.com>
+
+""" idid daemon and its thin unix socket client """
+
+from __future__ import unicode_literals, absolute_import
+
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+
+from idid.utils import log, Date, Logging, IDID_DIR
+
+"""
+Daemon
+------
+``idid --serve`` keeps the parsed config and a pool of open engines (git
+repos, sqlite connections) in a long running process listening on a unix
+socket, ``~/.idid/idid.sock`` (or ``$IDID_SOCKET``). ``bin/idid``
+forwards its argv to the daemon when the socket exists and runs the
+command in-process otherwise, so a logg write costs a socket round
+trip instead of an interpreter start and config/repo load.
+
+Every message is a JSON object prefixed by its length as a 4 byte
+unsigned big endian integer::
+
+    request:  {"argv": [...], "cwd": "/home/...", "env": {...}}
+    reply:    {"ok": true, "result": ..., "output": "..."}
+              {"ok": false, "error": "...", "fallback": false}
+
+Commands are run one at a time by a single worker thread; logg writes
+queued by concurrent clients for the same journal are coalesced into
+a single ``Logg.logg_records`` transaction. Commands which need the
+client's terminal, stdin or stdout (the editor, ``idid import`` from a
+pipe, ``idid export`` to stdout) are answered with ``fallback`` and run
+by the client itself.
+
+The daemon never changes its working directory: paths given on the
+command line are resolved against the client's ``cwd``. Commands of
+clients whose environment (``$HOME``, ``$TZ``, ``$GIT_*``, ...) differs
+from the daemon's, or of configs with relative engine paths, fall back
+to the client too, so they write where they would without the daemon.
+
+The daemon keeps its latest log records in memory; ``{"logs": n}``
+is answered with the last n of them (``idid --server-log``). With
+``idid --serve --log-json`` they are written to stderr as JSON lines.
+"""
+
+SOCKET_PATH = os.environ.get('IDID_SOCKET') or os.path.join(
+    IDID_DIR, 'idid.sock')
+
+HEADER = struct.Struct(str('>I'))
+# refuse absurd frames from a confused peer
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+
+# the client's environment which can change what a command does
+CLIENT_ENV = ('HOME', 'TZ', 'EDITOR', 'GNUPGHOME')
+CLIENT_ENV_PREFIXES = ('GIT_', 'IDID_')
+# options taking a path, and all the options of `idid import` taking
+# a value (the rest of its arguments are files)
+PATH_OPTIONS = ('--config-file', '--output')
+VALUE_OPTIONS = ('--format', '--journal') + PATH_OPTIONS
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#  Protocol
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def send_message(sock, message):
+    """ Send a length prefixed JSON message """
+    data = json.dumps(message).encode('utf-8')
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+
+def recv_message(sock):
+    """ Receive a length prefixed JSON message; None if the peer hung up """
+    header = _recv_exactly(sock, HEADER.size)
+    if header is None:
+        return None
+    size, = HEADER.unpack(header)
+    if size > MAX_MESSAGE_SIZE:
+        raise ValueError('Message too large: {0} bytes'.format(size))
+    data = _recv_exactly(sock, size)
+    if data is None:
+        raise ValueError('Connection closed mid message')
+    return json.loads(data.decode('utf-8'))
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 65536))
+        if not chunk:
+            if chunks:
+                raise ValueError('Connection closed mid message')
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#  Client
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def request(argv, path=None):
+    """
+    Run the idid command line ``argv`` in the daemon
+
+    Returns the reply, or None when no daemon is listening or the
+    daemon asked the client to run the command itself.
+    """
+    reply = _roundtrip(
+        {'argv': list(argv), 'cwd': os.getcwd(), 'env': client_env()}, path)
+    if reply is None or reply.get('fallback'):
+        return None
+    return reply
+
+
+def logs(limit=None, path=None):
+    """ The latest log records of the daemon; None if it isn't running """
+    reply = _roundtrip({'logs': limit or 0}, path)
+    if reply is None:
+        return None
+    return reply['result']
+
+
+def forward(argv, path=None):
+    """
+    Forward ``argv`` to the daemon, printing its output
+
+    Returns True if the daemon ran the command, False if the caller
+    should run it in-process. Errors are re-raised as RuntimeError.
+    """
+    reply = request(argv, path)
+    if reply is None:
+        return False
+    output = reply.get('output')
+    if output:
+        sys.stdout.write(output.encode('utf-8'))
+    if not reply['ok']:
+        raise RuntimeError(reply['error'])
+    return True
+
+
+def client_env(environ=None):
+    """ The variables of the environment which matter to idid commands """
+    environ = os.environ if environ is None else environ
+    return dict(
+        (key, value) for key, value in environ.items()
+        if (key in CLIENT_ENV or key.startswith(CLIENT_ENV_PREFIXES)) and
+        key != 'IDID_SOCKET')
+
+
+def _roundtrip(message, path=None):
+    """ Send message to the daemon and return its reply, if listening """
+    path = path or SOCKET_PATH
+    if not os.path.exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            sock.connect(path)
+        except socket.error as err:
+            # stale socket of a daemon which is gone
+            log.debug('idid daemon not listening: {0}', err)
+            return None
+        send_message(sock, message)
+        return recv_message(sock)
+    finally:
+        sock.close()
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#  Daemon
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class Fallback(Exception):
+    """ The command has to be run by the client itself """
+
+
+class _Job(object):
+    """ A request waiting for the worker, and then for its reply """
+
+    def __init__(self, message):
+        self.argv = message.get('argv') or []
+        self.cwd = message.get('cwd')
+        self.env = message.get('env')
+        self.reply = None
+        self.done = threading.Event()
+        # set by the worker for logg writes
+        self.logg = None
+        self.options = None
+
+    def finish(self, reply):
+        self.reply = reply
+        self.done.set()
+
+
+class _Output(object):
+    """ Captures what a command prints, as unicode """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, text):
+        if isinstance(text, bytes):
+            text = text.decode('utf-8', 'replace')
+        self._chunks.append(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+    def getvalue(self):
+        return ''.join(self._chunks)
+
+
+class Server(object):
+    """ Serve idid commands on a unix socket """
+
+    def __init__(self, path=None):
+        self.path = path or SOCKET_PATH
+        self._queue = []
+        self._queue_cv = threading.Condition()
+        self._sock = None
+        self._running = False
+
+    # ~~~ lifecycle ~~~
+    def bind(self):
+        """ Listen on the socket, replacing a stale one """
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except socket.error:
+                os.remove(self.path)
+            else:
+                raise RuntimeError(
+                    'idid daemon already running on {0}'.format(self.path))
+            finally:
+                probe.close()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o077)
+        try:
+            sock.bind(self.path)
+        finally:
+            os.umask(umask)
+        sock.listen(64)
+        self._sock = sock
+        self._running = True
+        log.info('idid daemon listening on {0}', self.path)
+
+    def serve_forever(self):
+        """ Accept clients until shutdown() is called """
+        if not self._sock:
+            self.bind()
+        worker = threading.Thread(target=self._work, name='idid-worker')
+        worker.daemon = True
+        worker.start()
+        sock = self._sock
+        try:
+            while self._running:
+                try:
+                    conn, _ = sock.accept()
+                except socket.error:
+                    if not self._running:
+                        break
+                    raise
+                handler = threading.Thread(target=self._handle, args=(conn,))
+                handler.daemon = True
+                handler.start()
+        finally:
+            self.shutdown()
+            # let the worker finish the queued jobs
+            with self._queue_cv:
+                self._queue.append(None)
+                self._queue_cv.notify()
+            worker.join()
+
+    def shutdown(self):
+        """ Stop accepting clients and remove the socket """
+        self._running = False
+        sock, self._sock = self._sock, None
+        if sock:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            sock.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    # ~~~ connections ~~~
+    def _handle(self, conn):
+        """ Read requests of one client, queue them and send the replies """
+        try:
+            while True:
+                message = recv_message(conn)
+                if message is None:
+                    break
+                if 'logs' in message:
+                    # no need to wait for the worker
+                    send_message(conn, _logs(message['logs']))
+                    continue
+                job = _Job(message)
+                with self._queue_cv:
+                    self._queue.append(job)
+                    self._queue_cv.notify()
+                job.done.wait()
+                send_message(conn, job.reply)
+        except (socket.error, ValueError) as err:
+            log.debug('idid daemon client error: {0}', err)
+        finally:
+            conn.close()
+
+    # ~~~ worker ~~~
+    def _work(self):
+        """ Run the queued jobs, coalescing writes to the same journal """
+        while True:
+            with self._queue_cv:
+                while not self._queue:
+                    self._queue_cv.wait()
+                jobs, self._queue = self._queue, []
+            if None in jobs:
+                jobs = jobs[:jobs.index(None)]
+                self._run(jobs)
+                break
+            self._run(jobs)
+
+    def _run(self, jobs):
+        from idid.logg import release_logg
+        # Logg's taken from the pool for this run; {(config, journal): Logg}
+        loggs = {}
+        try:
+            self._run_with(jobs, loggs)
+        finally:
+            for logg in loggs.values():
+                release_logg(logg)
+
+    def _run_with(self, jobs, loggs):
+        writes = []
+        for job in jobs:
+            try:
+                self._prepare(job, loggs)
+            except Fallback:
+                job.finish({'ok': False, 'fallback': True, 'error': None})
+                continue
+            except Exception as err:
+                job.finish(_error(err))
+                continue
+            if job.logg is None:
+                # queries run right away, in order
+                self._command(job)
+            else:
+                writes.append(job)
+        for batch in _batches(writes):
+            self._write(batch)
+
+    def _prepare(self, job, loggs):
+        """ Parse the job's argv; open the Logg of logg writes """
+        from idid import cli
+        if job.env != client_env():
+            # eg, another $HOME or $TZ than the daemon's
+            raise Fallback()
+        job.argv = _resolve_paths(job.argv, job.cwd or os.getcwd())
+        if _relative_engines(job.argv):
+            raise Fallback()
+        command, arguments = cli.split_command(job.argv)
+        with _log_level():
+            if command == 'import':
+                options = cli.ImportOptions(arguments=arguments).parse()
+                if '-' in options.paths:
+                    # reads the client's stdin
+                    raise Fallback()
+            if command == 'export':
+                options = cli.ExportOptions(arguments=arguments).parse()
+                if options.output == '-':
+                    # streamed to the client's stdout, not into a reply
+                    raise Fallback()
+            if command:
+                return
+            options = cli.LoggOptions(arguments=arguments).parse()
+        if options.logg == '--':
+            # the editor needs the client's terminal
+            raise Fallback()
+        job.options = options
+        job.logg = self._logg(options, loggs)
+
+    def _logg(self, options, loggs):
+        """ Pooled Logg of the options' journal, one per journal and run """
+        from idid.logg import acquire_logg
+        # load_config_file() returns a new config once the file changed
+        key = (id(options.config), options.journal)
+        if key not in loggs:
+            loggs[key] = acquire_logg(options.config, options.journal)
+        return loggs[key]
+
+    def _command(self, job):
+        from idid import cli
+        output = _Output()
+        stdout, sys.stdout = sys.stdout, output
+        try:
+            with _log_level():
+                result = cli.main(job.argv)
+        except Exception as err:
+            reply = _error(err)
+        else:
+            reply = {'ok': True, 'result': _jsonable(result)}
+        finally:
+            sys.stdout = stdout
+        reply['output'] = output.getvalue()
+        job.finish(reply)
+
+    def _write(self, batch):
+        logg = batch[0].logg
+        try:
+            if len(batch) == 1:
+                options = batch[0].options
+                results = [logg.logg_record(options.logg, options.date)]
+            else:
+                logg.logg_records(
+                    (job.options.date, job.options.logg) for job in batch)
+                results = [_logg_line(logg, job.options) for job in batch]
+        except Exception as err:
+            for job in batch:
+                job.finish(_error(err))
+        else:
+            for job, result in zip(batch, results):
+                job.finish({'ok': True, 'result': _jsonable(result)})
+
+
+def serve(path=None, log_json=False):
+    """
+    Run the idid daemon until interrupted
+
+    The latest log records are kept for ``logs()``; with log_json, they
+    are written to stderr as JSON lines instead of the usual output.
+    """
+    import signal
+    Logging('did').enable_json(stream=sys.stderr if log_json else None,
+                               only=log_json)
+    server = Server(path)
+    server.bind()
+
+    def stop(signum, frame):
+        server.shutdown()
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#  Helpers
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def _batches(jobs):
+    """ Group consecutive jobs writing to the same Logg """
+    batch = []
+    for job in jobs:
+        if batch and batch[0].logg is not job.logg:
+            yield batch
+            batch = []
+        batch.append(job)
+    if batch:
+        yield batch
+
+
+def _logg_line(logg, options):
+    """ The txt formatted logg line of a coalesced write """
+    record = options.logg
+    if isinstance(record, bytes):
+        record = record.decode('utf-8')
+    return logg._logg_format.format(
+        journal=options.journal, date=Date(options.date),
+        record=record.strip())
+
+
+def _resolve_paths(argv, cwd):
+    """ The argv with the paths it gives made absolute, against cwd """
+    from idid import cli
+    command, arguments = cli.split_command(argv)
+
+    def resolve(path):
+        return os.path.join(cwd, os.path.expanduser(path))
+    resolved = []
+    previous = None
+    for arg in arguments:
+        option = arg.split('=', 1)[0]
+        if previous in PATH_OPTIONS:
+            resolved.append(resolve(arg))
+        elif option in PATH_OPTIONS and '=' in arg:
+            resolved.append('{0}={1}'.format(
+                option, resolve(arg.split('=', 1)[1])))
+        elif (command == 'import' and previous not in VALUE_OPTIONS and
+                arg != '-' and not arg.startswith('-')):
+            resolved.append(resolve(arg))
+        else:
+            resolved.append(arg)
+        previous = arg if arg in VALUE_OPTIONS else None
+    # keep the command, or the '--' escaping a logg, as it was
+    return argv[:len(argv) - len(arguments)] + resolved
+
+
+def _relative_engines(argv):
+    """ True if the config the argv uses has engines at relative paths """
+    import argparse
+    from idid import cli
+    from idid.logg import Logg, load_config_file
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--config-file', default=cli.DEFAULT_IDID_CONFIG)
+    path = parser.parse_known_args(argv)[0].config_file
+    if not os.path.exists(path):
+        # the command itself reports it
+        return False
+    config = load_config_file(path)
+    for jconf in (config.get('journals') or {}).values():
+        engine = (jconf or {}).get('engine', config.get('default_engine'))
+        try:
+            _, engine_path = Logg._parse_engine(engine)
+        except Exception:
+            continue
+        if not os.path.isabs(engine_path):
+            return True
+    return False
+
+
+def _logs(limit):
+    handler = getattr(log, 'json_handler', None)
+    records = handler.records(limit) if handler else []
+    return {'ok': True, 'result': records}
+
+
+def _error(err):
+    log.debug('idid daemon command failed: {0!r}', err)
+    return {'ok': False, 'error': unicode(err), 'fallback': False}
+
+
+def _jsonable(result):
+    if result is None or isinstance(result, (bool, int, long, float)):
+        return result
+    return unicode(result)
+
+
+class _log_level(object):
+    """ Restore the log level a client's --debug or --quiet changed """
+
+    def __enter__(self):
+        self.level = log.level
+
+    def __exit__(self, *exc_info):
+        log.setLevel(self.level)
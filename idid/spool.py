@@ -0,0 +1,241 @@
+# coding: utf-8
+# @ Author: "Chris Ward" <cward@redhat.com>
+
+""" Spool files of loggs waiting to be written to a journal """
+
+from __future__ import unicode_literals, absolute_import
+
+import atexit
+import fcntl
+import hashlib
+import json
+import os
+import struct
+import threading
+import zlib
+
+from idid.utils import log, IDID_DIR
+
+"""
+Spool
+-----
+Loggs which can't or shouldn't be written to a journal right now (eg, a
+``sync_to`` target on an unreachable disk, or any journal in ``spool``
+mode) are appended to the journal's spool and written to the journal
+later, in batches, by ``Spool.flush()``.
+
+A spool file starts with the offset up to which its loggs were flushed,
+followed by one frame per logg::
+
+    header: flushed offset (8 bytes)
+    frame:  magic (2 bytes), payload size, payload crc32, payload
+
+where the payload is the JSON of ``{"date": ..., "record": ...}``.
+Appends hold an exclusive ``flock`` on the file, so concurrent idid
+processes never lose or interleave a frame. A frame torn by a crash is
+detected by its size and crc and skipped. The flushed offset is saved
+after every batch, so a flush interrupted by a crash resumes where it
+left off; only the batch being written at the time may be written
+twice. Fully flushed spools are removed.
+"""
+
+SPOOL_DIR = os.path.join(IDID_DIR, 'spool')
+# loggs written to the journal at a time while flushing
+BATCH_SIZE = 1000
+
+HEADER = struct.Struct(b'>Q')
+FRAME = struct.Struct(b'>2sII')
+# can't occur in the (ascii) JSON payloads, so torn frames are skipped
+# by looking for the next magic
+MAGIC = b'\xe1\xd1'
+
+
+class Spool(object):
+    """ Append-only file of (record, date) pairs """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = '{0}.lock'.format(path)
+
+    @classmethod
+    def for_journal(cls, engine, journal, kind='sync'):
+        """ The spool of a journal, named after its engine and journal """
+        key = '{0}\0{1}'.format(engine, journal).encode('utf-8')
+        name = '{0}-{1}.spool'.format(kind, hashlib.sha1(key).hexdigest()[:16])
+        return cls(os.path.join(SPOOL_DIR, name))
+
+    def extend(self, records):
+        """ Append (record, date) pairs """
+        frames = [_frame(record, date) for record, date in records]
+        if not frames:
+            return
+        k_records = len(frames)
+        directory = os.path.dirname(self.path)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        fd = self._open_locked()
+        try:
+            if os.fstat(fd).st_size < HEADER.size:
+                # new, or its header torn by a crash
+                os.ftruncate(fd, 0)
+                frames.insert(0, HEADER.pack(HEADER.size))
+            data = b''.join(frames)
+            while data:
+                data = data[os.write(fd, data):]
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        log.debug('Spooled {0} records to {1}', k_records, self.path)
+
+    def flush(self, write, batch_size=BATCH_SIZE):
+        """
+        Pass the spooled (record, date) pairs to write(), in batches
+
+        Only one process (or thread) flushes a spool at a time; the
+        others wait for it. Appends aren't blocked while flushing. If
+        write() fails, the rest of the loggs stay spooled and the error
+        is raised. Returns the number of loggs written.
+        """
+        if not os.path.exists(self.path):
+            return 0
+        k_records = 0
+        with open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                spool = open(self.path, 'r+b')
+            except IOError:
+                # flushed by somebody else meanwhile
+                return 0
+            with spool:
+                flushed, entries, end = _read(spool)
+                for start in range(0, len(entries), batch_size):
+                    batch = entries[start:start + batch_size]
+                    if not _flushes.start():
+                        # exiting; the rest is flushed next time
+                        return k_records
+                    try:
+                        write([record for _, record in batch])
+                        _write_header(spool, batch[-1][0])
+                    finally:
+                        _flushes.finish()
+                    k_records += len(batch)
+                if end > flushed and not entries:
+                    # nothing but corrupt frames
+                    _write_header(spool, end)
+            self._remove_flushed(end)
+        return k_records
+
+    def __len__(self):
+        try:
+            with open(self.path, 'rb') as spool:
+                return len(_read(spool)[1])
+        except IOError:
+            return 0
+
+    def _open_locked(self):
+        """ Exclusively locked O_APPEND descriptor of the current file """
+        while True:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                         0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.stat(self.path).st_ino == os.fstat(fd).st_ino:
+                    return fd
+            except OSError:
+                pass
+            # removed by a flush while we waited for the lock
+            os.close(fd)
+
+    def _remove_flushed(self, offset):
+        """ Remove the spool file, unless something was appended """
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            if os.fstat(fd).st_size <= offset:
+                os.remove(self.path)
+        finally:
+            os.close(fd)
+
+
+class _Flushes(object):
+    """ Batches being written by the flushes of this process """
+
+    def __init__(self):
+        self.stopping = False
+        self._active = 0
+        self._done = threading.Condition()
+
+    def start(self):
+        """ Start writing a batch, unless exiting """
+        with self._done:
+            if self.stopping:
+                return False
+            self._active += 1
+            return True
+
+    def finish(self):
+        with self._done:
+            self._active -= 1
+            self._done.notify_all()
+
+    def stop(self):
+        """ Let the batches being written finish, start no more """
+        with self._done:
+            self.stopping = True
+            while self._active:
+                self._done.wait(1)
+
+
+_flushes = _Flushes()
+# background flushes mustn't be killed in the middle of a batch
+atexit.register(_flushes.stop)
+
+
+def _frame(record, date):
+    payload = json.dumps({'date': date, 'record': record}).encode('ascii')
+    return FRAME.pack(MAGIC, len(payload),
+                      zlib.crc32(payload) & 0xffffffff) + payload
+
+
+def _write_header(spool, flushed):
+    spool.seek(0)
+    spool.write(HEADER.pack(flushed))
+    spool.flush()
+    os.fsync(spool.fileno())
+
+
+def _read(spool):
+    """
+    Read the loggs of the spool which weren't flushed yet
+
+    Returns the flushed offset, a list of (end offset, (record, date))
+    and the offset where the complete frames end.
+    """
+    spool.seek(0)
+    data = spool.read()
+    if len(data) < HEADER.size:
+        return HEADER.size, [], HEADER.size
+    flushed = HEADER.unpack_from(data)[0]
+    entries = []
+    offset = flushed
+    while offset + FRAME.size <= len(data):
+        magic, size, crc = FRAME.unpack_from(data, offset)
+        start = offset + FRAME.size
+        payload = data[start:start + size]
+        if magic == MAGIC and len(payload) < size:
+            # still being written, or torn at the very end
+            break
+        if magic != MAGIC or zlib.crc32(payload) & 0xffffffff != crc:
+            skip = data.find(MAGIC, offset + 1)
+            skip = len(data) if skip < 0 else skip
+            log.warn('Skipping {0} corrupt bytes of spool {1}',
+                     skip - offset, spool.name)
+            offset = skip
+            continue
+        entry = json.loads(payload.decode('ascii'))
+        offset = start + size
+        entries.append((offset, (entry['record'], entry['date'])))
+    return flushed, entries, offset
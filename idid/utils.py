@@ -4,18 +4,21 @@
 
 from __future__ import unicode_literals, absolute_import
 
+import calendar
+from collections import deque
 import datetime
+import functools
+import importlib
 import os
-from pprint import pformat as pretty  # imported, but not used # NOQA
+import pkgutil
 import re
-import shutil
 import sys
 import logging
-import unicodedata
+import time
 
-from dateutil.relativedelta import relativedelta as delta
-from dateutil.parser import parse as dt_parse
-import pytz
+# dateutil, shutil and unicodedata are imported only where used (and
+# pytz not at all); idid is called synchronously from shell prompts and
+# editors, so keep the imports of a plain txt write as small as possible
 
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -38,11 +41,27 @@ LOG_DEBUG = logging.DEBUG
 LOG_CACHE = 7
 LOG_DATA = 4
 LOG_ALL = 1
+# log records kept in memory by the JSONHandler
+LOG_BUFFER_SIZE = 1000
 
 # Extract name and email from string
 # See: http://stackoverflow.com/questions/14010875
 EMAIL_REGEXP = re.compile(r'(?:"?([^"]*)"?\s)?(?:<?(.+@[^>]+)>?)')
 
+# Report periods understood by Date.period()
+PERIODS = ['today', 'yesterday', 'week', 'month', 'quarter', 'year']
+
+# Dates Date() parses without dateutil; YYYY-MM-DD, optionally followed by
+# [T ]HH:MM[:SS[.ffffff]] and a Z or [+-]HH[:]MM utc offset
+DATE_REGEXP = re.compile(
+    r'^(\d{4})-(\d{2})-(\d{2})'
+    r'(?:[T ](\d{2}):(\d{2})(?::(\d{2})(?:\.(\d{1,6})\d*)?)?)?'
+    r'(?:\s*(z|[+-]\d{2}):?(\d{2})?)?$', re.IGNORECASE)
+# Strings without digits are only dates if they name a month or weekday
+DATE_WORDS_REGEXP = re.compile(
+    r'\b(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec|'
+    r'mon|tue|wed|thu|fri|sat|sun)', re.IGNORECASE)
+
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 #  Utils
@@ -170,6 +189,7 @@ def ascii(text):
     """ Transliterate special unicode characters into pure ascii """
     if not isinstance(text, unicode):
         text = unicode(text)
+    import unicodedata
     return unicodedata.normalize('NFKD', text).encode('ascii', 'ignore')
 
 
@@ -206,6 +226,13 @@ class Logging(object):
     # All levels
     LEVELS = "CRITICAL DEBUG ERROR FATAL INFO NOTSET WARN WARNING".split()
 
+    # Custom level names
+    NAMES = {
+        LOG_ALL: "ALL",
+        LOG_DATA: "DATA",
+        LOG_CACHE: "CACHE",
+    }
+
     # Default log level is WARN
     _level = LOG_WARN
 
@@ -223,36 +250,53 @@ class Logging(object):
             self.set()
 
     class ColoredFormatter(logging.Formatter):
-        """ Custom color formatter for logging """
+        """
+        Custom color formatter for logging
+
+        Whether to color is decided once per stream (and color mode),
+        not for every record.
+        """
+        def __init__(self, stream=None):
+            logging.Formatter.__init__(self)
+            self.stream = stream
+            # color mode the prefixes were made for; {levelno: prefix}
+            self._mode = None
+            self._prefixes = {}
+
         def format(self, record):
-            # Handle custom log level names
-            if record.levelno == LOG_ALL:
-                levelname = "ALL"
-            elif record.levelno == LOG_DATA:
-                levelname = "DATA"
-            elif record.levelno == LOG_CACHE:
-                levelname = "CACHE"
-            else:
-                levelname = record.levelname
-            # Map log level to appropriate color
+            mode = Coloring().get()
+            if mode != self._mode:
+                self._mode = mode
+                self._prefixes = {}
             try:
-                colour = Logging.COLORS[record.levelno]
+                prefix = self._prefixes[record.levelno]
             except KeyError:
-                colour = "black"
+                prefix = self._prefixes[record.levelno] = self._prefix(record)
+            return u"{0} {1}".format(prefix, record.getMessage())
+
+        def _prefix(self, record):
+            # Handle custom log level names
+            levelname = Logging.NAMES.get(record.levelno, record.levelname)
+            # Map log level to appropriate color
+            colour = Logging.COLORS.get(record.levelno, "black")
             # Color the log level, use brackets when coloring off
-            if Coloring().enabled():
-                level = color(" " + levelname + " ", "lightwhite", colour)
-            else:
-                level = "[{0}]".format(levelname)
-            return u"{0} {1}".format(level, record.getMessage())
+            if Coloring().enabled(self.stream):
+                return color(" " + levelname + " ", "lightwhite", colour)
+            return "[{0}]".format(levelname)
 
     @staticmethod
     def _create_logger(name='did', level=None):
         """ Create idid logger """
-        # Create logger, handler and formatter
-        logger = logging.getLogger(name)
+        # Create logger, handler and formatter; messages are formatted
+        # with their args only once emitted (see _Logger)
+        logger_class = logging.getLoggerClass()
+        logging.setLoggerClass(_Logger)
+        try:
+            logger = logging.getLogger(name)
+        finally:
+            logging.setLoggerClass(logger_class)
         handler = logging.StreamHandler()
-        handler.setFormatter(Logging.ColoredFormatter())
+        handler.setFormatter(Logging.ColoredFormatter(handler.stream))
         logger.addHandler(handler)
         # Save log levels in the logger itself (backward compatibility)
         for level in Logging.LEVELS:
@@ -261,9 +305,9 @@ class Logging(object):
         logger.DATA = LOG_DATA
         logger.CACHE = LOG_CACHE
         logger.ALL = LOG_ALL
-        logger.cache = lambda message: logger.log(LOG_CACHE, message) # NOQA
-        logger.data = lambda message: logger.log(LOG_DATA, message) # NOQA
-        logger.all = lambda message: logger.log(LOG_ALL, message) # NOQA
+        logger.cache = lambda *args: logger.log(LOG_CACHE, *args) # NOQA
+        logger.data = lambda *args: logger.log(LOG_DATA, *args) # NOQA
+        logger.all = lambda *args: logger.log(LOG_ALL, *args) # NOQA
         return logger
 
     def set(self, level=None):
@@ -295,6 +339,119 @@ class Logging(object):
         """ Get the current log level """
         return self.logger.level
 
+    def enable_json(self, capacity=LOG_BUFFER_SIZE, stream=None, only=False):
+        """
+        Keep the latest log records in memory, as JSON-able dicts
+
+        With stream, the records are written to it as JSON lines too;
+        with only, instead of the colored output. Returns the handler.
+        """
+        handler = getattr(self.logger, 'json_handler', None)
+        if handler is None:
+            handler = self.logger.json_handler = JSONHandler(capacity, stream)
+            self.logger.addHandler(handler)
+        else:
+            handler.stream = stream
+        if only:
+            for other in self.logger.handlers[:]:
+                if other is not handler:
+                    self.logger.removeHandler(other)
+        return handler
+
+
+class _LogRecord(logging.LogRecord):
+    """ Log record formatting its message with str.format(), once """
+
+    _message = None
+
+    def getMessage(self):
+        if self._message is not None:
+            return self._message
+        args, self.args = self.args, None
+        try:
+            message = logging.LogRecord.getMessage(self)
+        finally:
+            self.args = args
+        if args and '{' not in message:
+            # %-style message of a logger user other than idid
+            message = message % args
+        elif args:
+            # a single dict argument is unpacked by LogRecord
+            if isinstance(args, dict):
+                message = message.format(**args)
+            else:
+                message = message.format(*args)
+        self._message = message
+        return message
+
+
+class _Logger(logging.Logger):
+    """
+    Logger taking str.format() style arguments::
+
+        log.debug('Saving [{0}] to {1}', journal, path)
+
+    The message is only formatted if the record is emitted, so debug
+    messages cost next to nothing while debugging is off. Messages
+    without any ``{`` are formatted with ``%`` as usual.
+    """
+
+    def makeRecord(self, name, level, fn, lno, msg, args, exc_info,
+                   func=None, extra=None):
+        record = _LogRecord(name, level, fn, lno, msg, args, exc_info, func)
+        for key, value in (extra or {}).items():
+            if key in ["message", "asctime"] or key in record.__dict__:
+                raise KeyError(
+                    "Attempt to overwrite {0!r} in LogRecord".format(key))
+            record.__dict__[key] = value
+        return record
+
+
+class JSONHandler(logging.Handler):
+    """
+    Keep the latest log records as JSON-able dicts
+
+    The last ``capacity`` records are kept in a ring buffer, eg for the
+    daemon to tell what it has been up to. With a stream, every record
+    is also written to it as a JSON line.
+    """
+
+    def __init__(self, capacity=LOG_BUFFER_SIZE, stream=None):
+        logging.Handler.__init__(self)
+        self.buffer = deque(maxlen=capacity)
+        self.stream = stream
+
+    def emit(self, record):
+        try:
+            entry = {
+                'time': datetime.datetime.utcfromtimestamp(
+                    record.created).isoformat() + 'Z',
+                'level': Logging.NAMES.get(record.levelno, record.levelname),
+                'message': record.getMessage(),
+                'logger': record.name,
+                'thread': record.threadName,
+                'where': '{0}:{1}'.format(record.module, record.lineno),
+            }
+            if record.exc_info:
+                entry['exception'] = logging.Formatter().formatException(
+                    record.exc_info)
+            self.buffer.append(entry)
+            if self.stream:
+                import json
+                self.stream.write(json.dumps(entry) + '\n')
+                self.stream.flush()
+        except Exception:
+            self.handleError(record)
+
+    def records(self, limit=None):
+        """ The latest records, oldest first """
+        self.acquire()
+        try:
+            records = list(self.buffer)
+        finally:
+            self.release()
+        return records[-limit:] if limit else records
+
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 #  Coloring
@@ -377,19 +534,20 @@ class Coloring(object):
             raise RuntimeError("Invalid color mode '{0}'".format(mode))
         self._mode = mode
         log.debug(
-            "Coloring {0} ({1})".format(
-                "enabled" if self.enabled() else "disabled",
-                self.MODES[self._mode]))
+            "Coloring {0} ({1})",
+            "enabled" if self.enabled() else "disabled",
+            self.MODES[self._mode])
 
     def get(self):
         """ Get the current color mode """
         return self._mode
 
-    def enabled(self):
-        """ True if coloring is currently enabled """
+    def enabled(self, stream=None):
+        """ True if coloring is enabled for the stream (stdout) """
         # In auto-detection mode color enabled when terminal attached
         if self._mode == COLOR_AUTO:
-            return sys.stdout.isatty()
+            stream = stream or sys.stdout
+            return hasattr(stream, 'isatty') and stream.isatty()
         return self._mode == COLOR_ON
 
 
@@ -410,6 +568,7 @@ def remove_path(path):
     if os.path.exists(path):
         if os.path.isdir(path):
             # a dir
+            import shutil
             shutil.rmtree(path)
         else:
             # a file
@@ -417,21 +576,116 @@ def remove_path(path):
     assert not os.path.exists(path)
 
 
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#  Lazy Imports
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class LazyModule(object):
+    """ Stand-in for a module which is imported on first attribute use """
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        # sys.modules caches the import, so later lookups are cheap
+        return getattr(importlib.import_module(self._name), attr)
+
+    def __repr__(self):
+        return '<lazy module {0!r}>'.format(self._name)
+
+
+def available(name):
+    """ Check if a top-level module can be imported, without importing it """
+    return pkgutil.find_loader(name) is not None
+
+
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 #  Date
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class _UTC(datetime.tzinfo):
+    """ UTC timezone (importing pytz just for utc is slow) """
+    _zero = datetime.timedelta(0)
+
+    def utcoffset(self, dt):
+        return self._zero
+
+    def dst(self, dt):
+        return self._zero
+
+    def tzname(self, dt):
+        return 'UTC'
+
+    def __reduce__(self):
+        return _utc, ()
+
+    def __repr__(self):
+        return '<UTC>'
+
+
+def _utc():
+    return UTC
+
+
+UTC = _UTC()
+
+
+# (second, datetime) of the last today() call
+_today = (None, None)
+
+
 def today():
     """ Return today's datetime as UTC """
-    # Today's date (UTC)
-    return datetime.datetime.utcnow().replace(tzinfo=pytz.utc)
+    # Today's date (UTC); memoized for the current second
+    global _today
+    second = int(time.time())
+    if _today[0] != second:
+        _today = (second, datetime.datetime.utcnow().replace(tzinfo=UTC))
+    return _today[1]
+
+
+def parse_date(text):
+    """
+    Parse common date strings into a datetime, quickly
+
+    ISO dates and datetimes (see DATE_REGEXP) are parsed with a regexp,
+    strings which can't be dates are rejected right away, and only the
+    rest is passed on to dateutil. Raises ValueError for non-dates.
+    """
+    match = DATE_REGEXP.match(text)
+    if match:
+        (year, month, day, hour, minute, second, micro,
+         tz_hours, tz_minutes) = match.groups()
+        date = datetime.datetime(
+            int(year), int(month), int(day), int(hour or 0),
+            int(minute or 0), int(second or 0),
+            int(micro) * 10 ** (6 - len(micro)) if micro else 0)
+        if tz_hours is None:
+            return date
+        if tz_hours not in 'zZ':
+            offset = int(tz_hours) * 60 + int(tz_minutes or 0) * (
+                -1 if tz_hours[0] == '-' else 1)
+            date -= datetime.timedelta(minutes=offset)
+        return date.replace(tzinfo=UTC)
+    if not any(char.isdigit() for char in text) and \
+            not DATE_WORDS_REGEXP.search(text):
+        # eg, a journal name or a logg record
+        raise ValueError('Not a date: {0}'.format(text))
+    from dateutil.parser import parse as dt_parse
+    return dt_parse(text)
 
 
 # FIXME: turn this into a FUNCTION ##############
 
+@functools.total_ordering
 class Date(object):
-    """ Date parsing for common word and string formats """
+    """ Date parsing for common word and string formats
 
-    fmt = None
+    Dates are ordered and hashed by their (UTC) datetime, regardless of
+    the output format.
+    """
+
+    __slots__ = ('date', 'fmt')
 
     def __init__(self, date=None, fmt=None):
         """ Parse the date string """
@@ -451,9 +705,9 @@ class Date(object):
                 date = today()
             elif date == "yesterday":
                 # produces datetime.date()
-                date = today() - delta(days=1)
+                date = today() - datetime.timedelta(days=1)
             elif isinstance(date, (unicode, str)):
-                date = dt_parse(date)
+                date = parse_date(date)
             else:
                 raise ValueError
         except ValueError:
@@ -464,19 +718,95 @@ class Date(object):
         # Make sure we're a datetime, not date
         if type(date) is datetime.date:
             date = datetime.datetime(
-                date.year, date.month, date.day, 0, 0, 0, tzinfo=pytz.utc)
+                date.year, date.month, date.day, 0, 0, 0, tzinfo=UTC)
 
         # FIXME: Make sure we've converted to in UTC
         # if there is no tz info in the datetime object
         # assume it's UTC (WARNING: AMIGUOUS...)
-        if date.tzinfo:
-            log.debug('Timezone detected [{0}]; converting to UTC'.format(
-                date.tzinfo))
-            date = date.astimezone(pytz.utc)
+        if date.tzinfo and date.tzinfo is not UTC:
+            log.debug('Timezone detected [{0}]; converting to UTC',
+                      date.tzinfo)
+            date = date.astimezone(UTC)
         # Makesure the datetime is tz-aware (UTC)
-        date = date.replace(tzinfo=pytz.utc)
+        date = date.replace(tzinfo=UTC)
         self.date = date
 
+    @staticmethod
+    def period(argument=None):
+        """
+        Detect the desired time period from the argument
+
+        Returns a (since, until, period) tuple of Date's (both inclusive)
+        and the period description. Periods are today, yesterday, week,
+        month, quarter and year, optionally preceded by 'last'::
+
+            Date.period('week') ......... this week, Monday to Sunday
+            Date.period('last month') ... the whole previous month
+            Date.period() ............... this week
+        """
+        if isinstance(argument, (list, tuple)):
+            argument = ' '.join(argument)
+        words = (argument or 'week').lower().split()
+        last = 'last' in words
+        words = [word for word in words if word != 'last'] or ['week']
+        if len(words) > 1 or words[0] not in PERIODS:
+            raise ValueError("Invalid period '{0}', use one of {1}".format(
+                argument, listed(PERIODS, quote="'")))
+        period = words[0]
+        day = today().date()
+        one_day = datetime.timedelta(days=1)
+        if period == 'yesterday':
+            since = until = day - one_day
+        elif period == 'today':
+            since = until = day - one_day if last else day
+        else:
+            from dateutil.relativedelta import relativedelta as delta
+            if period == 'week':
+                since = day - delta(days=day.weekday())
+                step = delta(weeks=1)
+            elif period == 'month':
+                since = day.replace(day=1)
+                step = delta(months=1)
+            elif period == 'quarter':
+                since = day.replace(month=(day.month - 1) // 3 * 3 + 1, day=1)
+                step = delta(months=3)
+            else:
+                since = day.replace(month=1, day=1)
+                step = delta(years=1)
+            if last:
+                since -= step
+            until = since + step - one_day
+        period = '{0}{1}'.format('last ' if last else '', period)
+        return Date(since), Date(until), period
+
+    @property
+    def timestamp(self):
+        """ Seconds since the epoch (UTC) """
+        return calendar.timegm(self.date.utctimetuple())
+
+    @property
+    def day(self):
+        """ Days since 0001-01-01, the day's proleptic Gregorian ordinal """
+        return self.date.toordinal()
+
+    def __eq__(self, other):
+        if not isinstance(other, Date):
+            return NotImplemented
+        return self.date == other.date
+
+    def __ne__(self, other):
+        if not isinstance(other, Date):
+            return NotImplemented
+        return self.date != other.date
+
+    def __lt__(self, other):
+        if not isinstance(other, Date):
+            return NotImplemented
+        return self.date < other.date
+
+    def __hash__(self):
+        return hash(self.date)
+
     def __str__(self):
         """ Ascii version of the string representation """
         return ascii(unicode(self))
@@ -25,7 +25,6 @@ __desc__ = 'idid - Save and share your daily activities!'
 __scripts__ = ['bin/idid']
 __irequires__ = [
     'python_dateutil==2.4.2',
-    'pytz==2015.6',
     'GitPython==2.0.5',
     'configure==0.5',
 ]
@@ -34,6 +33,8 @@ __xrequires__ = {
     # `develop` usage: python setup.py -e .[tests,docs]
     'tests': [
         'pytest==2.7.2',
+        # only the tests compare against pytz timezones
+        'pytz==2015.6',
     ],
     'docs': [
         'sphinx==1.3.1',
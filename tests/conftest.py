@@ -0,0 +1,19 @@
+# coding: utf-8
+# @ Author: "Chris Ward" <cward@redhat.com>
+
+""" Fixtures shared by all the tests """
+
+from __future__ import unicode_literals, absolute_import
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def clear_pools(request):
+    """ Don't let the Logg's and repos pooled by a test leak into others """
+    from idid import logg
+
+    def clear():
+        logg._loggs.clear()
+        logg._repos.clear()
+    request.addfinalizer(clear)
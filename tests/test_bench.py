@@ -0,0 +1,26 @@
+# coding: utf-8
+# @ Author: "Chris Ward" <cward@redhat.com>
+
+""" Make sure the benchmarks keep working """
+
+from __future__ import unicode_literals, absolute_import
+
+import json
+
+from benchmarks import bench
+
+
+def test_bench(tmpdir):
+    output = str(tmpdir.join('bench.json'))
+    assert bench.main(['--quick', '--output', output]) == 0
+    with open(output) as stdin:
+        results = json.load(stdin)
+    names = set(results['results'])
+    assert 'logg_record/txt/100' in names
+    assert set('date/{0}'.format(name) for name, _ in bench.DATES) <= names
+    assert 'logg_factory/file-uncached' in names
+    assert results['results']['date/iso-date']['min'] > 0
+
+    # nothing is a regression with an infinite threshold
+    assert bench.main(['--quick', '--filter', 'date/', '--compare', output,
+                       '--threshold', 'inf']) == 0
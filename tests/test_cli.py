@@ -5,8 +5,10 @@
 
 from __future__ import unicode_literals, absolute_import
 
+import io
 import os
 import re
+import subprocess
 import sys
 import pytest
 
@@ -127,6 +129,38 @@ def test_default_logg():
     assert r == RESULT_OK_MIN
 
 
+def test_txt_logg_startup_imports():
+    # a txt write must not pay for importing the git/sqlite backends
+    script = '; '.join([
+        'import sys',
+        'from idid import cli',
+        'cli.main({0!r} + ["--config-file", {1!r}])'.format(
+            [str(arg) for arg in ARGS_OK_TXT], str(EXAMPLE_CONFIG)),
+        'print(" ".join(sys.modules))'])
+    env = dict(os.environ, PYTHONPATH=os.path.join(PATH, '..'))
+    modules = subprocess.check_output(
+        [sys.executable, '-c', script], env=env).split()
+    for heavy in ('git', 'pytz', 'sqlite3', 'dateutil'):
+        assert heavy not in modules
+    assert len(modules) < 250
+
+
+def test_spooled_logg_written_before_exit(tmpdir):
+    # bin/idid exits right after spooling; the flush must finish first
+    config = tmpdir.join('config.yaml')
+    config.write('\n'.join([
+        'default_engine: git://{0}'.format(tmpdir.join('logg.git')),
+        'journals:', '  joy: {spool: true}', '']))
+    env = dict(os.environ, HOME=str(tmpdir),
+               PYTHONPATH=os.path.join(PATH, '..'))
+    subprocess.check_call(
+        [sys.executable, os.path.join(PATH, '..', 'bin', 'idid'), 'joy',
+         'spooled', '--config-file', str(config)], env=env)
+    assert not tmpdir.join('.idid', 'spool').listdir('*.spool')
+    l = idid.logg.Logg(str(config), 'joy')
+    assert [r.record for r in l.iter_records()] == ['spooled']
+
+
 def test_default_git_logg():
     clean_git(TMP_GIT)
     r = idid.cli.main(ARGS_OK_GIT, EXAMPLE_CONFIG)
@@ -159,6 +193,209 @@ def test_logg_api():
     # assert re.search(now, r)
 
 
+def test_import():
+    clean_git(TMP_GIT)
+    path = '/tmp/logg-import.txt'
+    with open(path, 'w') as f:
+        f.write('<joy> [2015-10-21]:: test 1 2 3\n')
+        f.write('<proj> [2015-10-22]:: test 4 5 6\n\n')
+        f.write('<joy> [2015-10-23]:: test 7 8 9\n')
+    try:
+        r = idid.cli.main(['import', '--journal', 'joy', path], EXAMPLE_CONFIG)
+        assert r == 3
+        # default journal isn't stored in git
+        with pytest.raises(RuntimeError):
+            idid.cli.main(['import', path], EXAMPLE_CONFIG)
+    finally:
+        idid.utils.remove_path(path)
+
+    l = idid.logg.GitLogg(config=EXAMPLE_CONFIG, journal='joy')
+    commits = list(l._logg_repo.iter_commits('joy'))
+    assert len(commits) == 4
+    assert commits[0].message == 'test 7 8 9\n'
+    assert commits[0].authored_date == 1445558400
+    # later appends continue the imported history
+    idid.cli.main(ARGS_OK_GIT, EXAMPLE_CONFIG)
+    assert len(list(l._logg_repo.iter_commits('joy'))) == 5
+
+
+def test_import_journal_engines(tmpdir):
+    def engine(name):
+        return 'git://{0}'.format(tmpdir.join(name))
+    config = {
+        'default_engine': engine('one'),
+        'journals': {'joy': {}, 'work': {}, 'side': {'engine': engine('two')},
+                     'notes': {'engine': 'txt://{0}'.format(
+                         tmpdir.join('notes.txt'))}},
+    }
+    path = tmpdir.join('loggs.txt')
+    path.write('<joy> [2015-10-21]:: joy 1\n'
+               '<side> [2015-10-21]:: side 1\n'
+               '<work> [2015-10-22]:: work 1\n'
+               '<joy> [2015-10-23]:: joy 2\n')
+    # each logg goes to the engine of its own journal
+    assert idid.cli.main(['import', str(path)], config) == 4
+    for journal, records in [('joy', ['joy 2', 'joy 1']),
+                             ('work', ['work 1']), ('side', ['side 1'])]:
+        logg = idid.logg.Logg(config, journal)
+        assert [r.record for r in logg.iter_records()] == records
+    one = idid.logg.Logg(config, 'joy')._logg_repo
+    assert one.git.rev_parse('--verify', '-q', 'side',
+                             with_exceptions=False) == ''
+
+    path.write('<nope> [2015-10-21]:: unknown journal\n')
+    with pytest.raises(RuntimeError):
+        idid.cli.main(['import', str(path)], config)
+    path.write('<notes> [2015-10-21]:: not a git journal\n')
+    with pytest.raises(RuntimeError):
+        idid.cli.main(['import', str(path)], config)
+
+
+def test_command_named_journal(tmpdir):
+    config = tmpdir.join('config.yaml')
+    config.write('default_engine: txt://{0}\n'
+                 'journals:\n  report: {{}}\n'.format(tmpdir.join('logg.txt')))
+    idid.cli.main(['--', 'report', 'sent the quarterly report',
+                   '--config-file', str(config)])
+    logg = idid.logg.Logg(str(config), 'report')
+    assert [r.record for r in logg.iter_records()] == [
+        'sent the quarterly report']
+
+
+def test_report(capsys):
+    clean_git(TMP_TXT)
+    clean_git(TMP_GIT)
+    idid.cli.main(ARGS_OK_TXT, EXAMPLE_CONFIG)
+    idid.cli.main(ARGS_OK_GIT, EXAMPLE_CONFIG)
+    idid.cli.main(['2015-09-30', 'joy', 'too old'], EXAMPLE_CONFIG)
+    capsys.readouterr()
+
+    args = ['report', '--since', '2015-10-01', '--until', '2015-10-31']
+    assert idid.cli.main(args, EXAMPLE_CONFIG) == 2
+    out = capsys.readouterr()[0]
+    assert '* joy (Joy of the Day!)\n' in out
+    assert '    * 2015-10-21 idid joy test 1 2 3\n' in out
+    assert 'too old' not in out
+
+    args = ['report', '--since', '2015-10-01', '--until', '2015-10-31',
+            '--journal', 'joy', '--brief']
+    assert idid.cli.main(args, EXAMPLE_CONFIG) == 1
+    out = capsys.readouterr()[0]
+    assert '* joy (Joy of the Day!)\n' in out
+    assert 'test 1 2 3' not in out
+
+    # nothing was saved this week
+    assert idid.cli.main(['report', 'week'], EXAMPLE_CONFIG) == 0
+
+
+def test_export(tmpdir, capsys):
+    import csv
+    import json
+    clean_git(TMP_TXT)
+    clean_git(TMP_GIT)
+    idid.cli.main([_date, 'project_x', 'ünïcode #release @kejbaly2'],
+                  EXAMPLE_CONFIG)
+    idid.cli.main([_date, 'joy', 'party #fun'], EXAMPLE_CONFIG)
+    idid.cli.main(['2015-09-30', 'project_x', 'too old'], EXAMPLE_CONFIG)
+    capsys.readouterr()
+
+    args = ['export', '--since', '2015-10-01', '--until', '2015-10-31']
+    assert idid.cli.main(args, EXAMPLE_CONFIG) == 2
+    loggs = [json.loads(line) for line in capsys.readouterr()[0].splitlines()]
+    assert loggs[0] == {
+        'journal': 'joy', 'date': '2015-10-21', 'record': 'party #fun',
+        'tags': ['#fun'], 'mentions': []}
+    assert loggs[1]['tags'] == ['#release']
+    assert loggs[1]['mentions'] == ['@kejbaly2']
+
+    # all time by default
+    path = str(tmpdir.join('loggs.csv'))
+    args = ['export', '--format', 'csv', '--output', path,
+            '--journal', 'project_x']
+    assert idid.cli.main(args, EXAMPLE_CONFIG) == 2
+    with open(path, 'rb') as stdin:
+        rows = list(csv.reader(stdin))
+    assert rows[0] == ['journal', 'date', 'record', 'tags', 'mentions']
+    # in date order, as read from the txt index
+    assert rows[1] == ['project_x', '2015-09-30', 'too old', '', '']
+    assert rows[2] == ['project_x', '2015-10-21',
+                       'ünïcode #release @kejbaly2'.encode('utf-8'),
+                       '#release', '@kejbaly2']
+
+
+def test_tags(capsys):
+    clean_git(TMP_TXT)
+    clean_git(TMP_TXT + '.tags')
+    clean_git(TMP_GIT)
+    idid.cli.main([_date, 'project_x', 'shipped #release @kejbaly2'],
+                  EXAMPLE_CONFIG)
+    idid.cli.main([_date, 'joy', 'party #release'], EXAMPLE_CONFIG)
+    idid.cli.main([_date, 'joy', 'more #fun'], EXAMPLE_CONFIG)
+    capsys.readouterr()
+
+    assert idid.cli.main(['tags'], EXAMPLE_CONFIG) == 3
+    out = capsys.readouterr()[0]
+    assert 'Tags for all time' in out
+    assert '    * #fun (1)\n' in out
+    assert '@kejbaly2' not in out
+
+    assert idid.cli.main(['tags', 'release'], EXAMPLE_CONFIG) == 2
+    out = capsys.readouterr()[0]
+    assert '* 2015-10-21 party #release\n' in out
+    assert idid.cli.main(['tags', 'release', 'week'], EXAMPLE_CONFIG) == 0
+
+    assert idid.cli.main(['mentions'], EXAMPLE_CONFIG) == 1
+    out = capsys.readouterr()[0]
+    assert 'Mentions for all time' in out
+    assert '@tags' not in out
+    assert idid.cli.main(['mentions', 'kejbaly2', '#release'],
+                         EXAMPLE_CONFIG) == 1
+
+
+def test_sync(tmpdir, capsys):
+    config = {
+        'default_engine': 'git://{0}'.format(tmpdir.join('logg.git')),
+        'remotes': {'origin': str(tmpdir.join('origin.git')),
+                    'backup': str(tmpdir.join('backup.git'))},
+        'journals': {'joy': {}, 'work': {}, 'txt': {
+            'engine': 'txt://{0}'.format(tmpdir.join('logg.txt'))}},
+    }
+    idid.cli.main([_date, 'joy', 'synced'], config)
+    capsys.readouterr()
+    # both git journals live in the same repo; it's synced once
+    assert idid.cli.main(['sync', '--remote', 'backup'], config) == 1
+    assert 'with backup\n' in capsys.readouterr()[0]
+    assert tmpdir.join('backup.git').check()
+    assert not tmpdir.join('origin.git').check()
+    # nothing to sync in a txt journal
+    assert idid.cli.main(['sync', 'txt'], config) == 0
+
+
+def test_commands_without_arguments(tmpdir, monkeypatch, capsys):
+    """ Sub-commands given no arguments don't parse the real sys.argv """
+    config = tmpdir.join('config.yaml')
+    config.write('\n'.join([
+        'default_engine: git://{0}'.format(tmpdir.join('logg.git')),
+        'default_journal: joy',
+        'remotes: {0}'.format(tmpdir.join('origin.git')),
+        'journals:', '  joy: {}', '']))
+    monkeypatch.setattr(idid.cli, 'DEFAULT_IDID_CONFIG', str(config))
+    idid.cli.main(['joy', 'no arguments #none'])
+    for command, found in [('report', 1), ('tags', 1), ('mentions', 0),
+                           ('export', 1), ('sync', 1)]:
+        monkeypatch.setattr(sys, 'argv', ['/bin/idid', command])
+        assert idid.cli.main() == found
+    out = capsys.readouterr()[0]
+    assert '* #none (1)\n' in out
+    assert tmpdir.join('origin.git').check()
+
+    # idid import < loggs.txt
+    monkeypatch.setattr(sys, 'argv', ['/bin/idid', 'import'])
+    monkeypatch.setattr(sys, 'stdin', io.StringIO(
+        '<joy> [2015-10-22]:: from stdin\n'))
+    assert idid.cli.main() == 1
+
+
 # with pytest.raises(idid.base.OptionError):
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -0,0 +1,50 @@
+# coding: utf-8
+# @ Author: "Chris Ward" <cward@redhat.com>
+
+""" Tests for the background executor """
+
+from __future__ import unicode_literals, absolute_import
+
+import threading
+import time
+
+import pytest
+
+from idid.executor import Executor, Timeout
+
+
+def test_submit():
+    executor = Executor(max_workers=2)
+    assert executor.submit(lambda x, y: x + y, 1, y=2).result() == 3
+
+    future = executor.submit(lambda: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        future.result()
+    assert isinstance(future.exception(), ZeroDivisionError)
+
+    release = threading.Event()
+    future = executor.submit(release.wait)
+    with pytest.raises(Timeout):
+        future.result(timeout=0.01)
+    done = []
+    future.add_done_callback(done.append)
+    release.set()
+    future.result()
+    assert done == [future]
+    executor.shutdown()
+
+
+def test_submit_ordered():
+    executor = Executor(max_workers=4)
+    seen = {'a': [], 'b': []}
+
+    def call(key, k):
+        # later calls would overtake without the ordering
+        time.sleep(0.001 * (k % 3))
+        seen[key].append(k)
+
+    futures = [executor.submit_ordered(key, call, key, k)
+               for k in range(30) for key in ('a', 'b')]
+    [future.result() for future in futures]
+    assert seen == {'a': range(30), 'b': range(30)}
+    executor.shutdown()
@@ -2,15 +2,19 @@
 
 from __future__ import unicode_literals, absolute_import
 
+import datetime
 import logging
 import os
 import pytest
 import re
+import threading
 
 from configure import ConfigurationError
+import git
 
 # simple test that import works
 from idid import utils
+from idid import logg
 from idid.logg import Logg, GitLogg
 
 utils.log.setLevel(logging.DEBUG)
@@ -60,6 +64,33 @@ def test_bad_args():
         Logg(config=EG_CONF_PATH, journal='not_defined')
 
 
+def test_config_cache(tmpdir, monkeypatch):
+    monkeypatch.setattr(logg, 'CONFIG_CACHE_DIR', str(tmpdir.join('cache')))
+    monkeypatch.setattr(logg, '_CONFIGS', {})
+    path = tmpdir.join('config.yaml')
+    path.write(open(EG_CONF_PATH).read())
+
+    config = logg.load_config_file(str(path))
+    assert logg.load_config_file(str(path)) is config
+    assert len(tmpdir.join('cache').listdir()) == 1
+
+    # a fresh process reads the cached structure without parsing YAML
+    monkeypatch.setattr(logg, '_CONFIGS', {})
+
+    def fail(*args, **kwargs):
+        raise AssertionError('YAML parsed again')
+    monkeypatch.setattr(logg.Configuration, 'load', classmethod(fail))
+    cached = logg.load_config_file(str(path))
+    assert dict(cached['journals']) == dict(config['journals'])
+    assert Logg(cached, 'joy')
+
+    # changing the file invalidates the cache
+    monkeypatch.undo()
+    monkeypatch.setattr(logg, 'CONFIG_CACHE_DIR', str(tmpdir.join('cache')))
+    path.write(path.read() + '\ndefault_journal: joy\n')
+    assert logg.load_config_file(str(path))['default_journal'] == 'joy'
+
+
 def test_good_args():
     Logg(config=EG_CONF_PATH, journal='joy')
 
@@ -118,3 +149,680 @@ def test_git_logg():
 # configured in config file
 
 # ... that only branches defined in config or master can be used
+
+
+def test_git_logg_no_checkout():
+    utils.remove_path(GIT_ENGINE_PATH)
+    l = GitLogg(EG_CONF_PATH, 'joy')
+    head = l._logg_repo.head.commit
+
+    l.logg_record("test 1 2 3", '2015-10-21T07:28:00 +0000')
+    l.logg_record("test 4 5 6", '2015-10-22T07:28:00 +0000')
+
+    # HEAD and the working tree stay where they were
+    assert l._logg_repo.active_branch.name == 'master'
+    assert l._logg_repo.head.commit == head
+
+    commits = list(l._logg_repo.iter_commits('joy'))
+    assert len(commits) == 3
+    assert commits[0].message.strip() == 'test 4 5 6'
+    # loggs are stored per day (UTC)
+    assert commits[0].authored_date == 1445472000
+    assert commits[1].parents[0] == head
+
+
+def test_git_logg_bare_namespace():
+    path = '/tmp/logg-bare.git'
+    utils.remove_path(path)
+    config = {
+        'default_engine': 'git://{0}'.format(path),
+        'bare': True,
+        'ref_namespace': 'refs/idid/cward',
+        'journals': {'joy': {}, 'work': {}},
+    }
+    try:
+        l = GitLogg(config, 'joy')
+        assert l._logg_repo.bare
+        assert not os.path.exists(os.path.join(path, '.git'))
+
+        l.logg_record("test 1 2 3", '2015-10-21')
+        GitLogg(config, 'work').logg_record("test 4 5 6", '2015-10-21')
+
+        refs = l._logg_repo.git.for_each_ref(
+            'refs/idid', format='%(refname)').split()
+        assert refs == ['refs/idid/cward/joy', 'refs/idid/cward/work']
+        commits = list(l._logg_repo.iter_commits('refs/idid/cward/joy'))
+        assert len(commits) == 2
+    finally:
+        utils.remove_path(path)
+
+
+def test_pooled_logg():
+    utils.remove_path(GIT_ENGINE_PATH)
+    with logg.pooled_logg(EG_CONF_PATH, 'joy') as l:
+        l.logg_record("test 1 2 3", '2015-10-21')
+        repo = l._logg_repo
+    # idle Logg's give their repo back to the pool of repos
+    assert l._logg_repo is None
+    assert len(logg._repos) == 1
+
+    with logg.pooled_logg(EG_CONF_PATH, 'joy') as again:
+        assert again is l
+        assert again._logg_repo is repo
+        # reading commits starts a persistent cat-file process
+        commits = again._logg_repo.iter_commits('joy')
+        assert [c.message.strip() for c in commits][0] == 'test 1 2 3'
+        assert repo.git.cat_file_all
+        # other Logg's of the engine share the idle repos only
+        other = GitLogg(EG_CONF_PATH, 'joy')
+        assert other._logg_repo is not repo
+        other.close()
+    assert len(logg._repos) == 2
+
+    # repos evicted from the pool are closed
+    logg._repos.clear()
+    assert repo.git.cat_file_all is None
+
+    # recreated repos aren't reused
+    with logg.pooled_logg(EG_CONF_PATH, 'joy') as l:
+        repo = l._logg_repo
+    utils.remove_path(GIT_ENGINE_PATH)
+    with logg.pooled_logg(EG_CONF_PATH, 'joy') as l:
+        assert l._logg_repo is not repo
+        assert len(list(l._logg_repo.iter_commits())) == 1
+
+
+def test_pooled_sqlite_logg_threads(tmpdir):
+    config = logg.load_config({
+        'default_engine': 'sqlite://{0}'.format(tmpdir.join('logg.sqlite')),
+        'journals': {'joy': {}},
+    })
+
+    def write(k):
+        with logg.pooled_logg(config, 'joy') as l:
+            l.logg_record('thread {0}'.format(k), '2015-10-21')
+    # leased on a worker thread, then used and closed on this one
+    thread = threading.Thread(target=write, args=(0,))
+    thread.start()
+    thread.join()
+    with logg.pooled_logg(config, 'joy') as l:
+        assert [r.record for r in l.iter_records()] == ['thread 0']
+
+        # a Logg shared by threads serializes their use of the db
+        def share(k):
+            for x in range(20):
+                l.logg_record('shared {0} {1}'.format(k, x), '2015-10-22')
+                list(l.iter_records(since='2015-10-22'))
+        threads = [threading.Thread(target=share, args=(k,))
+                   for k in range(4)]
+        [thread.start() for thread in threads]
+        [thread.join() for thread in threads]
+        assert len(list(l.iter_records(since='2015-10-22'))) == 80
+    logg._loggs.clear()
+    assert l._db is None
+
+
+def test_repo_pool_size(monkeypatch):
+    utils.remove_path(GIT_ENGINE_PATH)
+    monkeypatch.setattr(logg._repos, 'size', 1)
+    config = logg.load_config_file(EG_CONF_PATH)
+    loggs = [logg.acquire_logg(config, 'joy') for _ in range(3)]
+    repos = [l._logg_repo for l in loggs]
+    [logg.release_logg(l) for l in loggs]
+    # the idle Logg's are all pooled, but only one repo is kept open
+    assert len(logg._loggs) == 3
+    assert len(logg._repos) == 1
+    with logg.pooled_logg(config, 'joy') as l:
+        assert l._logg_repo is repos[-1]
+
+
+def test_logg_records():
+    utils.remove_path(DEFAULT_ENGINE_PATH)
+    l = Logg(EG_CONF_PATH, 'project_x')
+
+    records = (('2015-10-{0}'.format(x), 'test {0}'.format(x))
+               for x in range(10, 20))
+    assert l.logg_records(records) == 10
+    l.logg_record("test 20", '2015-10-20')
+
+    with open(DEFAULT_ENGINE_PATH) as f:
+        lines = f.read().splitlines()
+    assert len(lines) == 11
+    assert lines[0] == "<project_x> [2015-10-10]:: test 10"
+    assert lines[-1] == "<project_x> [2015-10-20]:: test 20"
+
+
+def test_git_logg_records():
+    utils.remove_path(GIT_ENGINE_PATH)
+    l = GitLogg(EG_CONF_PATH, 'joy')
+
+    records = (('2015-10-{0}'.format(x), 'test {0}'.format(x))
+               for x in range(10, 20))
+    assert l.logg_records(records) == 10
+
+    commits = list(l._logg_repo.iter_commits('joy'))
+    assert len(commits) == 11
+    assert commits[0].message.strip() == 'test 19'
+    assert commits[9].message.strip() == 'test 10'
+
+
+def test_git_logg_ref_moved():
+    utils.remove_path(GIT_ENGINE_PATH)
+    l = GitLogg(EG_CONF_PATH, 'joy')
+    ref = l._journal_ref()
+    base = l._rev_parse('HEAD')
+
+    # build a commit, but let another writer advance the journal first
+    sha = l._commit_tree('test 2', '2015-10-22', base)
+    l.logg_record('test 1', '2015-10-21')
+    tip = l._advance_ref(ref, sha, None, base)
+
+    assert tip != sha
+    commits = list(l._logg_repo.iter_commits('joy'))
+    assert [c.message.strip() for c in commits[:2]] == ['test 2', 'test 1']
+    assert commits[0].authored_date == 1445472000
+
+
+def _stress_writer(config, journal, worker, k_loggs, start):
+    l = Logg(config, journal)
+    start.wait()
+    for x in range(k_loggs // 2):
+        l.logg_record('worker {0} logg {1}'.format(worker, x), '2015-10-21')
+    l.logg_records(
+        ('2015-10-22', 'worker {0} logg {1} '.format(worker, x) + 'x' * 4096)
+        for x in range(k_loggs // 2, k_loggs))
+
+
+def _stress(config, journal, k_workers, k_loggs):
+    import multiprocessing
+    start = multiprocessing.Event()
+    workers = [multiprocessing.Process(target=_stress_writer, args=(
+        config, journal, worker, k_loggs, start))
+        for worker in range(k_workers)]
+    for worker in workers:
+        worker.start()
+    start.set()
+    for worker in workers:
+        worker.join()
+    assert [worker.exitcode for worker in workers] == [0] * k_workers
+    return set('worker {0} logg {1}'.format(worker, x)
+               for worker in range(k_workers) for x in range(k_loggs))
+
+
+def test_concurrent_writers(tmpdir):
+    path = tmpdir.join('logg.txt')
+    config = {'default_engine': 'txt://{0}'.format(path),
+              'journals': {'joy': {}}}
+    expected = _stress(config, 'joy', 24, 10)
+
+    lines = path.read_binary().decode('utf-8').splitlines()
+    loggs = [logg.LOGG_RE.match(line) for line in lines]
+    # no logg torn apart or interleaved with another
+    assert all(loggs)
+    records = [m.group('record').rstrip('x ') for m in loggs]
+    assert len(records) == len(expected) and set(records) == expected
+    # the index saw every logg too
+    assert len(list(Logg(config, 'joy').iter_records())) == len(expected)
+
+
+def test_git_concurrent_writers(tmpdir):
+    # the repo doesn't exist yet; the writers race to create it
+    config = {'default_engine': 'git://{0}'.format(tmpdir.join('logg.git')),
+              'journals': {'joy': {}}}
+    expected = _stress(config, 'joy', 8, 4)
+
+    l = Logg(config, 'joy')
+    messages = [c.message.strip().rstrip('x ')
+                for c in l._logg_repo.iter_commits('joy')]
+    # plus the initial commit, shared by all the writers
+    assert len(messages) == len(expected) + 1
+    assert set(messages[:-1]) == expected
+    # creating the repo leaves no lock file behind
+    assert tmpdir.listdir() == [tmpdir.join('logg.git')]
+
+
+def test_git_locked_new_ref(tmpdir):
+    config = {'default_engine': 'git://{0}'.format(tmpdir.join('logg.git')),
+              'journals': {'joy': {}, 'new': {}}}
+    Logg(config, 'joy').logg_record('init', '2015-10-21')
+    l = Logg(config, 'new')
+    # the ref of the new journal is locked for longer than git waits
+    lock = tmpdir.join('logg.git', '.git', 'refs', 'heads', 'new.lock')
+    lock.write('')
+    timer = threading.Timer(0.6, lock.remove)
+    timer.start()
+    try:
+        l.logg_record('first #logg', '2015-10-22')
+    finally:
+        timer.join()
+    assert [r.record for r in l.iter_records()] == ['first #logg']
+    assert len(l._logg_repo.commit('new').parents) == 1
+    assert len(list(l.iter_tagged('#logg'))) == 1
+
+
+def test_iter_records():
+    utils.remove_path(DEFAULT_ENGINE_PATH)
+    l = Logg(EG_CONF_PATH, 'project_x')
+    l.logg_records((
+        ('2015-10-21', 'test 1 #tag'),
+        ('2015-10-23', 'test 3 @mention #tag'),
+        ('2015-10-22', 'test 2'),
+    ))
+    Logg(EG_CONF_PATH, 'general').logg_record('general', '2015-10-22')
+
+    records = l.iter_records()
+    # it's lazy
+    assert not isinstance(records, list)
+    records = list(records)
+    # the index generates loggs in date order
+    assert [r.record for r in records] == [
+        'test 1 #tag', 'test 2', 'test 3 @mention #tag']
+    assert records[2].tags == ('@mention', '#tag')
+    assert records[2].journal == 'project_x'
+    assert unicode(records[2].date) == '2015-10-23'
+
+    records = list(l.iter_records('2015-10-22', '2015-10-22'))
+    assert [r.record for r in records] == ['test 2']
+
+
+def test_logg_columns():
+    from idid.logg import LoggColumns, LoggRecord
+
+    loggs = [
+        LoggRecord('joy', utils.Date('2015-10-23'), 'three #tag', ('#tag',)),
+        LoggRecord('work', utils.Date('2015-10-21'), 'one', ()),
+        LoggRecord('joy', utils.Date('2015-10-22'), 'two', ()),
+    ]
+    columns = LoggColumns(loggs)
+    assert len(columns) == 3
+    assert columns.journals == ['joy', 'work']
+    assert columns[0] == loggs[0]
+    columns.sort()
+    assert list(columns) == sorted(loggs, key=lambda logg: logg.date)
+    groups = [(journal, [logg.record for logg in group])
+              for journal, group in columns.groupby_journal()]
+    assert groups == [('joy', ['two', 'three #tag']), ('work', ['one'])]
+    # records are hashable and ordered
+    assert len(set(loggs + list(columns))) == 3
+    assert sorted(loggs)[0].record == 'two'
+
+
+def test_async_logg():
+    from idid.logg import AsyncLogg
+    utils.remove_path(DEFAULT_ENGINE_PATH)
+    utils.remove_path(GIT_ENGINE_PATH)
+    txt = AsyncLogg(EG_CONF_PATH, 'project_x')
+    git = AsyncLogg(EG_CONF_PATH, 'joy')
+    assert isinstance(git.logg, GitLogg)
+
+    futures = []
+    for k in range(10):
+        futures.append(txt.logg_record('txt {0}'.format(k), '2015-10-21'))
+        futures.append(git.logg_record('git {0}'.format(k), '2015-10-21'))
+    futures.append(txt.logg_records([('2015-10-22', 'txt batch')]))
+    [future.result(timeout=60) for future in futures]
+
+    # each journal's loggs were saved in order
+    records = txt.iter_records().result(timeout=60)
+    assert [r.record for r in records] == [
+        'txt {0}'.format(k) for k in range(10)] + ['txt batch']
+    records = git.iter_records().result(timeout=60)
+    assert [r.record for r in records] == [
+        'git {0}'.format(k) for k in reversed(range(10))]
+
+    with pytest.raises(RuntimeError):
+        txt.logg_record('').result(timeout=60)
+
+
+def test_async_sqlite_logg(tmpdir):
+    from idid.logg import AsyncLogg, SqliteLogg
+    config = {
+        'default_engine': 'sqlite://{0}'.format(tmpdir.join('logg.sqlite')),
+        'journals': {'joy': {}},
+    }
+    sqlite = AsyncLogg(config, 'joy')
+    assert isinstance(sqlite.logg, SqliteLogg)
+    futures = [sqlite.logg_record('sqlite {0}'.format(k), '2015-10-21')
+               for k in range(10)]
+    [future.result(timeout=60) for future in futures]
+    records = sqlite.iter_records().result(timeout=60)
+    assert [r.record for r in records] == [
+        'sqlite {0}'.format(k) for k in range(10)]
+
+
+def test_sync_to(tmpdir, monkeypatch):
+    from idid import spool
+    monkeypatch.setattr(spool, 'SPOOL_DIR', str(tmpdir.join('spool')))
+    utils.remove_path(GIT_ENGINE_PATH)
+    team = tmpdir.join('team', 'logg.txt')
+    config = {
+        'default_engine': 'txt://{0}'.format(tmpdir.join('me.txt')),
+        'journals': {
+            'me': {'sync_to': ['joy', 'team']},
+            'joy': {'engine': 'git://{0}'.format(GIT_ENGINE_PATH)},
+            # the team dir doesn't exist yet; its loggs get spooled
+            'team': {'engine': 'txt://{0}'.format(team)},
+        },
+    }
+    l = Logg(config, 'me')
+    l.logg_record('did one', '2015-10-21')
+    joy = Logg(config, 'joy')
+    assert [r.record for r in joy.iter_records()] == ['did one [me]']
+    assert not team.check()
+    assert len(spool.Spool.for_journal('txt://{0}'.format(team), 'team')) == 1
+
+    team.dirpath().ensure(dir=True)
+    l.logg_records([('2015-10-22', 'did two'), ('2015-10-22', 'did three')])
+    assert [r.record for r in Logg(config, 'team').iter_records()] == [
+        'did one [me]', 'did two [me]', 'did three [me]']
+    assert l.retry_sync() == 0
+    assert len(list(joy.iter_records())) == 3
+
+
+def test_sync_to_timeout(tmpdir, monkeypatch):
+    import fcntl
+    from idid import spool
+    from idid.executor import shared_executor
+    monkeypatch.setattr(spool, 'SPOOL_DIR', str(tmpdir.join('spool')))
+    team = tmpdir.join('team.txt')
+    config = {
+        'default_engine': 'txt://{0}'.format(tmpdir.join('me.txt')),
+        'journals': {
+            'me': {'sync_to': ['team'], 'sync_timeout': 0.1},
+            'team': {'engine': 'txt://{0}'.format(team)},
+        },
+    }
+    l = Logg(config, 'me')
+    team_spool = l._target_spool('team')
+    # a slow target; its spool can't be flushed for now
+    tmpdir.join('spool').ensure(dir=True)
+    with open(team_spool.lock_path, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        l.logg_record('did one', '2015-10-21')
+        # had idid exited here, the logg would be written next time
+        assert not team.check()
+        assert len(team_spool) == 1
+    shared_executor('sync').submit_ordered(
+        ('sync', 'team'), lambda: None).result()
+    assert [r.record for r in Logg(config, 'team').iter_records()] == [
+        'did one [me]']
+    assert len(team_spool) == 0
+
+
+def test_spool_mode(tmpdir, monkeypatch):
+    from idid import spool
+    monkeypatch.setattr(spool, 'SPOOL_DIR', str(tmpdir.join('spool')))
+    # the engine's dir doesn't exist yet; writing to it fails
+    path = tmpdir.join('down', 'logg.txt')
+    config = {'default_engine': 'txt://{0}'.format(path),
+              'journals': {'joy': {'spool': True}}}
+    l = Logg(config, 'joy')
+    assert l.logg_record('did one', '2015-10-21') == \
+        '<joy> [2015-10-21]:: did one'
+    assert l.logg_records([('2015-10-22', 'did two')]) == 1
+    # wait for the background flushes
+    logg.wait_for_flushes()
+    assert not logg._flushing
+    assert len(l._spool) == 2
+
+    path.dirpath().ensure(dir=True)
+    assert [r.record for r in l.iter_records()] == ['did one', 'did two']
+    assert len(l._spool) == 0
+    assert l.flush() == 0
+
+
+def test_git_sync(tmpdir):
+    remote = str(tmpdir.join('remote.git'))
+
+    def config(name, **options):
+        return dict(options, **{
+            'default_engine': 'git://{0}'.format(tmpdir.join(name)),
+            'remotes': {'origin': remote},
+            'journals': {'joy': {}, 'work': {}},
+        })
+
+    one, two = Logg(config('one'), 'joy'), Logg(config('two'), 'joy')
+    one.logg_record('one 1 #sync', '2015-10-21')
+    Logg(config('one'), 'work').logg_record('work 1', '2015-10-21')
+    assert one.sync() == ['origin']
+    assert two.sync() == ['origin']
+    assert [r.record for r in two.iter_records()] == ['one 1 #sync']
+    assert [r.record for r in two.iter_tagged('#sync')] == ['one 1 #sync']
+    work = Logg(config('two'), 'work')
+    assert [r.record for r in work.iter_records()] == ['work 1']
+    # only the journal refs are synced; not master nor other branches
+    one._logg_repo.git.branch('unrelated', 'master')
+    one.sync()
+    remote_refs = git.Repo(remote).git.for_each_ref(format='%(refname)')
+    assert remote_refs.split() == ['refs/heads/joy', 'refs/heads/work']
+
+    # diverged journals: the local loggs are replayed on the remote ones
+    one.logg_record('one 2', '2015-10-22')
+    two.logg_record('two 1 #sync', '2015-10-22')
+    one.sync()
+    two.sync()
+    one.sync()
+    for logg in (one, two):
+        assert sorted(r.record for r in logg.iter_records()) == [
+            'one 1 #sync', 'one 2', 'two 1 #sync']
+        assert len(list(logg.iter_tagged('#sync'))) == 2
+
+    # auto sync pushes at most once per interval
+    three = Logg(config('three', sync_interval=3600), 'joy')
+    three.logg_record('three 1', '2015-10-23')
+    three.logg_record('three 2', '2015-10-23')
+    two.sync()
+    assert [r.record for r in two.iter_records()][0] == 'three 1'
+
+
+def test_git_iter_records():
+    utils.remove_path(GIT_ENGINE_PATH)
+    l = GitLogg(EG_CONF_PATH, 'joy')
+    l.logg_records((
+        ('2015-10-21', 'test 1 #tag'),
+        ('2015-10-23', 'test 3 @mention'),
+        ('2015-10-22', 'test 2'),
+    ))
+
+    records = list(l.iter_records())
+    assert [r.record for r in records] == ['test 2', 'test 3 @mention',
+                                           'test 1 #tag']
+    assert records[1].tags == ('@mention',)
+    assert unicode(records[1].date) == '2015-10-23'
+
+    records = list(l.iter_records(until='2015-10-22'))
+    assert [r.record for r in records] == ['test 2', 'test 1 #tag']
+    # loggs are never committed before the day they're dated
+    tomorrow = utils.today() + datetime.timedelta(days=1)
+    assert list(l.iter_records(since=tomorrow)) == []
+
+    # loggs dated ahead are found behind the later loggs of today
+    l.logg_record('plan', unicode(tomorrow))
+    l.logg_record('today', unicode(utils.today()))
+    l.fast_import([('joy', unicode(tomorrow), 'imported plan'),
+                   ('joy', unicode(utils.today()), 'imported today')])
+    records = l.iter_records(since=unicode(tomorrow))
+    assert [r.record for r in records] == ['imported plan', 'plan']
+
+
+def test_txt_index(monkeypatch):
+    from idid.index import TxtIndex
+    utils.remove_path(DEFAULT_ENGINE_PATH)
+    utils.remove_path(DEFAULT_ENGINE_PATH + '.idx')
+    monkeypatch.setattr(TxtIndex, 'COMPACT_AFTER', 4)
+
+    l = Logg(EG_CONF_PATH, 'project_x')
+    g = Logg(EG_CONF_PATH, 'general')
+    # out of date order, and interleaved with another journal
+    for day in [5, 3, 9, 1, 7, 2, 8, 4, 6]:
+        l.logg_record('test {0}'.format(day), '2015-10-0{0}'.format(day))
+        g.logg_record('general {0}'.format(day), '2015-10-0{0}'.format(day))
+    assert os.path.exists(DEFAULT_ENGINE_PATH + '.idx')
+
+    records = l.iter_records('2015-10-03', '2015-10-06')
+    assert [r.record for r in records] == [
+        'test 3', 'test 4', 'test 5', 'test 6']
+    assert len(list(g.iter_records())) == 9
+
+    # records appended behind idid's back are indexed on the next query
+    with open(DEFAULT_ENGINE_PATH, 'a') as f:
+        f.write('<project_x> [2015-10-04]:: test 4b\n')
+    records = l.iter_records('2015-10-04', '2015-10-04')
+    assert [r.record for r in records] == ['test 4', 'test 4b']
+    # the index is shared like the data file
+    mode = os.stat(DEFAULT_ENGINE_PATH).st_mode & 0o777
+    assert os.stat(DEFAULT_ENGINE_PATH + '.idx').st_mode & 0o777 == mode
+
+    # hand edited lines with invalid dates are skipped
+    with open(DEFAULT_ENGINE_PATH, 'a') as f:
+        f.write('<project_x> [2015-13-45]:: bad date\n')
+        f.write('<project_x> [someday]:: no date\n')
+    index = TxtIndex(DEFAULT_ENGINE_PATH)
+    index.rebuild()
+    assert len(list(index.query(journal='project_x'))) == 10
+    assert len(list(l.iter_records())) == 10
+
+    # a replaced data file is detected and the index rebuilt
+    utils.remove_path(DEFAULT_ENGINE_PATH)
+    l.logg_record('test 1', '2015-10-01')
+    assert [r.record for r in l.iter_records()] == ['test 1']
+
+    index = TxtIndex(DEFAULT_ENGINE_PATH)
+    index.rebuild()
+    assert list(index.query()) == [0]
+
+
+def test_iter_records_mmap():
+    utils.remove_path(DEFAULT_ENGINE_PATH)
+    utils.remove_path(DEFAULT_ENGINE_PATH + '.idx')
+    config = {
+        'default_engine': DEFAULT_ENGINE_URI,
+        'index': False,
+        'journals': {'joy': {}, 'joyful': {}},
+    }
+    l = Logg(config, 'joy')
+    assert list(l.iter_records()) == []
+
+    l.logg_records((
+        ('2015-10-21', 'test 1 #tag'),
+        ('2015-10-23', 'test 3 ěšč #tag'),
+        ('2015-10-22', 'test 2'),
+    ))
+    Logg(config, 'joyful').logg_record('test 1 #tag', '2015-10-21')
+    assert not os.path.exists(DEFAULT_ENGINE_PATH + '.idx')
+
+    # without the index, loggs come in file order
+    records = list(l.iter_records())
+    assert [r.record for r in records] == [
+        'test 1 #tag', 'test 3 ěšč #tag', 'test 2']
+    records = list(l.iter_records(since='2015-10-22', search='#tag'))
+    assert [r.record for r in records] == ['test 3 ěšč #tag']
+    records = list(l.iter_records(search='š'))
+    assert len(records) == 1
+    # journal name is not part of the search
+    assert list(l.iter_records(search='joy')) == []
+
+
+def test_git_iter_records_search():
+    utils.remove_path(GIT_ENGINE_PATH)
+    l = GitLogg(EG_CONF_PATH, 'joy')
+    l.logg_records((
+        ('2015-10-21', 'test 1 #tag'),
+        ('2015-10-22', 'test 2'),
+    ))
+    records = list(l.iter_records(search='#tag'))
+    assert [r.record for r in records] == ['test 1 #tag']
+
+
+def test_tag_index():
+    utils.remove_path(DEFAULT_ENGINE_PATH)
+    utils.remove_path(DEFAULT_ENGINE_PATH + '.tags')
+    l = Logg(EG_CONF_PATH, 'project_x')
+    l.logg_records((
+        ('2015-10-23', 'test 3 #Release @kejbaly2'),
+        ('2015-10-21', 'test 1 #release'),
+        ('2015-10-22', 'test 2'),
+    ))
+    l.logg_record('test 4 #release', '2015-12-01')
+    Logg(EG_CONF_PATH, 'general').logg_record('#release', '2015-10-21')
+
+    records = l.iter_tagged('#release')
+    assert [r.record for r in records] == [
+        'test 1 #release', 'test 3 #Release @kejbaly2', 'test 4 #release']
+    records = l.iter_tagged('#RELEASE', '2015-10-01', '2015-10-31')
+    assert len(list(records)) == 2
+    assert list(l.tags('#')) == [('#release', 3)]
+    assert list(l.tags('@', until='2015-10-22')) == []
+    assert list(l.tags()) == [('#release', 3), ('@kejbaly2', 1)]
+
+    # the index can be rebuilt from the journal
+    utils.remove_path(DEFAULT_ENGINE_PATH + '.tags')
+    assert list(l.iter_tagged('#release')) == []
+    l.rebuild_tags()
+    assert len(list(l.iter_tagged('#release'))) == 3
+
+
+def test_git_tag_index():
+    utils.remove_path(GIT_ENGINE_PATH)
+    l = GitLogg(EG_CONF_PATH, 'joy')
+    l.logg_records((
+        ('2015-10-23', 'test 3 #release @kejbaly2'),
+        ('2015-10-21', 'test 1 #release'),
+        ('2015-10-22', 'test 2'),
+    ))
+    l.logg_record('test 4 #release', '2015-12-01')
+    l.fast_import([(None, '2015-10-24', 'test 5 #release')])
+
+    records = l.iter_tagged('#release')
+    assert [r.record for r in records] == [
+        'test 1 #release', 'test 3 #release @kejbaly2', 'test 5 #release',
+        'test 4 #release']
+    records = l.iter_tagged('@kejbaly2', since='2015-10-01')
+    assert [r.record for r in records] == ['test 3 #release @kejbaly2']
+
+    l.rebuild_tags()
+    assert list(l.tags()) == [('#release', 4), ('@kejbaly2', 1)]
+
+
+def test_sqlite_logg():
+    from idid.logg import SqliteLogg
+    path = '/tmp/logg.sqlite'
+    utils.remove_path(path)
+    config = {
+        'default_engine': 'sqlite://{0}'.format(path),
+        'journals': {'joy': {}, 'work': {}},
+    }
+    try:
+        l = Logg(config, 'joy')
+        assert isinstance(l, SqliteLogg)
+        assert l._fts in ('fts5', 'fts4')
+
+        r = l.logg_record('test 1 #release', '2015-10-21')
+        assert r == '<joy> [2015-10-21]:: test 1 #release'
+        assert l.logg_records((
+            ('2015-10-23', 'test 3 #Release @kejbaly2 shipped it'),
+            ('2015-10-22', 'test 2'),
+        )) == 2
+        Logg(config, 'work').logg_record('test 4 #release', '2015-10-21')
+
+        records = list(l.iter_records())
+        assert [r.record for r in records] == [
+            'test 1 #release', 'test 2',
+            'test 3 #Release @kejbaly2 shipped it']
+        assert records[2].tags == ('#Release', '@kejbaly2')
+        records = l.iter_records('2015-10-22', '2015-10-22')
+        assert [r.record for r in records] == ['test 2']
+        records = l.iter_records(search='shipped it')
+        assert [r.record for r in records] == [
+            'test 3 #Release @kejbaly2 shipped it']
+
+        records = l.iter_tagged('#release', since='2015-10-22')
+        assert [r.record for r in records] == [
+            'test 3 #Release @kejbaly2 shipped it']
+        assert list(l.tags()) == [('#release', 2), ('@kejbaly2', 1)]
+
+        # a reader sees the writes of another connection
+        assert len(list(Logg(config, 'joy').iter_records())) == 3
+    finally:
+        for suffix in ['', '-wal', '-shm']:
+            utils.remove_path(path + suffix)
@@ -0,0 +1,51 @@
+# coding: utf-8
+# @ Author: "Chris Ward" <cward@redhat.com>
+
+""" Tests for the pools of idle objects """
+
+from __future__ import unicode_literals, absolute_import
+
+import pytest
+
+from idid.pool import Pool
+
+
+def test_lru_eviction():
+    closed = []
+    pool = Pool(3, close=closed.append)
+    pool.release('a', 'a1')
+    pool.release('b', 'b1')
+    pool.release('a', 'a2')
+    # a1 was released before b1, but 'a' was used since
+    pool.release('c', 'c1')
+    assert closed == ['b1']
+    assert len(pool) == 3
+    assert pool.acquire('a') == 'a2'
+    assert pool.acquire('a') == 'a1'
+    assert pool.acquire('a') is None
+
+    pool.clear()
+    assert closed == ['b1', 'c1']
+    assert len(pool) == 0
+
+
+def test_lease():
+    closed = []
+    pool = Pool(4, close=closed.append)
+    with pool.lease('a', lambda: ['a']) as one:
+        # objects in use aren't handed out twice
+        with pool.lease('a', lambda: ['a']) as two:
+            assert one is not two
+    with pool.lease('a', lambda: ['new']) as three:
+        # the most recently used first
+        assert three is one
+    assert len(pool) == 2
+
+    # objects which raised aren't reused
+    with pytest.raises(ValueError):
+        with pool.lease('a', lambda: ['new']) as four:
+            raise ValueError()
+    assert closed == [four]
+    # neither are the stale ones
+    assert pool.acquire('a', check=lambda obj: False) is None
+    assert len(closed) == 2
@@ -0,0 +1,58 @@
+# coding: utf-8
+# @ Author: "Chris Ward" <cward@redhat.com>
+
+""" Tests for the timing of idid command phases """
+
+from __future__ import unicode_literals, absolute_import
+
+import json
+import os
+
+from idid import profile
+
+PATH = os.path.dirname(os.path.realpath(__file__))
+EXAMPLE_CONFIG = PATH + "/../examples/config.yaml"
+
+
+def test_span(tmpdir, capsys):
+    # nothing is recorded unless profiling
+    assert profile.span('git.commit') is profile.span('txt.append')
+
+    @profile.timed('inner')
+    def inner():
+        return 42
+
+    with profile.profiling():
+        with profile.span('outer'):
+            assert inner() == 42
+            inner()
+    err = capsys.readouterr()[1]
+    assert err.startswith('Profile: ')
+    lines = err.splitlines()
+    assert lines[3].split()[0] == '1' and lines[3].endswith('  outer')
+    assert lines[4].split()[0] == '2' and lines[4].endswith('    inner')
+
+    output = str(tmpdir.join('profile.json'))
+    with profile.profiling(output):
+        inner()
+    with open(output) as stdin:
+        data = json.load(stdin)
+    assert [s['path'] for s in data['spans']] == ['idid/inner', 'idid']
+    assert data['total'] >= data['spans'][0]['duration']
+
+
+def test_cli_profile(tmpdir):
+    import idid.cli
+    output = str(tmpdir.join('profile.json'))
+    stats = str(tmpdir.join('idid.pstats'))
+    idid.cli.main(['--profile-output', output, '--profile-stats', stats,
+                   '2015-10-21', 'project_x', 'did some profiling'],
+                  EXAMPLE_CONFIG)
+    with open(output) as stdin:
+        paths = set(s['path'] for s in json.load(stdin)['spans'])
+    assert 'idid/cli.parse' in paths
+    assert 'idid/logg.factory' in paths
+    assert 'idid/logg.write/txt.append/txt.index' in paths
+
+    import pstats
+    assert pstats.Stats(stats).total_calls
@@ -0,0 +1,129 @@
+# coding: utf-8
+# @ Author: "Chris Ward" <cward@redhat.com>
+
+""" Tests for the idid daemon """
+
+from __future__ import unicode_literals, absolute_import
+
+import os
+import socket
+import threading
+
+from idid import server, utils
+
+# Prepare path and config examples
+PATH = os.path.dirname(os.path.realpath(__file__))
+EXAMPLE_CONFIG = PATH + "/../examples/config.yaml"
+
+TMP_TXT = '/tmp/logg.txt'
+
+
+def start_server(tmpdir):
+    path = str(tmpdir.join('idid.sock'))
+    daemon = server.Server(path)
+    daemon.bind()
+    thread = threading.Thread(target=daemon.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return daemon, path
+
+
+def test_protocol():
+    one, two = socket.socketpair()
+    server.send_message(one, {'argv': ['joy', 'ünïcode']})
+    assert server.recv_message(two) == {'argv': ['joy', 'ünïcode']}
+    one.close()
+    assert server.recv_message(two) is None
+
+
+def test_no_daemon(tmpdir):
+    path = str(tmpdir.join('idid.sock'))
+    assert server.request(['report'], path) is None
+    # stale socket, nobody listening
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+    assert server.forward(['report'], path) is False
+
+
+def test_serve(tmpdir):
+    utils.remove_path(TMP_TXT)
+    daemon, path = start_server(tmpdir)
+    try:
+        args = ['--config-file', EXAMPLE_CONFIG]
+        reply = server.request(
+            ['2015-10-21', 'project_x', 'served #daemon'] + args, path)
+        assert reply['ok']
+        assert reply['result'] == '<project_x> [2015-10-21]:: served #daemon'
+
+        # concurrent writes all land, coalesced or not
+        def write(k):
+            server.request(
+                ['2015-10-22', 'project_x', 'logg {0}'.format(k)] + args,
+                path)
+        threads = [threading.Thread(target=write, args=(k, ))
+                   for k in range(10)]
+        [thread.start() for thread in threads]
+        [thread.join() for thread in threads]
+        assert len(open(TMP_TXT).readlines()) == 11
+
+        reply = server.request(['tags', 'daemon'] + args, path)
+        assert reply['ok'] and 'served #daemon' in reply['output']
+
+        # the editor needs the client's terminal
+        assert server.request(['project_x'] + args, path) is None
+
+        reply = server.request(
+            ['2015-10-21', 'not_in_config', 'x y'] + args, path)
+        assert not reply['ok'] and 'not_in_config' in reply['error']
+    finally:
+        daemon.shutdown()
+    assert not os.path.exists(path)
+
+
+def test_logs(tmpdir):
+    handler = utils.Logging('did').enable_json(capacity=10)
+    daemon, path = start_server(tmpdir)
+    try:
+        utils.log.warn('something happened to {0}', 'the daemon')
+        records = server.logs(path=path)
+        assert records[-1]['message'] == 'something happened to the daemon'
+        assert records[-1]['level'] == 'WARNING'
+        assert len(server.logs(1, path)) == 1
+    finally:
+        daemon.shutdown()
+        utils.log.removeHandler(handler)
+        del utils.log.json_handler
+    assert server.logs(path=path) is None
+
+
+def test_client_cwd_and_env(tmpdir):
+    daemon, path = start_server(tmpdir.join('sock').ensure(dir=True))
+    cwd = os.getcwd()
+    env = server.client_env()
+    try:
+        # paths are resolved against the client's cwd, without chdir
+        message = {'cwd': str(tmpdir), 'env': env, 'argv': [
+            'export', '--output', 'out.jsonl',
+            '--config-file={0}'.format(EXAMPLE_CONFIG)]}
+        reply = server._roundtrip(message, path)
+        assert reply['ok'], reply
+        assert tmpdir.join('out.jsonl').check()
+        assert os.getcwd() == cwd
+        # the '--' escaping journals named like commands is kept
+        argv = server._resolve_paths(['--', 'export', 'x'], str(tmpdir))
+        assert argv == ['--', 'export', 'x']
+
+        # another environment than the daemon's runs in the client
+        message = dict(message, env=dict(env, TZ='Europe/Prague'))
+        assert server._roundtrip(message, path)['fallback']
+
+        # as do relative engine paths
+        config = tmpdir.join('config.yaml')
+        config.write('default_engine: txt://logg.txt\njournals:\n  joy:\n')
+        message = {'cwd': str(tmpdir), 'env': env, 'argv': [
+            'joy', 'relative', '--config-file', 'config.yaml']}
+        assert server._roundtrip(message, path)['fallback']
+        assert not tmpdir.join('logg.txt').check()
+    finally:
+        daemon.shutdown()
@@ -0,0 +1,61 @@
+# coding: utf-8
+# @ Author: "Chris Ward" <cward@redhat.com>
+
+""" Tests for the spool of loggs waiting to be written """
+
+from __future__ import unicode_literals, absolute_import
+
+import pytest
+
+from idid.spool import Spool, HEADER
+
+
+def test_flush(tmpdir):
+    spool = Spool(str(tmpdir.join('spool')))
+    assert len(spool) == 0
+    assert spool.flush(None) == 0
+
+    spool.extend([('did {0}'.format(x), '2015-10-21') for x in range(5)])
+    assert len(spool) == 5
+    batches = []
+    assert spool.flush(batches.append, batch_size=2) == 5
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert batches[0][0] == ('did 0', '2015-10-21')
+    # fully flushed spools are removed
+    assert not tmpdir.join('spool').check()
+
+
+def test_flush_resumes(tmpdir):
+    spool = Spool(str(tmpdir.join('spool')))
+    spool.extend([('did {0}'.format(x), '2015-10-21') for x in range(5)])
+
+    written = []
+
+    def fail_second(batch):
+        if written:
+            raise IOError('backend is down')
+        written.extend(batch)
+
+    with pytest.raises(IOError):
+        spool.flush(fail_second, batch_size=2)
+    assert len(spool) == 3
+    spool.extend([('did 5', '2015-10-22')])
+    assert spool.flush(written.extend) == 4
+    assert [record for record, _ in written] == [
+        'did {0}'.format(x) for x in range(6)]
+
+
+def test_torn_frames(tmpdir):
+    path = tmpdir.join('spool')
+    spool = Spool(str(path))
+    spool.extend([('did 1', '2015-10-21')])
+    # a crash in the middle of an append
+    data = path.read_binary()
+    path.write_binary(data + data[HEADER.size:-3])
+    assert len(spool) == 1
+
+    # the torn frame is skipped once something follows it
+    spool.extend([('did 2', '2015-10-21')])
+    written = []
+    assert spool.flush(written.extend) == 2
+    assert [record for record, _ in written] == ['did 1', 'did 2']
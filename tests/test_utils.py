@@ -4,7 +4,7 @@
 
 from __future__ import unicode_literals, absolute_import
 
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 
 import pytz
 import pytest
@@ -123,6 +123,59 @@ def test_Logging():
     assert Logging
 
 
+def test_Logging_deferred_format():
+    from idid.utils import Logging, LOG_DEBUG, LOG_WARN
+    logger = Logging('idid-test-format')
+    handler = logger.enable_json(capacity=2)
+
+    class Expensive(object):
+        formatted = 0
+
+        def __format__(self, spec):
+            Expensive.formatted += 1
+            return 'expensive'
+
+    logger.set(LOG_WARN)
+    logger.logger.debug('not shown {0}', Expensive())
+    assert Expensive.formatted == 0
+    assert handler.records() == []
+
+    logger.set(LOG_DEBUG)
+    logger.logger.debug('shown {0} {{literal}}', Expensive())
+    logger.logger.info('{x} by name', {'x': 'args'})
+    logger.logger.warn('no args {0}')
+    assert Expensive.formatted == 1
+    # only the latest records are kept
+    records = handler.records()
+    assert [record['message'] for record in records] == [
+        'args by name', 'no args {0}']
+    assert records[-1]['level'] == 'WARNING'
+    assert handler.records(limit=1) == records[-1:]
+
+    # other users of the logger keep their %-style messages
+    import logging
+    logging.getLogger('idid-test-format').warn('%s percent', 'still')
+    assert handler.records()[-1]['message'] == 'still percent'
+    # and only the idid loggers are created with brace formatting
+    assert logging.getLoggerClass() is logging.Logger
+
+
+def test_ColoredFormatter():
+    import logging
+    from idid.utils import Logging, Coloring, COLOR_ON, COLOR_OFF
+    formatter = Logging.ColoredFormatter()
+    record = logging.LogRecord(
+        'did', logging.WARN, __file__, 1, 'careful', None, None)
+    mode = Coloring().get()
+    try:
+        Coloring().set(COLOR_OFF)
+        assert formatter.format(record) == '[WARNING] careful'
+        Coloring().set(COLOR_ON)
+        assert formatter.format(record).startswith('\033[')
+    finally:
+        Coloring().set(mode)
+
+
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 #  Coloring
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -153,6 +206,7 @@ def test_today():
 
 
 def test_Date_type_handling():
+    from idid import utils
     from idid.utils import Date
 
     # clearly not dates
@@ -167,7 +221,7 @@ def test_Date_type_handling():
     assert unicode(Date(d_today)) == d_today
     assert unicode(Date(D_today)) == d_today
     # should always have utc timezone attached
-    assert Date(d_today).date.tzinfo == pytz.utc
+    assert Date(d_today).date.tzinfo is utils.UTC
 
     # UTC
     DT_today_utc = datetime(2015, 1, 1, 0, 0, 0, tzinfo=UTC)
@@ -175,7 +229,7 @@ def test_Date_type_handling():
     assert unicode(Date(dt_today_utc)) == d_today
     # should always have utc timezone attached
     # so this is the last time we test for it since it's been found 2x already
-    assert Date(dt_today_utc).date.tzinfo == pytz.utc
+    assert Date(dt_today_utc).date.tzinfo is utils.UTC
 
     # UTC using 'T' instead of ' ' (space) between date and time
     dt_today_utc = '2015-01-01T00:00:00.000 +0000'
@@ -207,6 +261,25 @@ def test_Date_type_handling():
     assert _DT == dt_today_noon_cet_as_utc
 
 
+def test_parse_date():
+    from idid.utils import parse_date, UTC
+    from dateutil.parser import parse
+
+    for text in ['2015-10-21', '2015-10-21T07:28:00', '2015-10-21 07:28',
+                 '2015-10-21T07:28:00.5', '2015-10-21T07:28:00.123 -05:30',
+                 '2015-10-21T07:28:00Z', '2015-10-21 23:28:00+0230']:
+        expected = parse(text)
+        if expected.tzinfo:
+            expected = expected.astimezone(UTC)
+        assert parse_date(text) == expected
+
+    # cheap reject of journal names and records; words are still dates
+    for bad in ['joy', 'project_x', 'idid joy test', '2015-13-01']:
+        with pytest.raises(ValueError):
+            parse_date(bad)
+    assert parse_date('may').month == 5
+
+
 def test_Date_format():
     from idid.utils import Date
 
@@ -243,3 +316,47 @@ def test_Date_format():
     # specify timezone
     iso = '%Y-%m-%d %H:%M:%S %z'
     assert unicode(Date(dtz_cet, fmt=iso)) == dtz_cet_utc
+
+
+def test_Date_ordering():
+    from idid.utils import Date
+
+    one, two = Date('2015-01-01'), Date('2015-01-02', fmt='%Y')
+    assert one < two and two > one and one != two
+    # the output format doesn't matter
+    assert Date('2015-01-01', fmt='%Y') == one
+    assert len(set([one, Date('2015-01-01'), two])) == 2
+    assert sorted([two, one]) == [one, two]
+    assert two.day - one.day == 1
+
+
+def test_Date_period():
+    from idid.utils import Date, today
+
+    day = today().date()
+    since, until, period = Date.period('week')
+    assert period == 'week'
+    assert since.date.weekday() == 0
+    assert (until.date - since.date).days == 6
+    assert since.date.date() <= day <= until.date.date()
+
+    since, until, period = Date.period(['last', 'month'])
+    assert period == 'last month'
+    assert since.date.day == 1
+    assert until.date.month == since.date.month
+    assert (until.date + timedelta(days=1)).day == 1
+
+    since, until, period = Date.period('quarter')
+    assert since.date.month in (1, 4, 7, 10)
+    assert (until.date.month - since.date.month) == 2
+
+    since, until, period = Date.period('last year')
+    assert unicode(since) == '{0}-01-01'.format(day.year - 1)
+    assert unicode(until) == '{0}-12-31'.format(day.year - 1)
+
+    since, until, period = Date.period('yesterday')
+    assert since.date == until.date
+    assert (day - since.date.date()).days == 1
+
+    with pytest.raises(ValueError):
+        Date.period('fortnight')